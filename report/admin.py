@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import ReportDefinition
+from .models import ReportDefinition, ReportSchedule
 
 admin.site.register(ReportDefinition)
+admin.site.register(ReportSchedule)
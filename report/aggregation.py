@@ -0,0 +1,200 @@
+"""
+Aggregations for the python_query implementations, over the results of run_stored_proc_report (list of dicts or,
+faster, ColumnarResult). For example the claims and amounts per district of a procedure result:
+
+    rows = run_stored_proc_report("uspSSRSClaims", columnar=True, ...)
+    per_district = group_by(rows, ["DistrictName"], {"claims": ("count", None), "amount": ("sum", "Amount")})
+
+As in SQL, null values are ignored by sum, count of a column, avg, min and max. The numeric columns stored as
+arrays by ColumnarResult are aggregated with NumPy when it is installed (the "aggregation" extra), the other columns
+and installations without NumPy use plain Python.
+"""
+from array import array
+
+from .columnar import ColumnarResult
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SUM = "sum"
+COUNT = "count"
+AVG = "avg"
+MIN = "min"
+MAX = "max"
+AGGREGATES = (SUM, COUNT, AVG, MIN, MAX)
+
+
+def as_columnar(rows):
+    return rows if isinstance(rows, ColumnarResult) else ColumnarResult.from_rows(rows)
+
+
+def _column(result, name):
+    # an empty list of dicts has no columns
+    return result.column(name) if len(result) else []
+
+
+def _with_column(result, name, values):
+    columns = result.columns + (name,)
+    return ColumnarResult(columns, [result.column(column) for column in result.columns] + [values])
+
+
+def _group_codes(result, keys):
+    """
+    :return: tuple (distinct key tuples in order of first appearance, group index of each row)
+    """
+    if not keys:
+        return [()], array("q", [0]) * len(result)
+    groups = {}
+    if len(keys) == 1:
+        codes = [groups.setdefault(key, len(groups)) for key in _column(result, keys[0])]
+        return [(key,) for key in groups], array("q", codes)
+    codes = [groups.setdefault(key, len(groups)) for key in zip(*(_column(result, k) for k in keys))]
+    return list(groups), array("q", codes)
+
+
+def _numpy_aggregate(func, values, codes, size):
+    np_codes = numpy.frombuffer(codes, dtype=numpy.int64)
+    counts = numpy.bincount(np_codes, minlength=size)
+    if func == COUNT:
+        return counts.tolist()
+    np_values = numpy.frombuffer(values, dtype=numpy.int64 if values.typecode == "q" else numpy.float64)
+    if func == AVG:
+        return (numpy.bincount(np_codes, weights=np_values, minlength=size) / counts).tolist()
+    if func == SUM:
+        out = numpy.zeros(size, dtype=np_values.dtype)
+        numpy.add.at(out, np_codes, np_values)
+    else:
+        out = numpy.full(size, np_values.max() if func == MIN else np_values.min(), dtype=np_values.dtype)
+        (numpy.minimum if func == MIN else numpy.maximum).at(out, np_codes, np_values)
+    return out.tolist()
+
+
+def _python_aggregate(func, values, codes, size):
+    if func in (SUM, COUNT) and isinstance(values, array):
+        # numeric column without null values, every group has at least one row
+        totals = [0] * size
+        for code, value in zip(codes, values if func == SUM else [1] * len(codes)):
+            totals[code] += value
+        return totals
+    counts = [0] * size
+    totals = [None] * size
+    for code, value in zip(codes, values):
+        if value is None:
+            continue
+        counts[code] += 1
+        current = totals[code]
+        if current is None:
+            totals[code] = value
+        elif func in (SUM, AVG):
+            totals[code] = current + value
+        elif (value < current) if func == MIN else (value > current):
+            totals[code] = value
+    if func == COUNT:
+        return counts
+    if func == AVG:
+        return [None if total is None else total / n for total, n in zip(totals, counts)]
+    return totals
+
+
+def _aggregate(func, values, codes, size):
+    if func not in AGGREGATES:
+        raise ValueError(f"unknown aggregate {func}")
+    if numpy is not None and isinstance(values, array) and len(values):
+        return _numpy_aggregate(func, values, codes, size)
+    return _python_aggregate(func, values, codes, size)
+
+
+def group_by(rows, keys, aggregations):
+    """
+    :param rows: list of dict or ColumnarResult
+    :param keys: columns to group on, the groups are in order of first appearance. No keys gives a single row.
+    :param aggregations: dict of output column name to (aggregate, column), column None with count counts the rows
+    :return: a ColumnarResult with the key columns and the aggregated columns
+    """
+    result = as_columnar(rows)
+    groups, codes = _group_codes(result, keys)
+    data = [list(values) for values in zip(*groups)] if keys else []
+    if keys and not groups:
+        data = [[] for _ in keys]
+    for func, column in aggregations.values():
+        if column is None:
+            if func != COUNT:
+                raise ValueError(f"{func} requires a column")
+            data.append(_aggregate(COUNT, codes, codes, len(groups)))
+        else:
+            data.append(_aggregate(func, _column(result, column), codes, len(groups)))
+    return ColumnarResult(list(keys) + list(aggregations), data)
+
+
+def total(rows, column, func=SUM):
+    """
+    :return: a single aggregate of a column, None for an empty result (0 for count)
+    """
+    result = as_columnar(rows)
+    if not len(result):
+        return 0 if func == COUNT else None
+    return group_by(result, [], {"total": (func, column)}).column("total")[0]
+
+
+def pivot(rows, index, columns, values, func=SUM, fill=None):
+    """
+    Spreads the distinct values of the columns column into columns (named by the str of the value), for example
+    the amount per district (rows) and per month (columns)
+    :param index: columns identifying a row of the pivot
+    :param fill: value of the cells without data
+    :return: a ColumnarResult with the index columns then one column per distinct value, in order of appearance
+    """
+    index = list(index)
+    grouped = group_by(rows, index + [columns], {"value": (func, values)})
+    rows_index = {}
+    pivot_values = {}
+    cells = {}
+    for row in grouped:
+        key = tuple(row[k] for k in index)
+        row_number = rows_index.setdefault(key, len(rows_index))
+        pivot_values.setdefault(row[columns], len(pivot_values))
+        cells[(row_number, row[columns])] = row["value"]
+    data = [list(values) for values in zip(*rows_index)] if rows_index else [[] for _ in index]
+    for pivot_value in pivot_values:
+        data.append([cells.get((row_number, pivot_value), fill) for row_number in range(len(rows_index))])
+    return ColumnarResult(index + [str(v) for v in pivot_values], data)
+
+
+def running_total(rows, column, name=None, partition_by=None):
+    """
+    Adds the cumulated sum of a column, restarting for each distinct value of the partition_by columns
+    :param name: name of the added column, defaults to "<column>_running_total"
+    """
+    result = as_columnar(rows)
+    values = _column(result, column)
+    if not partition_by and numpy is not None and isinstance(values, array) and len(values):
+        np_values = numpy.frombuffer(values, dtype=numpy.int64 if values.typecode == "q" else numpy.float64)
+        cumulated = numpy.cumsum(np_values).tolist()
+    else:
+        _, codes = _group_codes(result, partition_by or [])
+        totals = {}
+        cumulated = []
+        for code, value in zip(codes, values):
+            if value is not None:
+                totals[code] = totals.get(code, 0) + value
+            cumulated.append(totals.get(code))
+    return _with_column(result, name or f"{column}_running_total", cumulated)
+
+
+def percentage(rows, column, name=None, partition_by=None):
+    """
+    Adds the share (0-100) of each value of a column in the total of its partition (or of the whole result)
+    :param name: name of the added column, defaults to "<column>_percentage"
+    """
+    result = as_columnar(rows)
+    keys = list(partition_by or [])
+    groups, codes = _group_codes(result, keys)
+    values = _column(result, column)
+    totals = _aggregate(SUM, values, codes, len(groups))
+    shares = [
+        None if value is None or not totals[code] else value * 100 / totals[code]
+        for code, value in zip(codes, values)
+    ]
+    return _with_column(result, name or f"{column}_percentage", shares)
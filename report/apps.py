@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 from django.apps import AppConfig
 from openIMIS.openimisapps import openimis_apps
 
@@ -35,7 +38,63 @@ DEFAULT_CFG = {
     "gql_reports_claim_history_report_perms": ["131223"],
     "gql_mutation_report_add_perms": ["131224"],
     "gql_mutation_report_edit_perms": ["131225"],
-    "gql_mutation_report_delete_perms": ["131226"]
+    "gql_mutation_report_delete_perms": ["131226"],
+    "report_definition_cache_size": 64,
+    "report_definition_cache_ttl": 300,
+    "report_job_backend": "thread",  # thread or celery
+    "report_job_workers": 2,
+    "report_job_output_dir": "",  # defaults to a directory in the system temp dir
+    "report_job_output_ttl": 24 * 3600,  # seconds the job outputs can be downloaded
+    "report_job_output_max_bytes": 1024 * 1024 * 1024,
+    "report_job_timeout": 3600,  # seconds after which a job still running is considered lost and failed
+    "report_output_cache_ttl": 0,  # seconds, 0 disables the generated reports cache
+    "report_output_cache_max_bytes": 512 * 1024 * 1024,
+    "report_output_cache_dir": "",  # defaults to a directory in the system temp dir
+    "report_output_cache_backend": "",  # Django cache alias to use instead of the local directory
+    "report_output_cache_scope": "user",  # user or rights, see report.output_cache.permission_scope
+    "report_lazy_discovery": True,  # use the modules report_manifest when available, see report.registry
+    "report_render_max_concurrent": 4,  # reports rendered at the same time by a process
+    "report_render_max_queue": 20,  # renders waiting for a slot, above that the requests get a 503
+    "report_render_max_per_report": 2,
+    "report_render_max_per_user": 2,  # renders running or waiting for a user, above that the requests get a 429
+    "report_render_queue_timeout": 60,  # seconds
+    "report_render_retry_after": 30,  # seconds, Retry-After of the 429/503 responses
+    "report_render_heavy_reports": ["claim_history"],  # rendered after the other reports
+    "report_render_mode": "thread",  # thread (in the web worker) or process (in a pool of render processes)
+    "report_render_processes": 2,  # per web process, gunicorn workers x this value render processes in total
+    "report_render_max_jobs_per_worker": 50,  # render processes are recycled after that number of jobs
+    "report_render_max_worker_memory_mb": 1024,  # or when their peak RSS goes above this ceiling
+    "report_render_start_method": "spawn",
+    "report_render_output_dir": "",  # temporary files used to return the outputs, defaults to the system temp dir
+    # PDF reports rendered by slices of their table band: report name to the data source of the table (without ${})
+    "report_chunked_reports": {},
+    "report_chunk_rows": 20000,  # rows of the table band rendered at once
+    "report_chunk_workers": 1,  # slices rendered in parallel, only useful with the process render mode
+    # stored procedure name to the seconds its results are cached (see report.query_cache), not cached if absent
+    "report_query_cache_ttls": {},
+    "report_query_cache_max_bytes": 128 * 1024 * 1024,
+    # the results are cached per process, invalidations reach the other processes through this Django cache alias:
+    # it must be shared (Redis, Memcached...) for that, "" to only invalidate in the calling process
+    "report_query_cache_backend": "default",
+    # formats sent gzip/br compressed to the clients accepting it, xlsx files are already zip archives
+    "report_compressed_formats": ["csv"],
+    # database alias of the report queries (a read replica...), the default database if empty or unavailable
+    "report_database": "",
+    "report_database_overrides": {},  # report name to database alias
+    "report_statement_timeout": 0,  # seconds, 0 for no timeout
+    "report_statement_timeouts": {},  # report name to seconds
+    "report_preview_ttl": 3600,  # seconds the designer previews are kept
+    "report_preview_max_bytes": 256 * 1024 * 1024,
+    "report_preview_dir": "",  # defaults to a directory in the system temp dir
+    "report_metrics_exporter": False,  # expose the Prometheus metrics of the reports on report/metrics
+    "report_metrics_perms": ["131200"],  # rights required to read report/metrics (authenticated like the API)
+    "report_batch_workers": 4,  # parameter sets generated in parallel by a batch
+    "report_batch_max_size": 500,  # parameter sets accepted by a batch
+    # seconds the scheduled outputs are served, 0 disables the report schedules (no lookup on the report requests)
+    "report_schedule_output_ttl": 0,
+    "report_schedule_output_max_bytes": 1024 * 1024 * 1024,
+    "report_schedule_output_dir": "",  # defaults to a directory in the system temp dir
+    "report_snapshot_max_age": 7 * 24 * 3600,  # seconds a snapshot is reused and kept, 0 for no limit
 }
 
 
@@ -70,8 +129,59 @@ class ReportConfig(AppConfig):
     gql_reports_control_number_assignment_perms = []
     gql_reports_overview_of_commissions_perms = []
     gql_reports_claim_history_report_perms = []
+    report_definition_cache_size = 64
+    report_definition_cache_ttl = 300
+    report_job_backend = "thread"
+    report_job_workers = 2
+    report_job_output_dir = ""
+    report_job_output_ttl = 24 * 3600
+    report_job_output_max_bytes = 1024 * 1024 * 1024
+    report_job_timeout = 3600
+    report_output_cache_ttl = 0
+    report_output_cache_max_bytes = 512 * 1024 * 1024
+    report_output_cache_dir = ""
+    report_output_cache_backend = ""
+    report_output_cache_scope = "user"
+    report_lazy_discovery = True
+    report_render_max_concurrent = 4
+    report_render_max_queue = 20
+    report_render_max_per_report = 2
+    report_render_max_per_user = 2
+    report_render_queue_timeout = 60
+    report_render_retry_after = 30
+    report_render_heavy_reports = ["claim_history"]
+    report_render_mode = "thread"
+    report_render_processes = 2
+    report_render_max_jobs_per_worker = 50
+    report_render_max_worker_memory_mb = 1024
+    report_render_start_method = "spawn"
+    report_render_output_dir = ""
+    report_chunked_reports = {}
+    report_chunk_rows = 20000
+    report_chunk_workers = 1
+    report_query_cache_ttls = {}
+    report_query_cache_max_bytes = 128 * 1024 * 1024
+    report_query_cache_backend = "default"
+    report_compressed_formats = ["csv"]
+    report_database = ""
+    report_database_overrides = {}
+    report_statement_timeout = 0
+    report_statement_timeouts = {}
+    report_preview_ttl = 3600
+    report_preview_max_bytes = 256 * 1024 * 1024
+    report_preview_dir = ""
+    report_metrics_exporter = False
+    report_metrics_perms = ["131200"]
+    report_batch_workers = 4
+    report_batch_max_size = 500
+    report_schedule_output_ttl = 0
+    report_schedule_output_max_bytes = 1024 * 1024 * 1024
+    report_schedule_output_dir = ""
+    report_snapshot_max_age = 7 * 24 * 3600
 
     reports = []
+    reports_by_name = {}
+    reports_by_permission = {}
 
     def __load_config(self, cfg):
         for field in cfg:
@@ -80,10 +190,42 @@ class ReportConfig(AppConfig):
 
     @classmethod
     def get_report(cls, report_name):
+        return cls.reports_by_name.get(report_name)
+
+    @classmethod
+    def index_reports(cls):
+        """
+        Builds the name and permission indexes of the loaded reports. When several modules register the same
+        report name, the first one is kept.
+        """
+        reports_by_name = {}
+        reports_by_permission = {}
         for report in cls.reports:
-            if report["name"] == report_name:
-                return report
-        return None
+            name = report["name"]
+            if name in reports_by_name:
+                logger.warning(f"duplicate report name {name}, only the first definition is used")
+                continue
+            reports_by_name[name] = report
+            permission = tuple(report.get("permission") or ())
+            reports_by_permission.setdefault(permission, []).append(name)
+        cls.reports_by_name = reports_by_name
+        cls.reports_by_permission = reports_by_permission
+
+    @classmethod
+    def get_allowed_reports(cls, user, request=None):
+        """
+        Reports the user has the permission to run, checking each distinct permission only once.
+        The result is kept on the request (if given) for the other calls of the same request.
+        """
+        allowed = getattr(request, "_report_allowed_reports", None) if request is not None else None
+        if allowed is None:
+            allowed = set()
+            for permission, names in cls.reports_by_permission.items():
+                if not permission or user.has_perms(permission):
+                    allowed.update(names)
+            if request is not None:
+                request._report_allowed_reports = allowed
+        return [report for name, report in cls.reports_by_name.items() if name in allowed]
 
     def ready(self):
         from core.models import ModuleConfiguration
@@ -91,9 +233,90 @@ class ReportConfig(AppConfig):
         cfg = ModuleConfiguration.get_or_default(MODULE_NAME, DEFAULT_CFG)
         self.__load_config(cfg)
 
+        from .fonts import FontRegistry
+
+        FontRegistry.load()
+
+        from . import signals  # noqa: F401
+        from .services import report_definition_cache
+
+        report_definition_cache.configure(self.report_definition_cache_size, self.report_definition_cache_ttl)
+
+        from .query_cache import query_cache
+
+        query_cache.configure(
+            self.report_query_cache_ttls, self.report_query_cache_max_bytes, backend=self.report_query_cache_backend
+        )
+
+        from .output_cache import job_output_store, precomputed_outputs, preview_store, report_output_cache
+
+        job_output_store.configure(
+            self.report_job_output_dir or job_output_store.directory,
+            self.report_job_output_max_bytes,
+            self.report_job_output_ttl,
+        )
+        if self.report_preview_dir:
+            preview_store.configure(self.report_preview_dir, self.report_preview_max_bytes, self.report_preview_ttl)
+        else:
+            preview_store.configure(preview_store.directory, self.report_preview_max_bytes, self.report_preview_ttl)
+        report_output_cache.configure(
+            self.report_output_cache_ttl,
+            self.report_output_cache_max_bytes,
+            directory=self.report_output_cache_dir,
+            backend=self.report_output_cache_backend,
+            scope=self.report_output_cache_scope,
+        )
+        precomputed_outputs.configure(
+            self.report_schedule_output_ttl,
+            self.report_schedule_output_max_bytes,
+            directory=self.report_schedule_output_dir or os.path.join(
+                tempfile.gettempdir(), "openimis-report-precomputed"
+            ),
+            backend=self.report_output_cache_backend,
+            scope=self.report_output_cache_scope,
+        )
+
+        from .scheduler import render_scheduler
+
+        render_scheduler.configure(
+            self.report_render_max_concurrent,
+            self.report_render_max_queue,
+            self.report_render_max_per_report,
+            self.report_render_max_per_user,
+            self.report_render_queue_timeout,
+            self.report_render_retry_after,
+            heavy_reports=self.report_render_heavy_reports,
+        )
+
+        if self.report_chunked_reports:
+            try:
+                import pypdf  # noqa: F401
+            except ImportError:
+                logger.error("report_chunked_reports requires the pypdf package, the reports won't be chunked")
+                ReportConfig.report_chunked_reports = {}
+
+        from .render_pool import render_pool
+
+        render_pool.configure(
+            self.report_render_mode,
+            self.report_render_processes,
+            self.report_render_max_jobs_per_worker,
+            self.report_render_max_worker_memory_mb,
+            start_method=self.report_render_start_method,
+            output_dir=self.report_render_output_dir,
+        )
+
+        from .registry import load_report_manifest
+
         all_apps = openimis_apps()
 
         for app in all_apps:
+            if self.report_lazy_discovery:
+                manifest = load_report_manifest(app)
+                if manifest is not None:
+                    self.reports += manifest
+                    logger.debug(f"{app} {len(manifest)} reports registered from manifest")
+                    continue
             try:
                 appreports = __import__(f"{app}.report")
                 if hasattr(appreports.report, "report_definitions") and isinstance(
@@ -110,4 +333,5 @@ class ReportConfig(AppConfig):
                 raise  # This can be hiding actual compilation errors
             except Exception as exc:
                 logger.debug(f"{app} exception", exc)
+        self.index_reports()
         logger.debug("done loading reports")
@@ -0,0 +1,168 @@
+import io
+import logging
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.db import connections
+from reportbro import ReportBroError
+
+from .apps import ReportConfig
+from .export import report_extension
+from .routing import report_database
+from .scheduler import render_scheduler
+from .services import generate_report, get_compiled_report_definition
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_ZIP = "zip"
+OUTPUT_MERGED_PDF = "pdf"
+
+
+class BatchReportService(object):
+    """
+    Generates the same report for many parameter sets (every district, every health facility...) in one call.
+    The definition is loaded once and the parameter sets are run in parallel by a thread pool, each thread running
+    the query and the render (which can itself go to the render process pool) in a render_scheduler slot, like the
+    single reports. The pool is no larger than the renders the scheduler lets a user run at once.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def _run(self, report_config, definition, report_format, params):
+        try:
+            with render_scheduler.slot(report_config, self.user.id):
+                with report_database(report_config["name"]):
+                    data = report_config["python_query"](self.user, **params)
+                output = generate_report(report_config["name"], definition, data, report_format)
+                # the streamed formats (csv, xlsx-stream) return an iterable of chunks
+                return output if isinstance(output, (bytes, bytearray)) else b"".join(output)
+        finally:
+            connections.close_all()
+
+    def iter_outputs(self, report_config, report_format, parameter_sets):
+        """
+        Yields (index, parameters, output or None, error or None) in the order of the parameter sets,
+        each output as soon as it and the previous ones are generated. Only as many parameter sets as there are
+        workers are submitted ahead, the pending ones are cancelled when the generator is closed (client gone).
+        """
+        definition = get_compiled_report_definition(report_config["name"], report_config["default_report"])
+        workers = ReportConfig.report_batch_workers
+        if render_scheduler.max_per_user:
+            workers = min(workers, render_scheduler.max_per_user)
+        workers = max(workers, 1)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-batch")
+        remaining = enumerate(parameter_sets)
+        pending = deque()
+
+        def submit(count):
+            for index, params in islice(remaining, count):
+                future = executor.submit(self._run, report_config, definition, report_format, params)
+                pending.append((index, params, future))
+
+        try:
+            submit(workers)
+            while pending:
+                index, params, future = pending.popleft()
+                try:
+                    output, error = future.result(), None
+                except Exception as exc:
+                    logger.exception(f"batch report {report_config['name']} failed for {params}")
+                    output, error = None, getattr(exc, "error", None) or str(exc)
+                # keeps the workers busy while the output is consumed
+                submit(1)
+                yield index, params, output, error
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_zip(self, report_config, report_format, parameter_sets):
+        """
+        Yields the ZIP archive by chunks while the reports are generated, failed parameter sets get an .error.txt
+        """
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for index, params, output, error in self.iter_outputs(report_config, report_format, parameter_sets):
+                filename = batch_filename(report_config["name"], index, params)
+                if error:
+                    archive.writestr(f"{filename}.error.txt", error)
+                else:
+                    archive.writestr(f"{filename}.{report_extension(report_format)}", output)
+                yield stream.pop()
+        yield stream.pop()
+
+    def merged_pdf(self, report_config, parameter_sets):
+        outputs = []
+        for index, params, output, error in self.iter_outputs(report_config, "pdf", parameter_sets):
+            if error:
+                raise ReportBroError(f"parameter set {index + 1}: {error}")
+            outputs.append(output)
+        return merge_pdfs(outputs)
+
+
+class _ZipStream(object):
+    """
+    Write-only, non seekable buffer: zipfile then writes data descriptors and the archive can be streamed
+    """
+
+    def __init__(self):
+        self._buffer = io.BytesIO()
+
+    def write(self, data):
+        return self._buffer.write(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def batch_filename(report_name, index, params):
+    values = "_".join(f"{k}-{v}" for k, v in sorted(params.items()))
+    values = re.sub(r"[^\w.-]+", "", values)[:100]
+    return f"{report_name}_{index + 1:04d}" + (f"_{values}" if values else "")
+
+
+def _pypdf():
+    try:
+        import pypdf
+    except ImportError:
+        raise ReportBroError("merging PDF reports requires the pypdf package")
+    return pypdf
+
+
+def _pdf_source(output):
+    return io.BytesIO(output) if isinstance(output, (bytes, bytearray)) else output
+
+
+def pdf_page_count(output):
+    """
+    :param output: PDF document, as bytes or file path
+    """
+    return len(_pypdf().PdfReader(_pdf_source(output)).pages)
+
+
+def merge_pdfs(outputs, local_file=''):
+    """
+    Concatenates PDF documents (as bytes or file paths), requires the optional pypdf dependency
+    :return: the merged document or None if local_file is set
+    """
+    pypdf = _pypdf()
+    writer = pypdf.PdfWriter()
+    for output in outputs:
+        for page in pypdf.PdfReader(_pdf_source(output)).pages:
+            writer.add_page(page)
+    if local_file:
+        writer.write(local_file)
+        return None
+    merged = io.BytesIO()
+    writer.write(merged)
+    return merged.getvalue()
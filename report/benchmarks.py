@@ -0,0 +1,384 @@
+"""
+Micro benchmarks of the report pipeline, run them with: python manage.py report_benchmark <name>
+Every benchmark returns a JSON serializable dict.
+"""
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+
+def _stats(timings):
+    return {
+        "iterations": len(timings),
+        "min_ms": round(min(timings) * 1000, 3),
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+        "max_ms": round(max(timings) * 1000, 3),
+    }
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def benchmark_definition_cache(report_name="claim_overview", iterations=100, **kwargs):
+    """
+    Cold (empty cache) and warm latency of the report definition loading
+    """
+    from .apps import ReportConfig
+    from .services import get_compiled_report_definition, report_definition_cache
+
+    report_config = ReportConfig.get_report(report_name)
+    default = report_config["default_report"] if report_config else None
+
+    def load():
+        get_compiled_report_definition(report_name, default)
+
+    cold = []
+    for _ in range(iterations):
+        report_definition_cache.clear()
+        cold.append(_timed(load))
+    warm = [_timed(load) for _ in range(iterations)]
+    return {"report": report_name, "cold": _stats(cold), "warm": _stats(warm)}
+
+
+SYNTHETIC_COLUMNS = (
+    ("LocationId", "number"),
+    ("HFCode", "string"),
+    ("HFName", "string"),
+    ("ClaimCount", "number"),
+    ("Amount", "number"),
+    ("ClaimDate", "string"),
+)
+
+
+def synthetic_row(i):
+    return (i % 150, f"HF{i % 2000:05d}", f"Health facility {i % 2000}", i % 37, i * 1.5, "2023-01-31")
+
+
+def synthetic_rows(count):
+    """
+    Generates rows shaped like the results of the uspSSRS* procedures, as dicts
+    """
+    names = tuple(name for name, _ in SYNTHETIC_COLUMNS)
+    for i in range(count):
+        yield dict(zip(names, synthetic_row(i)))
+
+
+class SyntheticCursor(object):
+    """
+    DB-API cursor returning generated rows, the rows are only built when fetched
+    """
+
+    description = tuple((name,) for name, _ in SYNTHETIC_COLUMNS)
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.position = 0
+
+    def _row(self, i):
+        return synthetic_row(i)
+
+    def fetchmany(self, size=1):
+        end = min(self.position + size, self.rows)
+        rows = [self._row(i) for i in range(self.position, end)]
+        self.position = end
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(self.rows - self.position)
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_mb": round(peak / 1024 / 1024, 2), "seconds": round(time.perf_counter() - start, 3)}
+
+
+def benchmark_row_fetch(rows=1000000, **kwargs):
+    """
+    Peak memory of fetching a large stored procedure result with fetchall() vs streaming it by batches
+    """
+    from .services import ROW_TYPES, StreamedRows, _dictfetchall
+
+    result = {"rows": rows, "fetchall_dict": _peak_memory(lambda: _dictfetchall(SyntheticCursor(rows)))}
+    for row_type in ROW_TYPES:
+        streamed = StreamedRows(lambda: nullcontext(SyntheticCursor(rows)), row_type=row_type)
+        result[f"stream_{row_type}"] = _peak_memory(lambda: sum(1 for _ in streamed))
+    return result
+
+
+def _retained_memory(build):
+    """
+    Memory still allocated by the object build() returns, and the peak while building it
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = build()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return {
+        "retained_mb": round(current / 1024 / 1024, 2),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def benchmark_columnar(rows=500000, **kwargs):
+    """
+    Memory of a stored procedure result held as a list of dicts vs a ColumnarResult, and the cost of iterating it
+    """
+    from .columnar import ColumnarResult
+    from .services import _dictfetchall
+
+    def iterate(result):
+        return _timed(lambda: sum(row["ClaimCount"] for row in result))
+
+    dicts = _dictfetchall(SyntheticCursor(rows))
+    columnar = ColumnarResult.from_cursor(SyntheticCursor(rows))
+    result = {
+        "rows": rows,
+        "dict": _retained_memory(lambda: _dictfetchall(SyntheticCursor(rows))),
+        "columnar": _retained_memory(lambda: ColumnarResult.from_cursor(SyntheticCursor(rows))),
+        "iterate_dict_ms": round(iterate(dicts) * 1000, 1),
+        "iterate_columnar_ms": round(iterate(columnar) * 1000, 1),
+    }
+    result["saved_mb"] = round(result["dict"]["retained_mb"] - result["columnar"]["retained_mb"], 2)
+    return result
+
+
+def benchmark_aggregation(rows=500000, iterations=5, **kwargs):
+    """
+    Claim count and amount per health facility, with the hand-written loop most module reports use vs the
+    report.aggregation helpers (with and without NumPy)
+    """
+    from . import aggregation
+    from .columnar import ColumnarResult
+    from .services import _dictfetchall
+
+    dicts = _dictfetchall(SyntheticCursor(rows))
+    columnar = ColumnarResult.from_cursor(SyntheticCursor(rows))
+
+    def hand_loop():
+        totals = {}
+        for row in dicts:
+            total = totals.setdefault(row["HFCode"], {"HFCode": row["HFCode"], "claims": 0, "amount": 0})
+            total["claims"] += row["ClaimCount"]
+            total["amount"] += row["Amount"]
+        return list(totals.values())
+
+    def helpers():
+        return aggregation.group_by(
+            columnar, ["HFCode"], {"claims": ("sum", "ClaimCount"), "amount": ("sum", "Amount")}
+        )
+
+    result = {
+        "rows": rows,
+        "numpy": aggregation.numpy is not None,
+        "hand_loop": _stats([_timed(hand_loop) for _ in range(iterations)]),
+        "group_by": _stats([_timed(helpers) for _ in range(iterations)]),
+    }
+    numpy, aggregation.numpy = aggregation.numpy, None
+    try:
+        result["group_by_python"] = _stats([_timed(helpers) for _ in range(iterations)])
+    finally:
+        aggregation.numpy = numpy
+    return result
+
+
+def _text_cell(element_id, content, width, pattern="", bold=False):
+    return {
+        "elementType": "table_text",
+        "id": element_id,
+        "width": width,
+        "content": content,
+        "eval": False,
+        "bold": bold,
+        "font": "helvetica",
+        "fontSize": 8,
+        "pattern": pattern,
+        "horizontalAlignment": "left",
+        "verticalAlignment": "middle",
+        "paddingLeft": 2,
+        "paddingTop": 2,
+        "paddingRight": 2,
+        "paddingBottom": 2,
+    }
+
+
+def synthetic_table_definition():
+    """
+    Report definition with a single table band over the SYNTHETIC_COLUMNS, like most of the module reports
+    """
+    width = 575 // len(SYNTHETIC_COLUMNS)
+    return {
+        "docElements": [
+            {
+                "elementType": "table",
+                "id": 1,
+                "containerId": "0_content",
+                "x": 0,
+                "y": 0,
+                "width": width * len(SYNTHETIC_COLUMNS),
+                "height": 40,
+                "dataSource": "${rows}",
+                "columns": len(SYNTHETIC_COLUMNS),
+                "header": True,
+                "footer": False,
+                "border": "grid",
+                "borderColor": "#000000",
+                "borderWidth": 1,
+                "headerData": {
+                    "elementType": "table_band",
+                    "id": 2,
+                    "height": 20,
+                    "repeatHeader": True,
+                    "columnData": [
+                        _text_cell(10 + i, name, width, bold=True) for i, (name, _) in enumerate(SYNTHETIC_COLUMNS)
+                    ],
+                },
+                "contentDataRows": [
+                    {
+                        "elementType": "table_band",
+                        "id": 3,
+                        "height": 20,
+                        "columnData": [
+                            _text_cell(20 + i, "${%s}" % name, width, pattern="#,##0.00" if kind == "number" else "")
+                            for i, (name, kind) in enumerate(SYNTHETIC_COLUMNS)
+                        ],
+                    }
+                ],
+            }
+        ],
+        "parameters": [
+            {
+                "id": 100,
+                "name": "rows",
+                "type": "array",
+                "eval": False,
+                "nullable": False,
+                "children": [
+                    {"id": 101 + i, "name": name, "type": kind, "eval": False, "nullable": True}
+                    for i, (name, kind) in enumerate(SYNTHETIC_COLUMNS)
+                ],
+            }
+        ],
+        "styles": [],
+        "documentProperties": {
+            "pageFormat": "A4",
+            "unit": "mm",
+            "orientation": "portrait",
+            "marginLeft": "10",
+            "marginTop": "10",
+            "marginRight": "10",
+            "marginBottom": "10",
+            "header": False,
+            "footer": False,
+            "patternLocale": "en",
+        },
+        # current ReportBro definition version, older ones are migrated (contentData to contentDataRows...)
+        "version": 6,
+    }
+
+
+RENDER_CASES = {
+    "default_report": lambda rows: {"report_name": "benchmark", "data_dump": json.dumps(rows)},
+    "table": lambda rows: {"rows": rows},
+}
+
+
+def benchmark_render(sizes=(1000, 10000, 100000), formats=("pdf", "xlsx"), baseline=None, **kwargs):
+    """
+    Renders default_report (the fallback used when a report has no definition) and a table report with synthetic
+    rows, without database. Records the wall time and peak memory (both measured under tracemalloc) and the output
+    size of each case. Pass the JSON of a previous run as baseline to get the ratios against it.
+    """
+    from .default_report import default_report
+    from .services import render_report
+
+    definitions = {"default_report": default_report, "table": synthetic_table_definition()}
+    previous = {
+        (r["case"], r["rows"], r["format"]): r for r in (baseline or {}).get("results", [])
+    }
+    results = []
+    for case, make_data in RENDER_CASES.items():
+        for size in sizes:
+            data = make_data(list(synthetic_rows(size)))
+            for report_format in formats:
+                output = []
+                measure = _peak_memory(
+                    lambda: output.append(render_report(f"benchmark_{case}", definitions[case], data, report_format))
+                )
+                result = {"case": case, "rows": size, "format": report_format, **measure,
+                          "output_bytes": len(output[0] or b"")}
+                reference = previous.get((case, size, report_format))
+                if reference:
+                    result["seconds_ratio"] = round(result["seconds"] / reference["seconds"], 3)
+                    result["peak_mb_ratio"] = round(result["peak_mb"] / reference["peak_mb"], 3)
+                results.append(result)
+    return {"results": results}
+
+
+_DISCOVERY_SCRIPT = """
+import json, time
+import django
+start = time.perf_counter()
+django.setup()
+setup = time.perf_counter() - start
+from report.apps import ReportConfig
+from report.registry import LazyReport
+lazy = [r for r in ReportConfig.reports if isinstance(r, LazyReport)]
+start = time.perf_counter()
+for r in lazy:
+    r.get("python_query")
+print(json.dumps({"setup_seconds": setup, "reports": len(ReportConfig.reports), "lazy_reports": len(lazy),
+                  "deferred_import_seconds": time.perf_counter() - start}))
+"""
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)")
+_REPORT_MODULE_RE = re.compile(r"^\w+\.report(_manifest)?$")
+
+
+def benchmark_report_discovery(**kwargs):
+    """
+    Startup cost of the report discovery, measured with python -X importtime in a fresh interpreter
+    (DJANGO_SETTINGS_MODULE must be set). report_modules_us is the cumulative import time of the {app}.report and
+    {app}.report_manifest modules during django.setup(), deferred_import_seconds the time spent later to import
+    the reports registered from a manifest.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _DISCOVERY_SCRIPT], capture_output=True, text=True, check=True
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    modules = {}
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_RE.search(line)
+        if match and _REPORT_MODULE_RE.match(match.group(3)):
+            modules[match.group(3)] = int(match.group(2))
+    result["report_modules_us"] = sum(modules.values())
+    result["report_modules"] = modules
+    return result
+
+
+BENCHMARKS = {
+    "definition_cache": benchmark_definition_cache,
+    "row_fetch": benchmark_row_fetch,
+    "columnar": benchmark_columnar,
+    "aggregation": benchmark_aggregation,
+    "report_discovery": benchmark_report_discovery,
+    "render": benchmark_render,
+}
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Small thread-safe in-process LRU cache with an optional time to live (in seconds) on the entries.
+    With a weigher (callable returning the size of a value), the total size of the entries is kept under max_weight.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, max_weight=None, weigher=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires, weight = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.weight -= weight
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        weight = self.weigher(value) if self.weigher else 0
+        if self.max_weight and weight > self.max_weight:
+            self.pop(key)
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous:
+                self.weight -= previous[2]
+            self._data[key] = (value, expires, weight)
+            self.weight += weight
+            while (self.maxsize and len(self._data) > self.maxsize) or (
+                self.max_weight and self.weight > self.max_weight
+            ):
+                self.weight -= self._data.popitem(last=False)[1][2]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry:
+                self.weight -= entry[2]
+        return entry[0] if entry else default
+
+    def invalidate(self, predicate):
+        """
+        Removes all the entries whose key matches the predicate
+        :param predicate: callable receiving the key
+        :return: number of removed entries
+        """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self.weight -= self._data.pop(key)[2]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
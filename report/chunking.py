@@ -0,0 +1,106 @@
+"""
+Chunked PDF render of the very large reports (see report_chunked_reports): the rows of the table band are split in
+slices of report_chunk_rows, each slice is rendered as its own document with the rest of the data and the documents
+are merged. ReportBro lays out a whole document in memory, the peak memory is then bounded by the slice size.
+The page numbers continue from a slice to the next: when the definition shows them, the slices are rendered a first
+time to know their page counts, then again with their offset (and the total page count).
+Headers and footers hidden on the first page are laid out for the first page of every slice, use them carefully.
+Every slice is rendered with the whole definition: a definition with content besides the table (titles, parameter
+blocks, summaries), a table footer or sum/average parameters over the table rows would repeat it in every slice, or
+show the totals of a slice. Such reports are not chunked, see chunking_blocker.
+"""
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+
+from .batch import merge_pdfs, pdf_page_count
+from .columnar import ColumnarResult
+from .render_pool import render_pool
+from .services import render_report
+
+
+def page_number_usage(definition):
+    """
+    :return: tuple (uses page_number, uses page_count)
+    """
+    elements = json.dumps(definition.get("docElements", []))
+    return "page_number" in elements, "page_count" in elements
+
+
+def chunking_blocker(definition, data_source):
+    """
+    :return: why the definition can't be rendered by slices of data_source, None if it can
+    """
+    content = [
+        element for element in definition.get("docElements", [])
+        if not str(element.get("containerId", "")).endswith(("_header", "_footer"))
+    ]
+    table = next(
+        (element for element in content
+         if element.get("elementType") == "table" and element.get("dataSource") == f"${{{data_source}}}"),
+        None,
+    )
+    if table is None:
+        return f"no table of {data_source} in the content band"
+    if len(content) > 1:
+        return "content besides the table"
+    if table.get("footer"):
+        return "table footer"
+    for parameter in definition.get("parameters", []):
+        if parameter.get("type") in ("sum", "average") and f"${{{data_source}." in parameter.get("expression", ""):
+            return f"{parameter['type']} parameter {parameter.get('name')}"
+    return None
+
+
+def _slice(rows, start, size):
+    chunk = rows[start:start + size]
+    # row views would bring their whole result along to the render processes
+    return [dict(row) for row in chunk] if isinstance(rows, ColumnarResult) else chunk
+
+
+def render_chunked(report_name, definition, data, data_source, chunk_rows, workers=1, local_file='',
+                   is_test_data=None):
+    """
+    Renders a PDF report by slices of chunk_rows rows of data[data_source], see services.generate_report
+    :param workers: slices rendered in parallel (each by the render process pool if enabled)
+    :return: the PDF or None if local_file is set
+    """
+    rows = data.get(data_source) or []
+    starts = list(range(0, len(rows), chunk_rows))
+    uses_page_number, uses_page_count = page_number_usage(definition)
+    directory = tempfile.mkdtemp(prefix="report-chunks-", dir=render_pool.output_dir or None)
+    files = [os.path.join(directory, f"{index:05d}.pdf") for index in range(len(starts))]
+
+    def render(index, page_numbers=None):
+        chunk_data = dict(data)
+        chunk_data[data_source] = _slice(rows, starts[index], chunk_rows)
+        renderer = render_pool.render if render_pool.enabled else render_report
+        renderer(report_name, definition, chunk_data, "pdf", local_file=files[index], is_test_data=is_test_data,
+                 page_numbers=page_numbers)
+        return pdf_page_count(files[index])
+
+    try:
+        if uses_page_number and not uses_page_count and workers <= 1:
+            # sequential: the offset of a slice is known before rendering it
+            offset = 0
+            for index in range(len(starts)):
+                offset += render(index, (offset, None))
+        else:
+            with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="report-chunk") as executor:
+                pages = list(executor.map(render, range(len(starts))))
+                if uses_page_number or uses_page_count:
+                    total = sum(pages)
+                    offsets = [0] + list(accumulate(pages))[:-1]
+                    stale = [
+                        index for index in range(len(starts))
+                        if offsets[index] or (uses_page_count and pages[index] != total)
+                    ]
+                    list(executor.map(
+                        lambda index: render(index, (offsets[index], total if uses_page_count else None)), stale
+                    ))
+        return merge_pdfs(files, local_file)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
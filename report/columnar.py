@@ -0,0 +1,141 @@
+"""
+Columnar representation of the report query results.
+A list of dicts repeats the column names in every row and keeps one dict and one tuple per row. ColumnarResult
+keeps one list per column instead, turned into an array when all its values are int or float, and hands out
+read-only row views (without __dict__) that behave like the dicts ReportBro and the python_query implementations use.
+"""
+from array import array
+from collections.abc import Mapping, Sequence
+
+
+def _compact(values):
+    """
+    :return: the values as an array if they all are int or all are float (no None, no bool), else the list
+    """
+    if not values:
+        return values
+    first = type(values[0])
+    if first is int:
+        typecode = "q"
+    elif first is float:
+        typecode = "d"
+    else:
+        return values
+    if any(type(v) is not first for v in values):
+        return values
+    try:
+        return array(typecode, values)
+    except OverflowError:
+        return values
+
+
+class RowView(Mapping):
+    """
+    Read-only mapping over one row of a ColumnarResult
+    """
+
+    __slots__ = ("_result", "_index")
+
+    def __init__(self, result, index):
+        self._result = result
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._result._data[self._result._positions[key]][self._index]
+
+    def __iter__(self):
+        return iter(self._result.columns)
+
+    def __len__(self):
+        return len(self._result.columns)
+
+    def __contains__(self, key):
+        return key in self._result._positions
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ColumnarResult(Sequence):
+    """
+    Rows stored by column. Indexing and iterating give RowView objects, column(name) gives the values of a column
+    and to_dicts() builds the usual list of dicts when it is really needed.
+    """
+
+    __slots__ = ("columns", "_data", "_positions", "_length")
+
+    def __init__(self, columns, data):
+        """
+        :param columns: column names
+        :param data: one sequence of values per column, all of the same length
+        """
+        self.columns = tuple(columns)
+        self._data = [_compact(list(values)) if not isinstance(values, array) else values for values in data]
+        self._positions = {name: i for i, name in enumerate(self.columns)}
+        self._length = len(self._data[0]) if self._data else 0
+
+    @classmethod
+    def from_cursor(cls, cursor, fetch_size=1000):
+        """
+        Fetches all the rows of an executed cursor, by batches so that the row tuples are never all in memory
+        """
+        columns = [col[0] for col in cursor.description]
+        data = [[] for _ in columns]
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for values, column_values in zip(data, zip(*rows)):
+                values.extend(column_values)
+        return cls(columns, data)
+
+    @classmethod
+    def from_rows(cls, rows, columns=None):
+        """
+        :param rows: dicts (or tuples, with columns)
+        """
+        rows = list(rows)
+        if columns is None:
+            columns = list(rows[0].keys()) if rows else []
+            return cls(columns, [[row.get(column) for row in rows] for column in columns])
+        return cls(columns, [list(values) for values in zip(*rows)] if rows else [[] for _ in columns])
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RowView(self, i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("row index out of range")
+        return RowView(self, index)
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield RowView(self, i)
+
+    def __repr__(self):
+        return f"<ColumnarResult {len(self.columns)} columns, {self._length} rows>"
+
+    def column(self, name):
+        return self._data[self._positions[name]]
+
+    def to_dicts(self):
+        columns = self.columns
+        return [dict(zip(columns, values)) for values in zip(*self._data)] if columns else []
+
+    def __reduce__(self):
+        # pickled as plain columns for the render processes
+        return self.__class__, (self.columns, self._data)
+
+
+def reportbro_data(data):
+    """
+    Adapter for ReportBro, which needs list parameters to be lists (it reads the rows with get(), which RowView
+    provides): the ColumnarResult values of the report data become lists of row views, without copying the rows
+    """
+    if not isinstance(data, Mapping) or not any(isinstance(v, ColumnarResult) for v in data.values()):
+        return data
+    return {k: list(v) if isinstance(v, ColumnarResult) else v for k, v in data.items()}
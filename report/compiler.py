@@ -0,0 +1,105 @@
+"""
+Validation and compilation of the report definitions when they are saved (see
+schema.update_or_create_report_definition), so that definition errors are reported to the designer instead of to
+the users running the report after its query.
+The compiled metadata (digest, fonts, parameters) is stored with the ReportDefinition row and attached to the
+parsed definition under COMPILED_KEY by the definition cache, ReportBro ignores this key.
+"""
+import json
+
+from reportbro import Report, ReportBroError
+
+from .fonts import FontRegistry, used_fonts
+
+COMPILED_KEY = "openimisCompiled"
+COMPILED_VERSION = 1
+
+# parameters filled by ReportBro itself
+INTERNAL_PARAMETERS = ("page_count", "page_number", "row_number")
+# parameters computed by ReportBro from the other ones
+COMPUTED_PARAMETER_TYPES = ("sum", "average")
+
+
+def definition_parameters(definition):
+    return [
+        {"name": parameter.get("name"), "type": parameter.get("type")}
+        for parameter in definition.get("parameters", [])
+    ]
+
+
+def definition_metadata(definition, digest):
+    """
+    :param definition: parsed report definition
+    :param digest: services.definition_digest of the definition text
+    """
+    return {
+        "version": COMPILED_VERSION,
+        "digest": digest,
+        "fonts": sorted(used_fonts(definition)),
+        "parameters": definition_parameters(definition),
+    }
+
+
+def _is_provided(parameter):
+    return (
+        parameter.get("name") not in INTERNAL_PARAMETERS
+        and parameter.get("type") not in COMPUTED_PARAMETER_TYPES
+        and not parameter.get("eval")
+    )
+
+
+def check_data_schema(parameters, reference_parameters, prefix=""):
+    """
+    Checks that the data a definition expects is provided by the report query, described by the parameters of
+    the default definition of the report
+    :return: list of error messages
+    """
+    reference = {parameter.get("name"): parameter for parameter in reference_parameters or []}
+    errors = []
+    for parameter in parameters or []:
+        if not _is_provided(parameter):
+            continue
+        name = parameter.get("name")
+        expected = reference.get(name)
+        if expected is None:
+            errors.append(f"parameter {prefix}{name} is not provided by the report data")
+        elif expected.get("type") != parameter.get("type"):
+            errors.append(f"parameter {prefix}{name} must be of type {expected.get('type')}")
+        elif parameter.get("children"):
+            errors += check_data_schema(parameter["children"], expected.get("children"), f"{prefix}{name}.")
+    return errors
+
+
+def _error_message(error):
+    if isinstance(error, dict):
+        return ", ".join(f"{key}={value}" for key, value in error.items() if value is not None)
+    return str(error)
+
+
+def validate_report_definition(definition, reference=None):
+    """
+    :param definition: definition text
+    :param reference: parsed default definition of the report, to check the parameters against
+    :return: tuple (parsed definition or None, list of error messages)
+    """
+    try:
+        parsed = json.loads(definition)
+    except ValueError as exc:
+        return None, [f"invalid JSON: {exc}"]
+    if not isinstance(parsed, dict):
+        return None, ["the definition must be a JSON object"]
+    if reference is not None:
+        errors = check_data_schema(parsed.get("parameters"), reference.get("parameters"))
+        if errors:
+            return parsed, errors
+    try:
+        # ReportBro modifies the definition it loads
+        report = Report(json.loads(definition), {}, is_test_data=True,
+                        additional_fonts=FontRegistry.get_fonts(parsed))
+        if not report.errors:
+            report.verify()
+    except ReportBroError as exc:
+        return parsed, [_error_message(exc.error)]
+    except Exception as exc:
+        return parsed, [str(exc)]
+    return parsed, [_error_message(error) for error in report.errors]
@@ -0,0 +1,88 @@
+"""
+Minimal cron expressions (minute hour day-of-month month day-of-week) for the report schedules.
+Fields accept *, numbers, ranges (1-5), lists (1,15) and steps (*/15, 0-30/10). Day of week is 0-6, Sunday being 0
+(7 is accepted for Sunday too). As in cron, when both day fields are restricted a day matching either is used.
+"""
+import datetime
+
+FIELD_RANGES = (
+    (0, 59),  # minute
+    (0, 23),  # hour
+    (1, 31),  # day of month
+    (1, 12),  # month
+    (0, 7),  # day of week
+)
+
+# next_after gives up after this many steps, an expression like "0 0 31 2 *" never matches
+MAX_STEPS = 100000
+
+
+class CronExpression(object):
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression must have 5 fields: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES)
+        )
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        # datetime weekday() is 0 for Monday, cron uses 0 for Sunday
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def matches(self, dt):
+        return (
+            dt.minute in self.minutes
+            and dt.hour in self.hours
+            and dt.month in self.months
+            and self._day_matches(dt)
+        )
+
+    def next_after(self, dt):
+        """
+        :return: the first datetime strictly after dt (at minute precision) matching the expression
+        """
+        dt = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        for _ in range(MAX_STEPS):
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt = dt + datetime.timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"cron expression never matches: {self.expression}")
+
+
+def _parse_field(field, low, high):
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError(f"invalid cron step: {field}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron field out of range: {field}")
+        values.update(range(start, end + 1, step))
+    return values
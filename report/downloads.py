@@ -0,0 +1,255 @@
+"""
+HTTP delivery of the report outputs: strong ETags (content hash), Last-Modified, conditional GET, single byte
+Range requests (to resume a failed download) and gzip/br transport compression of the formats listed in
+report_compressed_formats. Compression is only applied to full responses, ranges are served from the identity
+encoding, as each encoding is a different representation with its own ETag.
+Ranges are only served for the stored outputs (output caches, job outputs): a report generated again on each
+request gets a new creation date stamped in it, the range of a download to resume would come from another document.
+"""
+import gzip
+import hashlib
+import io
+import os
+import re
+import time
+
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.text import compress_sequence
+
+from .apps import ReportConfig
+from .export import CHUNK_SIZE, FORMAT_CONTENT_TYPES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+ETAG_RE = re.compile(r'(?:W/)?"[^"]*"|\*')
+
+
+def _size(content):
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    position = content.tell()
+    size = content.seek(0, os.SEEK_END)
+    content.seek(position)
+    return size
+
+
+def content_etag(content):
+    """
+    Strong ETag of an output (bytes or binary file, read from the start and rewound)
+    """
+    digest = hashlib.sha256()
+    if isinstance(content, (bytes, bytearray)):
+        digest.update(content)
+    else:
+        content.seek(0)
+        for chunk in iter(lambda: content.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+        content.seek(0)
+    return f'"{digest.hexdigest()}"'
+
+
+def file_last_modified(content):
+    """
+    Modification time of an output file, now for the others. The output stores keep the mtime when an output is
+    read (unlike the ctime), it is only shifted at write time for the outputs with their own TTL
+    """
+    try:
+        return min(os.fstat(content.fileno()).st_mtime, time.time())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return time.time()
+
+
+def accepted_encoding(request, report_format):
+    """
+    :return: br, gzip or None, the transport compression to use for the format given the request Accept-Encoding
+    """
+    if report_format not in ReportConfig.report_compressed_formats:
+        return None
+    accepted = set()
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _matches_etag(header, etag):
+    tags = ETAG_RE.findall(header)
+    return "*" in tags or etag in tags
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        return _matches_etag(if_none_match, etag)
+    if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def _requested_range(request, etag, last_modified, size):
+    """
+    :return: tuple (start, end) inclusive, None to send the whole content or False if the range can't be satisfied
+    """
+    header = request.META.get("HTTP_RANGE")
+    if not header or request.method not in ("GET", "HEAD"):
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != int(last_modified):
+        # the client has another version, it gets the whole content
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # several ranges or another unit, the whole content is a valid answer
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(content, start, length):
+    if isinstance(content, (bytes, bytearray)):
+        yield bytes(content[start:start + length])
+        return
+    try:
+        content.seek(start)
+        while length > 0:
+            chunk = content.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+    finally:
+        content.close()
+
+
+def _close(content):
+    if not isinstance(content, (bytes, bytearray)):
+        content.close()
+
+
+def _compress(content, encoding):
+    if isinstance(content, (bytes, bytearray)):
+        data = content
+    else:
+        content.seek(0)
+        data = content.read()
+        content.close()
+    if encoding == "br":
+        return brotli.compress(data)
+    return gzip.compress(data, mtime=0)
+
+
+def download_response(request, content, filename, report_format, last_modified=None, etag=None, ranges=True):
+    """
+    Response for a generated or cached output
+    :param content: the output, bytes or binary file (closed by the response)
+    :param last_modified: timestamp of the output, by default the modification time of the file or now
+    :param etag: strong ETag of the content if already known
+    :param ranges: serve Range requests, only for outputs stored as they are sent so that a later request gets the
+                   same bytes
+    """
+    content_type = FORMAT_CONTENT_TYPES.get(report_format, "application/octet-stream")
+    size = _size(content)
+    etag = etag or content_etag(content)
+    last_modified = last_modified or file_last_modified(content)
+    ranged = ranges and request.META.get("HTTP_RANGE")
+    encoding = None if ranged else accepted_encoding(request, report_format)
+    representation_etag = f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+    if _not_modified(request, representation_etag, last_modified):
+        _close(content)
+        response = HttpResponseNotModified()
+    else:
+        requested = _requested_range(request, etag, last_modified, size) if ranges else None
+        if requested is False:
+            _close(content)
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+        elif requested:
+            start, end = requested
+            response = StreamingHttpResponse(
+                _read_range(content, start, end - start + 1), status=206, content_type=content_type
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            response["Content-Length"] = str(end - start + 1)
+        elif encoding:
+            compressed = _compress(content, encoding)
+            response = HttpResponse(compressed, content_type=content_type)
+            response["Content-Encoding"] = encoding
+            response["Content-Length"] = str(len(compressed))
+        else:
+            if isinstance(content, (bytes, bytearray)):
+                content = io.BytesIO(content)
+            content.seek(0)
+            response = FileResponse(content, content_type=content_type)
+            response["Content-Length"] = str(size)
+        response["Content-Disposition"] = f'inline; filename="{filename}"'
+    response["ETag"] = representation_etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes" if ranges else "none"
+    if report_format in ReportConfig.report_compressed_formats:
+        response["Vary"] = "Accept-Encoding"
+    return response
+
+
+def _brotli_sequence(chunks):
+    compressor = brotli.Compressor()
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class _CompressedChunks(object):
+    """
+    Compressed chunks closing their source with the response, even if the compression never started
+    """
+
+    def __init__(self, chunks, source):
+        self.chunks = chunks
+        self.source = source
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.chunks.close()
+        close = getattr(self.source, "close", None)
+        if close:
+            close()
+
+
+def streaming_download_response(request, chunks, filename, report_format):
+    """
+    Response for the streamed formats (csv, xlsx-stream), their size and hash are only known at the end
+    :param chunks: iterable of bytes, closed (if it has a close method) with the response
+    """
+    encoding = accepted_encoding(request, report_format)
+    if encoding == "br":
+        chunks = _CompressedChunks(_brotli_sequence(chunks), chunks)
+    elif encoding == "gzip":
+        chunks = _CompressedChunks(compress_sequence(chunks), chunks)
+    response = StreamingHttpResponse(chunks, content_type=FORMAT_CONTENT_TYPES[report_format])
+    if encoding:
+        response["Content-Encoding"] = encoding
+    if report_format in ReportConfig.report_compressed_formats:
+        response["Vary"] = "Accept-Encoding"
+    response["Content-Disposition"] = f'inline; filename="{filename}"'
+    return response
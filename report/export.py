@@ -0,0 +1,268 @@
+"""
+Tabular exports (xlsx-stream, csv) for the report definitions made of a single table band.
+They bypass the ReportBro layout and write the rows straight from the query result, keeping the headers,
+widths and patterns of the stored definition.
+"""
+import csv
+import datetime
+import decimal
+import io
+import os
+import re
+import tempfile
+from collections.abc import Mapping
+
+from reportbro import ReportBroError
+
+STREAM_FORMATS = ("xlsx-stream", "csv")
+FORMAT_EXTENSIONS = {"xlsx-stream": "xlsx"}
+FORMAT_CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "xlsx-stream": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+}
+
+CHUNK_SIZE = 64 * 1024
+CSV_BATCH_ROWS = 500
+# ReportBro widths are in points, xlsx column widths in characters
+POINTS_PER_CHARACTER = 7
+
+PARAMETER_RE = re.compile(r"\$\{([^}]+)\}")
+# quoted literal, field (run of the same letter) or separators of a babel date pattern
+DATE_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|([A-Za-z])\1*|[^A-Za-z']+")
+
+
+def report_extension(report_format):
+    return FORMAT_EXTENSIONS.get(report_format, report_format)
+
+
+class TableColumn(object):
+    __slots__ = ("header", "content", "field", "width", "pattern")
+
+    def __init__(self, header, content, width, pattern):
+        self.header = header
+        self.content = content or ""
+        match = PARAMETER_RE.fullmatch(self.content.strip())
+        self.field = match.group(1).strip() if match else None
+        self.width = width
+        self.pattern = pattern
+
+    def value(self, row):
+        if self.field:
+            return _row_value(row, self.field)
+        return PARAMETER_RE.sub(lambda m: _to_text(_row_value(row, m.group(1).strip())), self.content)
+
+
+class TableSpec(object):
+    """
+    Columns and data source of the single table band of a report definition
+    """
+
+    def __init__(self, data_source, columns):
+        self.data_source = data_source
+        self.columns = columns
+
+    @classmethod
+    def from_definition(cls, definition):
+        """
+        :param definition: parsed report definition
+        :return: a TableSpec or None if the definition isn't made of a single table
+        """
+        tables = [e for e in definition.get("docElements", []) if e.get("elementType") == "table"]
+        if len(tables) != 1:
+            return None
+        table = tables[0]
+        match = PARAMETER_RE.fullmatch((table.get("dataSource") or "").strip())
+        if not match:
+            return None
+        content_rows = table.get("contentDataRows") or [table.get("contentData") or {}]
+        content_cells = content_rows[0].get("columnData", []) if content_rows else []
+        header_cells = (table.get("headerData") or {}).get("columnData", []) if table.get("header", True) else []
+        columns = []
+        for i, cell in enumerate(content_cells):
+            header = header_cells[i] if i < len(header_cells) else {}
+            columns.append(
+                TableColumn(
+                    header=header.get("content", ""),
+                    content=cell.get("content", ""),
+                    width=_to_int(header.get("width") or cell.get("width")),
+                    pattern=cell.get("pattern") or "",
+                )
+            )
+        return cls(match.group(1).strip(), columns)
+
+    def headers(self, data):
+        return [PARAMETER_RE.sub(lambda m: _to_text(data.get(m.group(1).strip())), c.header) for c in self.columns]
+
+    def rows(self, data):
+        return data.get(self.data_source) or []
+
+
+def get_table_spec(report_name, definition):
+    table = TableSpec.from_definition(definition)
+    if not table:
+        raise ReportBroError(f"{report_name} is not a single table report, it can't be streamed")
+    return table
+
+
+def iter_csv(table, data):
+    """
+    Yields the CSV output by chunks while the rows are read
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM, for Excel to detect UTF-8
+    writer.writerow(table.headers(data))
+    for i, row in enumerate(table.rows(data), 1):
+        writer.writerow([_to_text(column.value(row)) for column in table.columns])
+        if i % CSV_BATCH_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_xlsx(table, data):
+    """
+    Writes the rows with xlsxwriter in constant memory mode, then yields the file by chunks
+    """
+    fd, filename = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        write_xlsx(table, data, filename)
+        with open(filename, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(filename)
+
+
+def write_xlsx(table, data, filename):
+    import xlsxwriter
+
+    # xlsx dates have no time zone, aware datetimes (USE_TZ) are written as their local time
+    workbook = xlsxwriter.Workbook(filename, {"constant_memory": True, "remove_timezone": True})
+    try:
+        worksheet = workbook.add_worksheet()
+        bold = workbook.add_format({"bold": True})
+        number_formats = []
+        date_formats = []
+        for i, column in enumerate(table.columns):
+            if column.width:
+                worksheet.set_column(i, i, column.width / POINTS_PER_CHARACTER)
+            number_formats.append(workbook.add_format({"num_format": column.pattern}) if column.pattern else None)
+            date_formats.append(workbook.add_format({"num_format": _date_pattern(column.pattern or "yyyy-MM-dd")}))
+        worksheet.write_row(0, 0, table.headers(data), bold)
+        for r, row in enumerate(table.rows(data), 1):
+            for c, column in enumerate(table.columns):
+                value = column.value(row)
+                if isinstance(value, (datetime.date, datetime.datetime)):
+                    worksheet.write_datetime(r, c, value, date_formats[c])
+                elif isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+                    worksheet.write_number(r, c, float(value), number_formats[c])
+                elif value is not None:
+                    worksheet.write_string(r, c, _to_text(value))
+    finally:
+        workbook.close()
+
+
+def stream_report(report_name, definition, data, report_format, local_file=''):
+    """
+    Tabular export of a single table report
+    :return: iterable of bytes chunks or None if local_file is set
+    """
+    table = get_table_spec(report_name, definition)
+    if report_format == "csv":
+        chunks = iter_csv(table, data)
+    elif local_file:
+        write_xlsx(table, data, local_file)
+        return None
+    else:
+        chunks = iter_xlsx(table, data)
+    if local_file:
+        with open(local_file, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return None
+    return chunks
+
+
+def _row_value(row, field):
+    if isinstance(row, Mapping):
+        return row.get(field)
+    return getattr(row, field, None)
+
+
+def _to_text(value):
+    return "" if value is None else str(value)
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _date_field(letter, length):
+    """
+    :return: tuple (field, xlsx format) of a babel (LDML) date pattern field, format None if it has no equivalent
+    """
+    if letter == "y":
+        return "year", "yy" if length == 2 else "yyyy"
+    if letter in "ML":
+        return "month", "m" * min(length, 4)
+    if letter == "d":
+        return "day", "d" * min(length, 2)
+    if letter in "Ec":
+        return "weekday", "dddd" if length >= 4 else "ddd"
+    if letter in "HhKk":
+        return "hour", "h" * min(length, 2)
+    if letter == "m":
+        return "minute", "m" * min(length, 2)
+    if letter == "s":
+        return "second", "s" * min(length, 2)
+    if letter == "S":
+        return "fraction", "0" * min(length, 3)
+    if letter == "a":
+        return "period", "AM/PM"
+    # era, quarter, week, time zone...
+    return None, None
+
+
+def _date_pattern(pattern):
+    """
+    Converts a ReportBro (babel) date pattern to an xlsx number format. Both use m for the minutes but babel uses M
+    for the months where xlsx uses m too, deciding by position: m/mm are minutes right after an hour or before
+    seconds, months otherwise.
+    """
+    fields = []
+    for match in DATE_TOKEN_RE.finditer(pattern):
+        token = match.group(0)
+        if token.startswith("'"):
+            text = "'" if token == "''" else token[1:-1].replace("''", "'")
+            fields.append((None, "".join(f"\\{c}" for c in text)))
+        elif match.group(1):
+            field, xlsx_format = _date_field(match.group(1), len(token))
+            if xlsx_format:
+                fields.append((field, xlsx_format))
+        else:
+            fields.append((None, token))
+    xlsx_pattern = []
+    for i, (field, xlsx_format) in enumerate(fields):
+        if field in ("month", "minute") and len(xlsx_format) <= 2:
+            previous = next((f for f, _ in reversed(fields[:i]) if f), None)
+            following = next((f for f, _ in fields[i + 1:] if f), None)
+            read_as_minutes = previous == "hour" or following == "second"
+            if field == "minute" and not read_as_minutes:
+                # xlsx has no minutes outside of a time, the field would be read as the month
+                continue
+            if field == "month" and read_as_minutes:
+                # same for a month next to a time, the short month name is the closest
+                xlsx_format = "mmm"
+        xlsx_pattern.append(xlsx_format)
+    return "".join(xlsx_pattern) or "yyyy-mm-dd"
@@ -0,0 +1,65 @@
+import base64
+import gzip
+import hashlib
+import json
+
+from django.core.exceptions import FieldError
+from django.db import models
+
+COMPRESSED_PREFIX = "gz:"
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def minify_json(text):
+    """
+    Canonical compact form of a JSON document (key order kept), the text itself if it isn't valid JSON
+    """
+    try:
+        return json.dumps(json.loads(text), separators=(",", ":"), ensure_ascii=False)
+    except ValueError:
+        return text
+
+
+def compress_text(text):
+    return COMPRESSED_PREFIX + base64.b64encode(gzip.compress(text.encode("utf-8"), mtime=0)).decode("ascii")
+
+
+def decompress_text(value):
+    if value is None or not value.startswith(COMPRESSED_PREFIX):
+        # stored before the compression
+        return value
+    return gzip.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX):])).decode("utf-8")
+
+
+class CompressedTextField(models.TextField):
+    """
+    Text stored gzip compressed (base64 encoded, still in a text column), transparently decompressed when read.
+    Uncompressed values are still read as is.
+    The compression is deterministic, exact and in lookups compare the compressed values. The database can't look
+    into them, the other lookups (contains, startswith...) raise a FieldError instead of matching nothing.
+    """
+
+    SUPPORTED_LOOKUPS = ("exact", "in", "isnull")
+
+    def get_lookup(self, lookup_name):
+        if lookup_name not in self.SUPPORTED_LOOKUPS:
+            raise FieldError(
+                f"{lookup_name} lookup not supported on the compressed field {self.name}, "
+                f"only {', '.join(self.SUPPORTED_LOOKUPS)}"
+            )
+        return super().get_lookup(lookup_name)
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_text(value)
+
+    def to_python(self, value):
+        return decompress_text(super().to_python(value))
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or value.startswith(COMPRESSED_PREFIX):
+            return value
+        return compress_text(value)
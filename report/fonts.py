@@ -0,0 +1,116 @@
+import logging
+
+from django.contrib.staticfiles import finders
+
+logger = logging.getLogger(__name__)
+
+FONTS_STATIC_DIR = "report/reportbro/fonts"
+
+# Fonts built into fpdf, they never need to be passed to ReportBro
+STANDARD_FONTS = ("courier", "helvetica", "times")
+
+# ReportBro font name -> static font files, the keys are the ones expected by ReportBro additional_fonts
+FONT_FILES = {
+    "firefly": dict(filename="fireflysung.ttf"),
+    "dejavusans": dict(
+        filename="DejaVuSans.ttf",
+        bold_filename="DejaVuSans-Bold.ttf",
+        italic_filename="DejaVuSans-Oblique.ttf",
+        bold_italic_filename="DejaVuSans-BoldOblique.ttf",
+    ),
+    "notosans": dict(
+        filename="NotoSans-Regular.ttf",
+        bold_filename="NotoSans-Bold.ttf",
+        italic_filename="NotoSans-Italic.ttf",
+        bold_italic_filename="NotoSans-BoldItalic.ttf",
+    ),
+    "notosans-myanmar": dict(
+        filename="NotoSansMyanmar-Regular.ttf",
+        bold_filename="NotoSansMyanmar-Bold.ttf",
+    ),
+    "notosans-arabic": dict(filename="NotoSansArabic.ttf"),
+    "notosans-naskh-arabic": dict(filename="NotoNaskhArabic.ttf"),
+    "notosans-ethiopic": dict(filename="NotoSansEthiopic.ttf"),
+    "freesans": dict(
+        filename="FreeSans.ttf",
+        bold_filename="FreeSansBold.ttf",
+        italic_filename="FreeSansOblique.ttf",
+        bold_italic_filename="FreeSansBoldOblique.ttf",
+    ),
+    "unifont": dict(filename="unifont.ttf"),
+}
+
+FONT_KEYS = ("font", "cs_font")
+
+
+class FontRegistry(object):
+    """
+    Process-wide registry of the fonts that can be used by the ReportBro templates.
+    The static files are resolved only once (at ReportConfig.ready()) and the font entries are kept in memory,
+    so generating a report doesn't hit the staticfiles finders anymore.
+    """
+
+    _fonts = None
+    _selections = {}
+
+    @classmethod
+    def load(cls):
+        fonts = {}
+        for value, files in FONT_FILES.items():
+            font = dict(value=value)
+            for key, filename in files.items():
+                path = finders.find(f"{FONTS_STATIC_DIR}/{filename}")
+                if path:
+                    font[key] = path
+                else:
+                    logger.debug(f"font file {filename} for {value} not found, skipping")
+            if not font.get("filename"):
+                logger.warning(f"font {value} has no regular font file, it won't be available to reports")
+                continue
+            fonts[value] = font
+        cls._fonts = fonts
+        cls._selections = {}
+        logger.debug(f"{len(fonts)} report fonts registered")
+        return fonts
+
+    @classmethod
+    def fonts(cls):
+        if cls._fonts is None:
+            cls.load()
+        return cls._fonts
+
+    @classmethod
+    def get_fonts(cls, definition, names=None):
+        """
+        Fonts to pass to ReportBro as additional_fonts, limited to the ones used by the definition
+        :param definition: parsed report definition (dict)
+        :param names: font names used by the definition if already known (see report.compiler)
+        :return: list of font dicts, to be used read-only
+        """
+        names = frozenset(used_fonts(definition) if names is None else names) & frozenset(cls.fonts())
+        selection = cls._selections.get(names)
+        if selection is None:
+            selection = [cls._fonts[name] for name in sorted(names)]
+            cls._selections[names] = selection
+        return selection
+
+
+def used_fonts(definition):
+    """
+    Collects the font names referenced by a report definition (font/cs_font of the elements, table cells and styles)
+    :param definition: parsed report definition (dict)
+    :return: set of font names, standard fpdf fonts excluded
+    """
+    found = set()
+    pending = [definition.get("docElements", []), definition.get("styles", [])]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in FONT_KEYS and isinstance(value, str):
+                    found.add(value)
+                elif isinstance(value, (dict, list)):
+                    pending.append(value)
+        elif isinstance(node, list):
+            pending.extend(node)
+    return found - set(STANDARD_FONTS)
@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from .apps import ReportConfig
+from .metrics import report_trace
+from .models import ReportJob
+from .output_cache import job_output_store
+from .services import run_report
+
+logger = logging.getLogger(__name__)
+
+
+class ReportJobService(object):
+    """
+    Submits reports to be generated outside of the HTTP request. The jobs are run by a local thread pool or,
+    when report_job_backend is "celery", by a Celery worker (report.tasks).
+    The outputs are kept in job_output_store for report_job_output_ttl. With the thread backend, the jobs queued in
+    a process that was restarted are lost: the first use of the service in a process requeues the queued jobs (the
+    status update in run_report_job ensures a job is only run once) and a job running for more than
+    report_job_timeout is failed when its status is read.
+    """
+
+    _executor = None
+    _lock = threading.Lock()
+    _recovered = False
+
+    def __init__(self, user):
+        self.user = user
+        self.recover()
+
+    @classmethod
+    def recover(cls):
+        if ReportConfig.report_job_backend == "celery":
+            return
+        with cls._lock:
+            if cls._recovered:
+                return
+            cls._recovered = True
+        fail_lost_jobs()
+        queued = list(ReportJob.objects.filter(status=ReportJob.STATUS_QUEUED).values_list("id", flat=True))
+        for job_id in queued:
+            cls.dispatch(job_id)
+        if queued:
+            logger.info(f"{len(queued)} queued report jobs requeued")
+
+    def submit(self, report_name, report_format="pdf", params=None, client_mutation_id=None):
+        job = ReportJob.objects.create(
+            name=report_name,
+            report_format=report_format,
+            parameters=params or {},
+            user=self.user,
+            client_mutation_id=client_mutation_id,
+        )
+        transaction.on_commit(lambda: self.dispatch(job.id))
+        return job
+
+    @classmethod
+    def dispatch(cls, job_id):
+        if ReportConfig.report_job_backend == "celery":
+            from .tasks import run_report_job_task
+
+            run_report_job_task.delay(str(job_id))
+        else:
+            cls.executor().submit(run_report_job, job_id)
+
+    @classmethod
+    def executor(cls):
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=ReportConfig.report_job_workers, thread_name_prefix="report-job"
+                )
+            return cls._executor
+
+    def get(self, job_id):
+        """
+        :return: the job if it was requested by the user, None otherwise
+        """
+        job = ReportJob.objects.filter(id=job_id, user=self.user).first()
+        if job and job.status == ReportJob.STATUS_RUNNING and fail_lost_jobs(job_id=job.id):
+            job.refresh_from_db()
+        return job
+
+    def output(self, job):
+        """
+        :return: the output of a successful job as a binary file, None if it expired
+        """
+        if job.status != ReportJob.STATUS_SUCCESS or not job.output_file:
+            return None
+        return job_output_store.get(os.path.basename(job.output_file))
+
+
+def fail_lost_jobs(job_id=None):
+    """
+    Fails the jobs running for more than report_job_timeout, their process was stopped
+    :return: the number of failed jobs
+    """
+    from core import datetime
+
+    now = datetime.datetime.now()
+    started_before = now - timedelta(seconds=ReportConfig.report_job_timeout)
+    jobs = ReportJob.objects.filter(
+        Q(status=ReportJob.STATUS_RUNNING) & (Q(started_at__lt=started_before) | Q(started_at__isnull=True))
+    )
+    if job_id:
+        jobs = jobs.filter(id=job_id)
+    failed = jobs.update(status=ReportJob.STATUS_FAILED, error="interrupted", finished_at=now)
+    if failed:
+        logger.warning(f"{failed} report jobs interrupted")
+    return failed
+
+
+def run_report_job(job_id):
+    """
+    Runs a queued ReportJob, the output is written in job_output_store
+    """
+    from core import datetime
+
+    close_old_connections()
+    try:
+        started = ReportJob.objects.filter(id=job_id, status=ReportJob.STATUS_QUEUED).update(
+            status=ReportJob.STATUS_RUNNING, started_at=datetime.datetime.now()
+        )
+        if not started:
+            logger.warning(f"report job {job_id} not found or already started")
+            return
+        job = ReportJob.objects.get(id=job_id)
+        try:
+            report_config = ReportConfig.get_report(job.name)
+            if not report_config:
+                raise ValueError(f"unknown report {job.name}")
+            with report_trace(job.name, job.report_format):
+                job.output_file = job_output_store.write(
+                    f"{job.id}.{job.report_format}",
+                    lambda path: run_report(job.user, report_config, job.report_format, job.parameters,
+                                            local_file=path),
+                )
+            job.status = ReportJob.STATUS_SUCCESS
+        except Exception as exc:
+            logger.exception(f"report job {job_id} failed")
+            job.status = ReportJob.STATUS_FAILED
+            job.error = str(exc)
+        job.finished_at = datetime.datetime.now()
+        job.save(update_fields=["status", "output_file", "error", "finished_at"])
+    finally:
+        close_old_connections()
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from report.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Runs a benchmark of the report pipeline and prints the results as JSON"
+
+    def add_arguments(self, parser):
+        # the options not given are left to the defaults of each benchmark
+        parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+        parser.add_argument("--report", dest="report_name", help="report of the definition_cache benchmark")
+        parser.add_argument("--iterations", type=int)
+        parser.add_argument("--rows", type=int)
+        parser.add_argument("--sizes", help="comma separated row counts of the render benchmark")
+        parser.add_argument("--formats", help="comma separated formats of the render benchmark")
+        parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+        parser.add_argument("--output", help="JSON file to write the results to, to be used as a baseline")
+
+    def handle(self, *args, **options):
+        kwargs = {
+            name: options[name] for name in ("report_name", "iterations", "rows") if options[name] is not None
+        }
+        if options["sizes"]:
+            kwargs["sizes"] = [int(size) for size in options["sizes"].split(",")]
+        if options["formats"]:
+            kwargs["formats"] = options["formats"].split(",")
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                kwargs["baseline"] = json.load(f)
+        result = BENCHMARKS[options["benchmark"]](**kwargs)
+        output = json.dumps(result, indent=2, default=str)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
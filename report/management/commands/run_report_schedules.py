@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from report.output_cache import precomputed_outputs
+from report.schedules import ReportScheduleService
+
+
+class Command(BaseCommand):
+    help = "Pre-renders the due scheduled reports, to be run periodically (e.g. every 5 minutes from cron)"
+
+    def handle(self, *args, **options):
+        if not precomputed_outputs.enabled:
+            self.stderr.write("report_schedule_output_ttl is 0, the scheduled reports are disabled")
+            return
+        for schedule, success in ReportScheduleService().run_due():
+            if success:
+                self.stdout.write(f"{schedule.name}: generated, next run at {schedule.next_run_at}")
+            else:
+                self.stderr.write(f"{schedule.name}: failed, {schedule.last_error}")
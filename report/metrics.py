@@ -0,0 +1,233 @@
+"""
+Per-stage instrumentation of the report pipeline.
+views.report (and the report jobs) open a trace, the pipeline functions record their stages in the current trace
+(if any): definition, query, db, load, fonts, render. When the trace ends, it is logged as a structured record,
+added to the Prometheus exporter and passed to the registered metrics hooks.
+The rss_delta_kb value is the growth of the process resident memory during the trace, negative when memory was
+released: the renders running at the same time in other threads are included in it. It is exported as a gauge of
+the last run of each report, the Prometheus counters can't decrease.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+_current_trace = ContextVar("report_trace", default=None)
+
+# trace counters that can be negative, exported as gauges
+GAUGES = ("rss_delta_kb",)
+_hooks = []
+
+
+def peak_rss_kb():
+    """
+    High-water mark of the process resident memory since it started
+    """
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss_kb():
+    """
+    Current resident memory of the process, 0 if it can't be read
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss // 1024
+    return 0
+
+
+class ReportTrace(object):
+    def __init__(self, report_name, report_format):
+        self.report_name = report_name
+        self.report_format = report_format
+        self.stages = {}
+        self.counters = {}
+        self.error = None
+        self._start = time.perf_counter()
+        self._rss = current_rss_kb()
+        self._finished = False
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes the trace the current one in the block, a streamed response activates it again while it is sent
+        """
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def finish(self):
+        """
+        Records the total time and publishes the trace, only once
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.add("total", time.perf_counter() - self._start)
+        self.counters["rss_delta_kb"] = current_rss_kb() - self._rss
+        publish(self)
+
+    def add(self, stage_name, seconds):
+        self.stages[stage_name] = self.stages.get(stage_name, 0) + seconds
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+    def as_dict(self):
+        return {
+            "report": self.report_name,
+            "format": self.report_format,
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+            "error": self.error,
+            **self.counters,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a stage of the current trace, does nothing outside of a trace
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+def count(name, value):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+@contextmanager
+def report_trace(report_name, report_format):
+    trace = ReportTrace(report_name, report_format)
+    try:
+        with trace.activate():
+            yield trace
+    except BaseException as exc:
+        trace.error = type(exc).__name__
+        raise
+    finally:
+        trace.finish()
+
+
+def register_metrics_hook(hook):
+    """
+    Registers a callable receiving each finished ReportTrace, to forward the metrics to another system
+    """
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def publish(trace):
+    metrics = trace.as_dict()
+    logger.info("report.metrics %s", json.dumps(metrics), extra={"report_metrics": metrics})
+    prometheus_exporter.observe(trace)
+    for hook in _hooks:
+        try:
+            hook(trace)
+        except Exception:
+            logger.exception("report metrics hook failed")
+
+
+class PrometheusExporter(object):
+    """
+    Aggregates the traces of this process and renders them in the Prometheus text format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs = defaultdict(int)
+        self._stage_seconds = defaultdict(float)
+        self._stage_count = defaultdict(int)
+        self._counters = defaultdict(float)
+        self._gauges = {}
+
+    def observe(self, trace):
+        with self._lock:
+            self._runs[(trace.report_name, trace.report_format, "error" if trace.error else "success")] += 1
+            for name, seconds in trace.stages.items():
+                self._stage_seconds[(trace.report_name, name)] += seconds
+                self._stage_count[(trace.report_name, name)] += 1
+            for name, value in trace.counters.items():
+                if name in GAUGES:
+                    self._gauges[(trace.report_name, name)] = value
+                else:
+                    self._counters[(trace.report_name, name)] += value
+
+    def render(self):
+        lines = [
+            "# HELP openimis_report_runs_total Reports generated",
+            "# TYPE openimis_report_runs_total counter",
+        ]
+        with self._lock:
+            for (report, report_format, status), value in sorted(self._runs.items()):
+                lines.append(
+                    f'openimis_report_runs_total{{report="{report}",format="{report_format}",status="{status}"}} '
+                    f'{value}'
+                )
+            lines += [
+                "# HELP openimis_report_stage_seconds Time spent in each stage of the report pipeline",
+                "# TYPE openimis_report_stage_seconds summary",
+            ]
+            for (report, name), value in sorted(self._stage_seconds.items()):
+                labels = f'report="{report}",stage="{name}"'
+                lines.append(f"openimis_report_stage_seconds_sum{{{labels}}} {value:.6f}")
+                lines.append(f"openimis_report_stage_seconds_count{{{labels}}} {self._stage_count[(report, name)]}")
+            lines += [
+                "# HELP openimis_report_total Rows and output bytes of the reports",
+                "# TYPE openimis_report_total counter",
+            ]
+            for (report, name), value in sorted(self._counters.items()):
+                lines.append(f'openimis_report_total{{report="{report}",metric="{name}"}} {value:g}')
+            for gauge in GAUGES:
+                lines += [
+                    f"# HELP openimis_report_{gauge} Last value of {gauge} of the reports",
+                    f"# TYPE openimis_report_{gauge} gauge",
+                ]
+                for (report, name), value in sorted(self._gauges.items()):
+                    if name == gauge:
+                        lines.append(f'openimis_report_{gauge}{{report="{report}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+prometheus_exporter = PrometheusExporter()
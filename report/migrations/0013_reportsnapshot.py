@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0012_reportschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportSnapshot',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('stored_procedure', models.CharField(max_length=255)),
+                ('parameters_hash', models.CharField(db_index=True, max_length=64)),
+                ('parameters', models.JSONField(blank=True, default=dict)),
+                ('source_version', models.CharField(blank=True, max_length=255, null=True)),
+                ('row_count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('generated_report', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='snapshots', to='report.generatedreports')),
+            ],
+            options={
+                'db_table': 'report_ReportSnapshot',
+                'managed': True,
+            },
+        ),
+    ]
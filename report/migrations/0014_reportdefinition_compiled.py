@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0013_reportsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportdefinition',
+            name='compiled',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+import report.fields
+
+
+def compress_definitions(apps, schema_editor):
+    """
+    Stores the definitions minified and compressed with their content hash, then removes the history versions
+    identical to the version that replaced them
+    """
+    ReportDefinition = apps.get_model("report", "ReportDefinition")
+    # the field is still a TextField here, the values are compressed explicitly
+    for pk, value in list(ReportDefinition.objects.values_list("pk", "definition")):
+        text = report.fields.minify_json(report.fields.decompress_text(value) or "")
+        ReportDefinition.objects.filter(pk=pk).update(
+            definition=report.fields.compress_text(text), definition_hash=report.fields.content_hash(text)
+        )
+
+    for current in list(ReportDefinition.objects.filter(legacy_id__isnull=True)):
+        history = list(
+            ReportDefinition.objects.filter(legacy_id=current.id).order_by("validity_to")
+            .values_list("id", "definition_hash")
+        )
+        chain = history + [(current.id, current.definition_hash)]
+        # the version kept covers the validity of the removed one, as it is valid until a later date
+        duplicates = [pk for (pk, digest), (_, next_digest) in zip(chain, chain[1:]) if digest == next_digest]
+        ReportDefinition.objects.filter(pk__in=duplicates).delete()
+
+
+def decompress_definitions(apps, schema_editor):
+    ReportDefinition = apps.get_model("report", "ReportDefinition")
+    for pk, value in list(ReportDefinition.objects.values_list("pk", "definition")):
+        ReportDefinition.objects.filter(pk=pk).update(definition=report.fields.decompress_text(value))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0014_reportdefinition_compiled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportdefinition',
+            name='definition_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True),
+        ),
+        migrations.RunPython(compress_definitions, decompress_definitions),
+        migrations.AlterField(
+            model_name='reportdefinition',
+            name='definition',
+            field=report.fields.CompressedTextField(),
+        ),
+    ]
@@ -1,8 +1,15 @@
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from core import models as core_models
 
 from core.models import UUIDVersionedModel
 
+from .cron import CronExpression
+from .fields import CompressedTextField, content_hash
+
 
 class ReportDefinition(core_models.UUIDModel, UUIDVersionedModel):
     """
@@ -18,12 +25,23 @@ class ReportDefinition(core_models.UUIDModel, UUIDVersionedModel):
     #     max_length=255, blank=True, null=True
     # )
     engine = models.IntegerField(choices=REPORT_ENGINE_CHOICES, default=REPORT_BRO)
-    definition = models.TextField()
+    definition = CompressedTextField()
+    # content hash of the definition, identical versions share it
+    definition_hash = models.CharField(max_length=40, blank=True, null=True, db_index=True)
+    # metadata computed when the definition is saved, see report.compiler
+    compiled = models.JSONField(blank=True, null=True)
 
     class Meta:
         managed = True
         db_table = "report_ReportDefinition"
 
+    def save(self, *args, **kwargs):
+        self.definition_hash = content_hash(self.definition) if self.definition is not None else None
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "definition" in update_fields:
+            kwargs["update_fields"] = list(update_fields) + ["definition_hash"]
+        return super().save(*args, **kwargs)
+
 
 class GeneratedReports(models.Model):
     id = models.AutoField(db_column="ReportingId", primary_key=True)
@@ -72,3 +90,91 @@ class GeneratedReports(models.Model):
     class Meta:
         managed = True
         db_table = "tblReporting"
+
+
+class ReportJob(core_models.UUIDModel):
+    """
+    Report generated asynchronously, outside of the HTTP request. The output is stored in a local file until
+    it is downloaded by the user.
+    """
+
+    STATUS_QUEUED = 0
+    STATUS_RUNNING = 1
+    STATUS_SUCCESS = 2
+    STATUS_FAILED = 3
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCESS, "Success"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    name = models.CharField(max_length=255)
+    report_format = models.CharField(max_length=16, default="pdf")
+    parameters = models.JSONField(default=dict, blank=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, models.DO_NOTHING, null=True, blank=True, related_name="+"
+    )
+    client_mutation_id = models.CharField(max_length=255, null=True, blank=True)
+    status = models.IntegerField(choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    output_file = models.CharField(max_length=1024, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "report_ReportJob"
+
+
+class ReportSchedule(core_models.UUIDModel):
+    """
+    Report pre-rendered on a cron schedule (see the run_report_schedules command). The outputs are stored for the
+    user of the schedule and served by views.report when a request matches the report, format and parameters.
+    Parameter values can use the placeholders of report.schedules.parameter_context, like {previous_month}.
+    The schedules only run when report_schedule_output_ttl is set.
+    """
+
+    name = models.CharField(max_length=255)
+    parameters = models.JSONField(default=dict, blank=True)
+    cron = models.CharField(max_length=255)
+    formats = models.JSONField(default=list, blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, models.DO_NOTHING, related_name="+")
+    is_active = models.BooleanField(default=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    next_run_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "report_ReportSchedule"
+
+    def clean(self):
+        super().clean()
+        try:
+            CronExpression(self.cron).next_after(datetime.datetime.now())
+        except ValueError as exc:
+            raise ValidationError({"cron": str(exc)})
+
+
+class ReportSnapshot(core_models.UUIDModel):
+    """
+    Compressed, columnar result of a stored procedure run (see report.snapshots), so a report can be re-run
+    without executing the procedure again while its parameters and source version are unchanged.
+    """
+
+    generated_report = models.ForeignKey(
+        GeneratedReports, models.DO_NOTHING, null=True, blank=True, related_name="snapshots"
+    )
+    stored_procedure = models.CharField(max_length=255)
+    parameters_hash = models.CharField(max_length=64, db_index=True)
+    parameters = models.JSONField(default=dict, blank=True)
+    source_version = models.CharField(max_length=255, null=True, blank=True)
+    row_count = models.IntegerField(default=0)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        managed = True
+        db_table = "report_ReportSnapshot"
@@ -0,0 +1,231 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# GET parameters that don't change the generated output
+IGNORED_PARAMETERS = ("async",)
+
+SCOPE_USER = "user"
+SCOPE_RIGHTS = "rights"
+
+
+def normalize_parameters(params):
+    return sorted(
+        (str(k), str(v)) for k, v in (params or {}).items() if k not in IGNORED_PARAMETERS
+    )
+
+
+def permission_scope(user, scope=SCOPE_USER):
+    """
+    Part of the cache key restricting the users an output can be shared with. With the "rights" scope, users with
+    the same rights share the outputs, only use it if the report queries don't filter on the user (location...).
+    """
+    if scope == SCOPE_RIGHTS:
+        rights = ",".join(str(r) for r in sorted(getattr(user, "rights", None) or []))
+        return "rights:" + hashlib.sha1(rights.encode("utf-8")).hexdigest()
+    return f"user:{user.id}"
+
+
+def output_cache_key(report_name, report_format, definition_version, params, scope):
+    payload = json.dumps([report_name, report_format, definition_version, normalize_parameters(params), scope])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FileOutputStore(object):
+    """
+    Local directory of generated outputs, named by key. The modification time of a file is its creation
+    time (for the TTL) and its access time is updated on each read (for the LRU eviction when max_bytes is exceeded).
+    Expired files are swept on write and, at most every sweep_interval seconds, on read.
+    """
+
+    def __init__(self, directory, max_bytes, ttl, sweep_interval=60):
+        self._lock = threading.Lock()
+        self.configure(directory, max_bytes, ttl, sweep_interval)
+
+    def configure(self, directory, max_bytes, ttl, sweep_interval=60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        self.sweep(force=False)
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime + self.ttl < time.time():
+                os.unlink(path)
+                return None
+            os.utime(path, (time.time(), stat.st_mtime))
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, write_file, ttl=None):
+        """
+        Stores an output written by write_file(path), the file is only visible once completely written
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        os.close(fd)
+        try:
+            write_file(tmp_path)
+            path = self.path(key)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        if ttl and ttl != self.ttl:
+            # the TTL check is based on mtime, shift it so the entry expires after its own TTL
+            now = time.time()
+            os.utime(path, (now, now + ttl - self.ttl))
+        self.sweep()
+        return path
+
+    def set(self, key, content, ttl=None):
+        def write_file(path):
+            with open(path, "wb") as f:
+                f.write(content)
+
+        self.write(key, write_file, ttl)
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, force=True):
+        """
+        Removes the expired outputs (and leftover temporary files), then the least recently used ones until the
+        store fits in max_bytes
+        """
+        now = time.time()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return
+        with self._lock:
+            self._last_sweep = now
+            if not os.path.isdir(self.directory):
+                return
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                    if stat.st_mtime + self.ttl < now:
+                        os.unlink(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(".tmp-"):
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+                total += stat.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class DjangoCacheOutputStore(object):
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+
+        return caches[self.alias]
+
+    def get(self, key):
+        content = self.cache.get(f"report_output:{key}")
+        return io.BytesIO(content) if content is not None else None
+
+    def set(self, key, content, ttl=None):
+        self.cache.set(f"report_output:{key}", content, ttl or self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(f"report_output:{key}")
+
+
+class ReportOutputCache(object):
+    """
+    Cache of the generated reports, keyed by report name, format, definition version, normalized parameters and
+    the permission scope of the user. Disabled when the TTL is 0.
+    """
+
+    def __init__(self):
+        self.ttl = 0
+        self.scope = SCOPE_USER
+        self.store = None
+
+    def configure(self, ttl, max_bytes, directory="", backend="", scope=SCOPE_USER):
+        self.ttl = ttl
+        self.scope = scope
+        if backend:
+            self.store = DjangoCacheOutputStore(backend, ttl)
+        else:
+            directory = directory or os.path.join(tempfile.gettempdir(), "openimis-report-outputs")
+            self.store = FileOutputStore(directory, max_bytes, ttl)
+
+    @property
+    def enabled(self):
+        return bool(self.ttl and self.store)
+
+    def key(self, user, report_name, report_format, definition_version, params):
+        return output_cache_key(
+            report_name, report_format, definition_version, params, permission_scope(user, self.scope)
+        )
+
+    def get(self, key):
+        """
+        :return: a binary file-like object with the output or None
+        """
+        if not self.enabled:
+            return None
+        try:
+            return self.store.get(key)
+        except Exception:
+            logger.exception("failed to read a report from the output cache")
+            return None
+
+    def set(self, key, content, ttl=None):
+        if not self.enabled:
+            return
+        try:
+            self.store.set(key, content, ttl)
+        except Exception:
+            logger.exception("failed to write a report in the output cache")
+
+
+report_output_cache = ReportOutputCache()
+
+# Outputs pre-rendered by the report schedules, see report.schedules
+precomputed_outputs = ReportOutputCache()
+
+# Outputs of the asynchronous report jobs until they are downloaded, see report.jobs
+job_output_store = FileOutputStore(
+    os.path.join(tempfile.gettempdir(), "openimis-report-jobs"), 1024 * 1024 * 1024, 24 * 3600
+)
+
+# Previews generated by the ReportBro designer, see views.reportbro_previewer
+preview_store = FileOutputStore(os.path.join(tempfile.gettempdir(), "openimis-report-previews"), 256 * 1024 * 1024, 3600)
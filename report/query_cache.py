@@ -0,0 +1,140 @@
+"""
+Opt-in, in-process cache of the stored procedure results, for the reports calling the same procedure with the same
+parameters within minutes (the PDF then the xlsx of a report...). Only the procedures given a TTL in
+report_query_cache_ttls are cached, the results are kept under report_query_cache_max_bytes (estimated sizes).
+Modules invalidate the results when the data changes, explicitly:
+
+    query_cache.invalidate("uspSSRSPremiumCollection")
+
+or by tying procedures to models, the results being dropped when an instance is saved or deleted:
+
+    query_cache.invalidate_on(Premium, "uspSSRSPremiumCollection", "uspSSRSPremiumDistribution")
+
+The results are cached per process. So that an invalidation reaches the other processes, each procedure has a
+generation counter in the Django cache report_query_cache_backend, part of the result keys and incremented by
+invalidate: it must be a cache shared by the processes (Redis, Memcached...), with the default local memory cache
+the other processes keep serving their results until the TTL expires. Without a backend only the results of the
+calling process are dropped.
+"""
+import sys
+from array import array
+
+from .cache import LRUCache
+from .columnar import ColumnarResult
+from .output_cache import normalize_parameters
+
+# rows measured to estimate the size of a list of dicts
+SIZE_SAMPLE = 100
+
+GENERATION_KEY = "report_query_cache_generation:{}"
+
+
+def result_size(rows):
+    """
+    Estimated memory of a stored procedure result, in bytes
+    """
+    if isinstance(rows, ColumnarResult):
+        size = 0
+        for name in rows.columns:
+            values = rows.column(name)
+            if isinstance(values, array):
+                size += values.buffer_info()[1] * values.itemsize
+            else:
+                size += sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values[:SIZE_SAMPLE]) * (
+                    len(values) / min(len(values), SIZE_SAMPLE) if values else 0
+                )
+        return int(size)
+    sample = rows[:SIZE_SAMPLE]
+    if not sample:
+        return sys.getsizeof(rows)
+    sample_size = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values()) for row in sample)
+    return int(sys.getsizeof(rows) + sample_size * len(rows) / len(sample))
+
+
+class QueryResultCache(object):
+    def __init__(self):
+        self.ttls = {}
+        self.results = LRUCache(maxsize=None, max_weight=128 * 1024 * 1024, weigher=result_size)
+        self._models = {}
+        self.backend = ""
+
+    def configure(self, ttls, max_bytes, backend=""):
+        """
+        :param backend: alias of the Django cache holding the generations shared by the processes, "" for none
+        """
+        self.ttls = dict(ttls or {})
+        self.results.max_weight = max_bytes
+        self.backend = backend
+        self.results.clear()
+
+    def _shared(self):
+        if not self.backend:
+            return None
+        from django.core.cache import caches
+
+        return caches[self.backend]
+
+    def generation(self, stored_procedure_name):
+        shared = self._shared()
+        return shared.get(GENERATION_KEY.format(stored_procedure_name), 0) if shared is not None else 0
+
+    def ttl(self, stored_procedure_name):
+        return self.ttls.get(stored_procedure_name, 0)
+
+    def key(self, stored_procedure_name, params, columnar=False):
+        return (stored_procedure_name, tuple(normalize_parameters(params)), columnar,
+                self.generation(stored_procedure_name))
+
+    def get(self, key):
+        rows = self.results.get(key)
+        if rows is None or isinstance(rows, ColumnarResult):
+            return rows
+        # the callers may modify the rows, each one gets its own copy
+        return [dict(row) for row in rows]
+
+    def set(self, key, rows):
+        ttl = self.ttl(key[0])
+        if ttl:
+            self.results.set(key, rows if isinstance(rows, ColumnarResult) else [dict(row) for row in rows], ttl)
+
+    def invalidate(self, *stored_procedure_names):
+        """
+        Drops the cached results of the given procedures, or all of them if none is given, in this process and,
+        through their generations, in the other ones
+        :return: number of dropped results (in this process)
+        """
+        shared = self._shared()
+        if shared is not None:
+            for name in stored_procedure_names or self.ttls:
+                key = GENERATION_KEY.format(name)
+                # add fails if the counter exists, incr fails if it expired in between
+                if not shared.add(key, 1, None):
+                    try:
+                        shared.incr(key)
+                    except ValueError:
+                        shared.set(key, 1, None)
+        if not stored_procedure_names:
+            count = len(self.results)
+            self.results.clear()
+            return count
+        return self.results.invalidate(lambda key: key[0] in stored_procedure_names)
+
+    def invalidate_on(self, model, *stored_procedure_names):
+        """
+        Drops the cached results of the procedures when an instance of the model is saved or deleted
+        """
+        from django.db.models.signals import post_delete, post_save
+
+        procedures = self._models.setdefault(model, set())
+        if not procedures:
+            post_save.connect(self._model_changed, sender=model, weak=False)
+            post_delete.connect(self._model_changed, sender=model, weak=False)
+        procedures.update(stored_procedure_names)
+
+    def _model_changed(self, sender, **kwargs):
+        procedures = self._models.get(sender)
+        if procedures:
+            self.invalidate(*procedures)
+
+
+query_cache = QueryResultCache()
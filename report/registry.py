@@ -0,0 +1,78 @@
+"""
+Lazy discovery of the module reports.
+A module can expose a lightweight {app}/report_manifest.py next to its report.py:
+
+    report_manifest = [
+        {
+            "name": "claim_overview",
+            "engine": 0,
+            "description": "Claim overview",
+            "module": "claim",
+            "permission": ["131213"],
+        },
+    ]
+
+Only the manifest is imported at startup, the heavy report.py (python_query, default_report) is imported the first
+time one of these keys is read. definitions_module can be set on an entry when the report_definitions aren't
+in {app}.report.
+"""
+import importlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+LAZY_KEYS = ("python_query", "default_report")
+
+
+class LazyReport(dict):
+    """
+    Report registry entry built from a manifest, its python_query and default_report are loaded on first access
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, manifest, definitions_module):
+        super().__init__(manifest)
+        self.definitions_module = definitions_module
+        self.loaded = False
+
+    def load(self):
+        with self._lock:
+            if self.loaded:
+                return
+            module = importlib.import_module(self.definitions_module)
+            definition = next(
+                (d for d in getattr(module, "report_definitions", []) if d.get("name") == self["name"]), None
+            )
+            if definition is None:
+                raise LookupError(f"report {self['name']} not found in {self.definitions_module}.report_definitions")
+            self.update(definition)
+            self.loaded = True
+            logger.debug(f"report {self['name']} loaded from {self.definitions_module}")
+
+    def __getitem__(self, key):
+        if key in LAZY_KEYS and not self.loaded:
+            self.load()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key in LAZY_KEYS and not self.loaded:
+            self.load()
+        return super().get(key, default)
+
+
+def load_report_manifest(app):
+    """
+    :return: the LazyReport entries of the app manifest, None if the app has no manifest
+    """
+    try:
+        module = importlib.import_module(f"{app}.report_manifest")
+    except ModuleNotFoundError as exc:
+        if exc.name in (app, f"{app}.report_manifest"):
+            return None
+        raise
+    manifest = getattr(module, "report_manifest", None)
+    if not isinstance(manifest, list):
+        return None
+    return [LazyReport(entry, entry.get("definitions_module", f"{app}.report")) for entry in manifest]
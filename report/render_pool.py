@@ -0,0 +1,189 @@
+"""
+Process pool render mode: the ReportBro layout is pure Python and CPU bound, rendering in worker processes avoids
+sharing the GIL of the web worker and keeps the memory of the renders out of it.
+Workers are started when the pool is configured (at ReportConfig.ready()), with Django set up and the fonts
+resolved, and they are recycled after a number of jobs or when their peak RSS goes above a ceiling, the replacement
+workers being started before the old ones are stopped. The outputs come back through temporary files instead of
+being pickled.
+The pool belongs to a web process: with several web workers (gunicorn --workers), the number of render processes is
+the number of web workers times report_render_processes.
+"""
+import logging
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from reportbro import ReportBroError
+
+from .metrics import peak_rss_kb
+
+logger = logging.getLogger(__name__)
+
+RENDER_MODE_THREAD = "thread"
+RENDER_MODE_PROCESS = "process"
+
+# set in the render processes, which render in their own thread and don't start a pool of their own
+_in_worker = False
+
+
+def _init_worker():
+    global _in_worker
+    _in_worker = True
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    from .fonts import FontRegistry
+
+    FontRegistry.fonts()
+
+
+def _warm():
+    """
+    No-op job, submitted once per worker so that all of them are started (and initialized) ahead of the renders
+    """
+    return os.getpid()
+
+
+def _render(report_name, definition, data, report_format, local_file, is_test_data, output_dir, page_numbers=None):
+    """
+    Runs in the worker process
+    :return: tuple (error, output file, peak RSS in MB)
+    """
+    from .services import render_report
+
+    output_file = local_file
+    if not output_file:
+        fd, output_file = tempfile.mkstemp(suffix=f".{report_format}", dir=output_dir or None)
+        os.close(fd)
+    try:
+        render_report(report_name, definition, data, report_format, local_file=output_file,
+                      is_test_data=is_test_data, page_numbers=page_numbers)
+    except Exception as exc:
+        if output_file != local_file:
+            os.unlink(output_file)
+        return getattr(exc, "error", None) or str(exc), None, peak_rss_kb() / 1024
+    return None, output_file, peak_rss_kb() / 1024
+
+
+class RenderPool(object):
+    """
+    Pool of pre-warmed render processes. The executor is replaced (the old one finishes its running jobs) once
+    max_jobs_per_worker jobs per process have been run or when a worker reports a peak RSS above max_worker_memory_mb.
+    A process forked from the one that started the pool (gunicorn --preload) starts its own.
+    """
+
+    def __init__(self):
+        self.mode = RENDER_MODE_THREAD
+        self.processes = 2
+        self.max_jobs_per_worker = 50
+        self.max_worker_memory_mb = 1024
+        self.start_method = "spawn"
+        self.output_dir = ""
+        self._executor = None
+        self._pid = None
+        self._jobs = 0
+        self._lock = threading.Lock()
+
+    def configure(self, mode, processes, max_jobs_per_worker, max_worker_memory_mb, start_method="spawn",
+                  output_dir=""):
+        self.shutdown()
+        self.mode = RENDER_MODE_THREAD if _in_worker else mode
+        self.processes = processes
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_memory_mb = max_worker_memory_mb
+        self.start_method = start_method
+        self.output_dir = output_dir
+        if self.enabled:
+            self.start()
+
+    @property
+    def enabled(self):
+        return self.mode == RENDER_MODE_PROCESS
+
+    def _new_executor(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=_init_worker,
+        )
+        # the executor starts a process per submitted job until max_workers, warm them all now
+        for _ in range(self.processes):
+            executor.submit(_warm)
+        self._jobs = 0
+        self._pid = os.getpid()
+        return executor
+
+    def start(self):
+        """
+        Starts the render processes if they aren't running in this process yet
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = self._new_executor()
+            return self._executor
+
+    def recycle(self, executor=None):
+        """
+        Replaces the executor (or the given one if it is still the current one) by a new, warmed one
+        """
+        with self._lock:
+            if self._executor is None or (executor is not None and executor is not self._executor):
+                return
+            old = self._executor
+            self._executor = self._new_executor()
+        old.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            old, self._executor = self._executor, None
+        if old is not None and self._pid == os.getpid():
+            old.shutdown(wait=False)
+
+    def render(self, report_name, definition, data, report_format, local_file='', is_test_data=None,
+               page_numbers=None):
+        """
+        Same contract as services.render_report
+        """
+        executor = self.start()
+        future = executor.submit(
+            _render, report_name, definition, data, report_format, local_file, is_test_data, self.output_dir,
+            page_numbers,
+        )
+        try:
+            error, output_file, peak_rss_mb = future.result()
+        except (pickle.PicklingError, TypeError, AttributeError) as exc:
+            logger.warning(f"report {report_name} data can't be sent to a render process, rendering locally: {exc}")
+            from .services import render_report
+
+            return render_report(report_name, definition, data, report_format, local_file=local_file,
+                                 is_test_data=is_test_data, page_numbers=page_numbers)
+        except BrokenProcessPool as exc:
+            self.recycle(executor)
+            logger.exception(f"render process died while generating {report_name}")
+            raise ReportBroError(str(exc))
+
+        with self._lock:
+            self._jobs += 1
+            exhausted = self._jobs >= self.max_jobs_per_worker * self.processes
+        if exhausted or (self.max_worker_memory_mb and peak_rss_mb > self.max_worker_memory_mb):
+            logger.debug(f"recycling the render processes, peak RSS {peak_rss_mb:.0f}MB")
+            self.recycle(executor)
+
+        if error:
+            raise ReportBroError(error)
+        if local_file:
+            return None
+        try:
+            with open(output_file, "rb") as f:
+                return f.read()
+        finally:
+            os.unlink(output_file)
+
+
+render_pool = RenderPool()
@@ -0,0 +1,115 @@
+"""
+Database routing of the report queries. The queries of a report run (run_stored_proc_report, and the ORM queries
+of the python_query using report_queryset) go to the report_database alias, a read replica for example, or to the
+alias given to the report in report_database_overrides. When the alias isn't configured or can't be reached, the
+queries fall back to the default database.
+A statement timeout (report_statement_timeout or the report value in report_statement_timeouts, in seconds) is
+set on the report connection for the time of the query, on PostgreSQL and SQL Server.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+
+from .apps import ReportConfig
+
+logger = logging.getLogger(__name__)
+
+_current_alias = ContextVar("report_database", default=None)
+
+
+def _configured_alias(report_name=None):
+    alias = ReportConfig.report_database_overrides.get(report_name) if report_name else None
+    return alias or ReportConfig.report_database or DEFAULT_DB_ALIAS
+
+
+def resolve_alias(report_name=None):
+    """
+    :return: the database alias of the report queries, the default one if the configured alias is missing or down
+    """
+    alias = _configured_alias(report_name)
+    if alias == DEFAULT_DB_ALIAS:
+        return alias
+    if alias not in connections.databases:
+        logger.warning(f"report database {alias} is not configured, using {DEFAULT_DB_ALIAS}")
+        return DEFAULT_DB_ALIAS
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        logger.exception(f"report database {alias} can't be reached, using {DEFAULT_DB_ALIAS}")
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+def report_db_alias():
+    """
+    Database alias of the current report run, the configured report database outside of a run
+    """
+    return _current_alias.get() or resolve_alias()
+
+
+def report_connection():
+    return connections[report_db_alias()]
+
+
+def report_queryset(queryset):
+    """
+    Routes an ORM query of a python_query to the report database
+    """
+    return queryset.using(report_db_alias())
+
+
+def statement_timeout_for(report_name=None):
+    timeout = ReportConfig.report_statement_timeouts.get(report_name) if report_name else None
+    return timeout if timeout is not None else ReportConfig.report_statement_timeout
+
+
+@contextmanager
+def statement_timeout(connection, seconds):
+    """
+    Limits the duration of the statements run on the connection in the block, does nothing if seconds is 0 or the
+    database isn't PostgreSQL or SQL Server
+    """
+    if not seconds:
+        yield
+        return
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cur:
+            cur.execute("SET statement_timeout = %s", [int(seconds * 1000)])
+        try:
+            yield
+        finally:
+            try:
+                with connection.cursor() as cur:
+                    cur.execute("RESET statement_timeout")
+            except DatabaseError:
+                # aborted transaction, the SET is rolled back with it
+                logger.debug("failed to reset the statement timeout", exc_info=True)
+    elif connection.vendor == "microsoft":
+        # query timeout of the pyodbc connection
+        connection.ensure_connection()
+        previous = connection.connection.timeout
+        connection.connection.timeout = int(seconds)
+        try:
+            yield
+        finally:
+            connection.connection.timeout = previous
+    else:
+        logger.debug(f"statement timeout not supported on {connection.vendor}")
+        yield
+
+
+@contextmanager
+def report_database(report_name):
+    """
+    Routes the queries of a report run to its database, with its statement timeout
+    """
+    alias = resolve_alias(report_name)
+    token = _current_alias.set(alias)
+    try:
+        with statement_timeout(connections[alias], statement_timeout_for(report_name)):
+            yield alias
+    finally:
+        _current_alias.reset(token)
@@ -0,0 +1,136 @@
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_NORMAL = 0
+PRIORITY_HEAVY = 1
+
+
+class RenderRejected(Exception):
+    """
+    The render couldn't be scheduled, status is the HTTP status to return (429 or 503)
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Ticket(object):
+    __slots__ = ("priority", "seq", "report_name", "user_id")
+
+    def __init__(self, priority, seq, report_name, user_id):
+        self.priority = priority
+        self.seq = seq
+        self.report_name = report_name
+        self.user_id = user_id
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RenderScheduler(object):
+    """
+    Bounds the number of reports rendered at the same time on this process.
+    A render waits in a bounded priority queue until a slot is free and the per report limit allows it to run.
+    Heavy reports are queued behind the other ones. When the queue is full (or the wait times out), RenderRejected
+    is raised with a 503 status. A user with max_per_user renders already running or queued gets a 429.
+    """
+
+    def __init__(self):
+        self.max_concurrent = 4
+        self.max_queue = 20
+        self.max_per_report = 2
+        self.max_per_user = 2
+        self.queue_timeout = 60
+        self.retry_after = 30
+        self.heavy_reports = set()
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._running_by_report = Counter()
+        self._in_flight_by_user = Counter()
+
+    def configure(self, max_concurrent, max_queue, max_per_report, max_per_user, queue_timeout, retry_after,
+                  heavy_reports=()):
+        with self._cond:
+            self.max_concurrent = max_concurrent
+            self.max_queue = max_queue
+            self.max_per_report = max_per_report
+            self.max_per_user = max_per_user
+            self.queue_timeout = queue_timeout
+            self.retry_after = retry_after
+            self.heavy_reports = set(heavy_reports)
+
+    def is_heavy(self, report_config):
+        return bool(report_config.get("heavy")) or report_config.get("name") in self.heavy_reports
+
+    def _can_run(self, ticket):
+        return not self.max_per_report or self._running_by_report[ticket.report_name] < self.max_per_report
+
+    def _next(self):
+        """
+        First queued ticket, in priority order, allowed by the per report limit
+        """
+        if self._running >= self.max_concurrent:
+            return None
+        for ticket in sorted(self._queue):
+            if self._can_run(ticket):
+                return ticket
+        return None
+
+    def acquire(self, report_name, user_id, heavy=False):
+        with self._cond:
+            if self.max_per_user and self._in_flight_by_user[user_id] >= self.max_per_user:
+                raise RenderRejected("too many reports requested by the user", 429, self.retry_after)
+            if len(self._queue) >= self.max_queue:
+                raise RenderRejected("report render queue is full", 503, self.retry_after)
+            ticket = _Ticket(PRIORITY_HEAVY if heavy else PRIORITY_NORMAL, next(self._seq), report_name, user_id)
+            self._queue.append(ticket)
+            self._in_flight_by_user[user_id] += 1
+            deadline = time.monotonic() + self.queue_timeout if self.queue_timeout else None
+            try:
+                while self._next() is not ticket:
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        raise RenderRejected("timed out waiting for a report render slot", 503, self.retry_after)
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._in_flight_by_user[user_id] -= 1
+                raise
+            finally:
+                self._queue.remove(ticket)
+                # another ticket may be eligible now that this one left the queue
+                self._cond.notify_all()
+            self._running += 1
+            self._running_by_report[report_name] += 1
+            return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            self._running -= 1
+            self._running_by_report[ticket.report_name] -= 1
+            self._in_flight_by_user[ticket.user_id] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, report_config, user_id):
+        ticket = self.acquire(report_config["name"], user_id, heavy=self.is_heavy(report_config))
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._cond:
+            return {"running": self._running, "queued": len(self._queue)}
+
+
+render_scheduler = RenderScheduler()
@@ -0,0 +1,94 @@
+import datetime
+import logging
+
+from django.db.models import Q
+
+from .apps import ReportConfig
+from .cron import CronExpression
+from .metrics import report_trace
+from .models import ReportSchedule
+from .output_cache import precomputed_outputs
+from .services import get_report_definition_version, run_report
+
+logger = logging.getLogger(__name__)
+
+
+def parameter_context(now):
+    first_of_month = now.date().replace(day=1)
+    last_of_previous_month = first_of_month - datetime.timedelta(days=1)
+    return {
+        "today": now.date().isoformat(),
+        "year": now.year,
+        "month": now.month,
+        "previous_month": last_of_previous_month.month,
+        "previous_month_year": last_of_previous_month.year,
+        "previous_month_start": last_of_previous_month.replace(day=1).isoformat(),
+        "previous_month_end": last_of_previous_month.isoformat(),
+        "previous_year": now.year - 1,
+    }
+
+
+def resolve_parameters(parameters, now):
+    """
+    Formats the string parameters of a schedule with parameter_context, e.g. {"month": "{previous_month}"}
+    """
+    context = parameter_context(now)
+    return {k: v.format(**context) if isinstance(v, str) else v for k, v in (parameters or {}).items()}
+
+
+class ReportScheduleService(object):
+    """
+    Pre-renders the due ReportSchedule outputs into precomputed_outputs, where views.report picks them up
+    """
+
+    def run_due(self, now=None):
+        now = now or datetime.datetime.now()
+        schedules = ReportSchedule.objects.filter(
+            Q(next_run_at__isnull=True) | Q(next_run_at__lte=now), is_active=True
+        )
+        results = []
+        for schedule in schedules:
+            try:
+                results.append((schedule, self.run(schedule, now)))
+            except Exception:
+                # one broken schedule doesn't hold back the other ones
+                logger.exception(f"report schedule {schedule.id} ({schedule.name}) failed")
+                results.append((schedule, False))
+        return results
+
+    def run(self, schedule, now=None):
+        """
+        A schedule with an invalid cron expression is deactivated instead of being generated on every run
+        :return: True if all the formats of the schedule were generated
+        """
+        now = now or datetime.datetime.now()
+        schedule.last_run_at = now
+        try:
+            schedule.next_run_at = CronExpression(schedule.cron).next_after(now)
+        except ValueError as exc:
+            logger.error(f"report schedule {schedule.id} ({schedule.name}) deactivated: {exc}")
+            schedule.is_active = False
+            schedule.last_error = f"cron: {exc}"
+            schedule.save(update_fields=["last_run_at", "is_active", "last_error"])
+            return False
+
+        errors = []
+        report_config = ReportConfig.get_report(schedule.name)
+        if not report_config:
+            errors.append(f"unknown report {schedule.name}")
+        else:
+            params = resolve_parameters(schedule.parameters, now)
+            definition_version = get_report_definition_version(schedule.name, report_config["default_report"])
+            for report_format in schedule.formats or ["pdf"]:
+                try:
+                    with report_trace(schedule.name, report_format):
+                        output = run_report(schedule.user, report_config, report_format, params)
+                    key = precomputed_outputs.key(schedule.user, schedule.name, report_format, definition_version,
+                                                  params)
+                    precomputed_outputs.set(key, output)
+                except Exception as exc:
+                    logger.exception(f"scheduled report {schedule.name} failed for {report_format}")
+                    errors.append(f"{report_format}: {exc}")
+        schedule.last_error = "\n".join(errors) or None
+        schedule.save(update_fields=["last_run_at", "next_run_at", "last_error"])
+        return not errors
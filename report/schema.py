@@ -4,11 +4,22 @@ import graphene
 from core.schema import OpenIMISMutation
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ValidationError
+from django.urls import reverse
 from django.utils.translation import gettext as _
 from core.utils import TimeUtils
 from report.apps import ReportConfig
-from report.models import ReportDefinition
-from report.services import get_report_definition
+from report.fields import minify_json
+from report.jobs import ReportJobService
+from report.models import ReportDefinition, ReportJob
+from report.default_report import default_report
+from report.services import (
+    ReportDefinitionLoader,
+    compile_report_definition,
+    definition_digest,
+    get_report_definition,
+    has_report_permission,
+    report_definition_cache,
+)
 from django.core.exceptions import PermissionDenied
 
 logger = logging.getLogger(__file__)
@@ -21,11 +32,45 @@ class ReportGQLType(graphene.ObjectType):
     description = graphene.String()
     module = graphene.String()
     permission = graphene.String()
+    definition_version = graphene.String(
+        description="Digest of the definition in use, to know if a cached definition is outdated without "
+                    "fetching the definition"
+    )
+    overridden = graphene.Boolean(description="True if the default definition is overridden")
 
     def resolve_definition(self, info, **kwargs):
         if not info.context.user.has_perms(ReportConfig.gql_query_report_perms):
             raise PermissionDenied(_("unauthorized"))
-        return get_report_definition(self.get("name"), self.get("default_report"))
+        return get_report_definition(
+            self.get("name"), self.get("default_report"), loader=ReportDefinitionLoader.for_request(info.context)
+        )
+
+    def resolve_definition_version(self, info, **kwargs):
+        version = ReportDefinitionLoader.for_request(info.context).load_version(self.get("name"))
+        if version:
+            return version[4]
+        return definition_digest(self.get("default_report") or default_report)
+
+    def resolve_overridden(self, info, **kwargs):
+        return ReportDefinitionLoader.for_request(info.context).load_version(self.get("name")) is not None
+
+
+class ReportJobGQLType(graphene.ObjectType):
+    id = graphene.UUID()
+    name = graphene.String()
+    report_format = graphene.String()
+    status = graphene.Int()
+    error = graphene.String()
+    client_mutation_id = graphene.String()
+    requested_at = graphene.DateTime()
+    started_at = graphene.DateTime()
+    finished_at = graphene.DateTime()
+    download_url = graphene.String()
+
+    def resolve_download_url(self, info, **kwargs):
+        if self.status != ReportJob.STATUS_SUCCESS:
+            return None
+        return reverse("report_job_download", args=[self.id])
 
 
 class Query(graphene.ObjectType):
@@ -37,40 +82,73 @@ class Query(graphene.ObjectType):
         ReportGQLType,
         name=graphene.String(required=True),
     )
+    report_job = graphene.Field(
+        ReportJobGQLType,
+        id=graphene.UUID(),
+        client_mutation_id=graphene.String(),
+        description="Status of a report generated asynchronously, by id or by the client_mutation_id of "
+                    "the GenerateReportMutation",
+    )
 
     def resolve_reports(self, info, **kwargs):
         if not info.context.user.has_perms(ReportConfig.gql_query_report_perms):
             raise PermissionDenied(_("unauthorized"))
-        return [
-            report
-            for report in ReportConfig.reports
-            if info.context.user.has_perms(report["permission"])
-        ]
+        reports = ReportConfig.get_allowed_reports(info.context.user, info.context)
+        # the overridden definitions are then fetched at once if a definition field is requested
+        ReportDefinitionLoader.for_request(info.context).add(report["name"] for report in reports)
+        return reports
 
     def resolve_report(self, info, name, **kwargs):
         if not info.context.user.has_perms(ReportConfig.gql_query_report_perms):
             raise PermissionDenied(_("unauthorized"))
         return ReportConfig.get_report(name)
 
+    def resolve_report_job(self, info, id=None, client_mutation_id=None, **kwargs):
+        if not info.context.user.has_perms(ReportConfig.gql_query_report_perms):
+            raise PermissionDenied(_("unauthorized"))
+        jobs = ReportJob.objects.filter(user=info.context.user)
+        if id:
+            jobs = jobs.filter(id=id)
+        elif client_mutation_id:
+            jobs = jobs.filter(client_mutation_id=client_mutation_id)
+        else:
+            return None
+        job = jobs.order_by("-requested_at").first()
+        # through the service, for the jobs lost by a restarted process
+        return ReportJobService(info.context.user).get(job.id) if job else None
+
 
 def update_or_create_report_definition(data, user):
     data.pop("client_mutation_id", None)
     data.pop("client_mutation_label", None)
     name = data.pop("name", None)
+    template = ReportConfig.get_report(name)
+    if "definition" in data:
+        data["definition"] = minify_json(data["definition"])
+        # rejects an invalid definition before it replaces the current one
+        data["compiled"] = compile_report_definition(
+            name, data["definition"], template.get("default_report") if template else None
+        )
 
     report_definition = ReportDefinition.objects.filter(
         name=name, validity_to__isnull=True
     ).first()
     if report_definition:
+        if all(getattr(report_definition, k) == v for k, v in data.items() if k != "compiled"):
+            # nothing changed, no new version
+            if data.get("compiled") and report_definition.compiled != data["compiled"]:
+                report_definition.compiled = data["compiled"]
+                report_definition.save(update_fields=["compiled"])
+            return report_definition
         report_definition.save_history()
     else:
-        template = ReportConfig.get_report(name)
         report_definition = ReportDefinition.objects.create(
             name=template.get("name"), engine=template.get("engine")
         )
 
     [setattr(report_definition, k, v) for k, v in data.items()]
     report_definition.save()
+    report_definition_cache.invalidate(name)
     return report_definition
 
 
@@ -108,5 +186,47 @@ class OverrideReportMutation(OpenIMISMutation):
             ]
 
 
+class GenerateReportMutation(OpenIMISMutation):
+    """
+    Generate a report asynchronously, the job can then be polled with the report_job query
+    """
+
+    _mutation_module = "report"
+    _mutation_class = "GenerateReportMutation"
+
+    class Input(OpenIMISMutation.Input):
+        name = graphene.String(required=True)
+        report_format = graphene.String(required=False)
+        parameters = graphene.JSONString(required=False)
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        try:
+            if type(user) is AnonymousUser or not user.id:
+                raise ValidationError(_("mutation.authentication_required"))
+            report_config = ReportConfig.get_report(data["name"])
+            if not report_config:
+                raise ValidationError(_("report.mutation.unknown_report"))
+            if not has_report_permission(user, report_config):
+                raise PermissionDenied(_("unauthorized"))
+
+            ReportJobService(user).submit(
+                data["name"],
+                data.get("report_format") or "pdf",
+                data.get("parameters") or {},
+                client_mutation_id=data.get("client_mutation_id"),
+            )
+            return None
+        except Exception as exc:
+            logger.exception("report.mutation.failed_to_generate_report")
+            return [
+                {
+                    "message": _("report.mutation.failed_to_generate_report"),
+                    "detail": str(exc),
+                }
+            ]
+
+
 class Mutation(graphene.ObjectType):
     override_report = OverrideReportMutation.Field()
+    generate_report = GenerateReportMutation.Field()
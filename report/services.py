@@ -1,63 +1,426 @@
 import io
 import json
+import os
+from collections import namedtuple
+from contextlib import contextmanager
 
-from django.core.exceptions import ObjectDoesNotExist
-from django.contrib.staticfiles import finders
-from django.db import connection
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db.models import Q
 from django.http import FileResponse
 from reportbro import Report, ReportBroError
+from .cache import LRUCache
+from .columnar import ColumnarResult, reportbro_data
+from .compiler import COMPILED_KEY, COMPILED_VERSION, definition_metadata, validate_report_definition
 from .models import ReportDefinition
 from .default_report import default_report
+from .export import STREAM_FORMATS, stream_report
+from .fields import content_hash
+from .fonts import FontRegistry
+from .metrics import count, stage
+from .query_cache import query_cache
+from .render_pool import render_pool
+from .routing import report_connection, report_database
 from django.core.serializers.json import DjangoJSONEncoder
 import logging
 logger = logging.getLogger(__name__)
 
+ROW_DICT = "dict"
+ROW_TUPLE = "tuple"
+ROW_NAMEDTUPLE = "namedtuple"
+ROW_TYPES = (ROW_DICT, ROW_TUPLE, ROW_NAMEDTUPLE)
 
-def get_report_definition(report_name, default, report_date=None):
+
+class ReportDefinitionCache(object):
     """
-    Retrieves the report definition, either the default one (as parameter) or the overridden definition
-    :param report_name: name of the report to fetch, no module yet
-    :param default: default template
-    :param report_date: date for which we're running the report, for the definition validity
-    :return:
+    In-process LRU cache of the report definitions.
+    The overridden definition of a report is looked up once per name and the parsed definitions are kept by
+    (name, validity window, row id, definition digest) so that the large JSON template is only parsed once per
+    version.
+    Entries are invalidated when a ReportDefinition is saved in this process (see report.signals). As other
+    processes can override a definition, a cached lookup is only used after checking that the current row id and
+    definition hash of the report are unchanged (a query without the definition text).
+    """
+
+    def __init__(self, maxsize=64, ttl=300):
+        self.lookups = LRUCache(maxsize, ttl)
+        self.compiled = LRUCache(maxsize)
+
+    def configure(self, maxsize, ttl):
+        self.lookups.maxsize = maxsize
+        self.lookups.ttl = ttl
+        self.compiled.maxsize = maxsize
+        self.clear()
+
+    def lookup(self, report_name, report_date=None):
+        """
+        :return: tuple (cache key, definition) of the overridden definition or None if not overridden
+        """
+        if report_date is None:
+            from core import datetime
+
+            now = datetime.datetime.now()
+            entry = self.lookups.get(report_name, _MISSING)
+            if (
+                entry is not _MISSING
+                and (entry is None or _is_valid(entry[0], now))
+                and _current_versions([report_name], now).get(report_name) == _entry_version(entry)
+            ):
+                return entry
+        entry = _definition_entry(_query_report_definition(report_name, report_date))
+        if report_date is None:
+            self.lookups.set(report_name, entry)
+        return entry
+
+    def lookup_many(self, report_names, with_definition=True):
+        """
+        Current overridden definitions of several reports, the ones not in the cache are fetched in one query
+        :param with_definition: without it, the entries only hold the cache key (version) and aren't cached
+        :return: dict of report name to entry (see lookup) or None if not overridden
+        """
+        from core import datetime
+
+        now = datetime.datetime.now()
+        entries = {}
+        missing = []
+        for report_name in report_names:
+            entry = self.lookups.get(report_name, _MISSING)
+            if entry is not _MISSING and (entry is None or _is_valid(entry[0], now)):
+                entries[report_name] = entry
+            else:
+                missing.append(report_name)
+        if entries:
+            versions = _current_versions(entries, now)
+            for report_name in list(entries):
+                if versions.get(report_name) != _entry_version(entries[report_name]):
+                    # overridden or restored by another process
+                    del entries[report_name]
+                    missing.append(report_name)
+        if not missing:
+            return entries
+        queryset = ReportDefinition.objects.filter(
+            Q(name__in=missing) & (Q(validity_to__isnull=True) | Q(validity_to__gte=now))
+        )
+        if not with_definition:
+            queryset = queryset.defer("definition", "compiled")
+        definitions = {}
+        for definition in queryset:
+            # the current version is preferred to a history version still valid
+            if definition.name not in definitions or definition.validity_to is None:
+                definitions[definition.name] = definition
+        for report_name in missing:
+            definition = definitions.get(report_name)
+            if with_definition:
+                entry = _definition_entry(definition)
+                self.lookups.set(report_name, entry)
+            else:
+                entry = _definition_entry(definition, with_definition=False)
+            entries[report_name] = entry
+        return entries
+
+    def compile(self, key, definition, metadata=None):
+        """
+        :param metadata: compiled metadata saved with the definition, computed if missing or outdated
+        """
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            compiled = json.loads(definition)
+            if not metadata or metadata.get("version") != COMPILED_VERSION or metadata.get("digest") != key[4]:
+                metadata = definition_metadata(compiled, key[4])
+            compiled[COMPILED_KEY] = metadata
+            self.compiled.set(key, compiled)
+        return compiled
+
+    def invalidate(self, report_name):
+        self.lookups.pop(report_name)
+        self.compiled.invalidate(lambda key: key[0] == report_name)
+
+    def clear(self):
+        self.lookups.clear()
+        self.compiled.clear()
+
+
+_MISSING = object()
+
+report_definition_cache = ReportDefinitionCache()
+
+
+def _current_versions(report_names, now):
+    """
+    :return: dict of report name to (row id, definition hash) of the current overridden definitions
+    """
+    versions = {}
+    rows = ReportDefinition.objects.filter(
+        Q(name__in=list(report_names)) & (Q(validity_to__isnull=True) | Q(validity_to__gte=now))
+    ).values_list("name", "id", "definition_hash", "validity_to")
+    for name, definition_id, definition_hash, validity_to in rows:
+        # the current version is preferred to a history version still valid
+        if name not in versions or validity_to is None:
+            versions[name] = (definition_id, definition_hash)
+    return versions
+
+
+def _entry_version(entry):
+    return (entry[0][3], entry[0][4]) if entry else None
+
+
+def _definition_entry(definition, with_definition=True):
+    if not definition:
+        return None
+    key = (
+        definition.name, definition.validity_from, definition.validity_to, definition.id,
+        definition.definition_hash or definition_digest(definition.definition),
+    )
+    if not with_definition:
+        return key, None, None
+    return key, definition.definition, definition.compiled
+
+
+class ReportDefinitionLoader(object):
+    """
+    DataLoader-style loader of the overridden definitions for one request: the reports of a list are registered
+    with add() and the first load() fetches all of them at once (see ReportDefinitionCache.lookup_many)
+    """
+
+    def __init__(self):
+        self.pending = set()
+        self.entries = {}
+        self.versions = {}
+
+    @classmethod
+    def for_request(cls, request):
+        loader = getattr(request, "_report_definition_loader", None)
+        if loader is None:
+            loader = cls()
+            if request is not None:
+                request._report_definition_loader = loader
+        return loader
+
+    def add(self, report_names):
+        self.pending.update(name for name in report_names if name not in self.entries)
+
+    def load(self, report_name):
+        if report_name not in self.entries:
+            self.pending.add(report_name)
+            self.entries.update(report_definition_cache.lookup_many(self.pending))
+            self.pending.clear()
+        return self.entries[report_name]
+
+    def load_version(self, report_name):
+        """
+        Cache key of the overridden definition (or None), without fetching the definitions text
+        """
+        if report_name in self.entries:
+            entry = self.entries[report_name]
+        else:
+            if report_name not in self.versions:
+                self.versions.update(report_definition_cache.lookup_many(
+                    self.pending | {report_name}, with_definition=False
+                ))
+            entry = self.versions[report_name]
+        return entry[0] if entry else None
+
+
+def definition_digest(definition):
+    """
+    Stable (across processes) digest of a definition, used as its version
     """
+    if isinstance(definition, dict):
+        definition = json.dumps(definition, sort_keys=True)
+    return content_hash(definition)
+
+
+def compile_report_definition(report_name, definition, reference=None):
+    """
+    Validates a definition before it is saved: JSON syntax, parameters against the data of the report (described
+    by the reference definition) and ReportBro checks with the test data
+    :param definition: definition text
+    :param reference: default definition of the report (text or dict)
+    :return: the compiled metadata to store with the definition
+    :raises ValidationError: with the list of errors
+    """
+    if isinstance(reference, str):
+        reference = json.loads(reference)
+    parsed, errors = validate_report_definition(definition, reference)
+    if errors:
+        logger.info(f"invalid definition for report {report_name}: {errors}")
+        raise ValidationError(errors)
+    return definition_metadata(parsed, definition_digest(definition))
+
+
+def _is_valid(key, report_date):
+    validity_to = key[2]
+    return validity_to is None or validity_to >= report_date
+
+
+def _query_report_definition(report_name, report_date=None):
     if not report_date:
         from core import datetime
 
         report_date = datetime.datetime.now()
     try:
-        r = ReportDefinition.objects.get(
+        return ReportDefinition.objects.get(
             Q(name=report_name)
             & (Q(validity_to__isnull=True) | Q(validity_to__gte=report_date))
-        ).definition
+        )
     except ObjectDoesNotExist:
-        if default:
-            r = default
+        return None
+
+
+def get_report_definition(report_name, default, report_date=None, loader=None):
+    """
+    Retrieves the report definition, either the default one (as parameter) or the overridden definition
+    :param report_name: name of the report to fetch, no module yet
+    :param default: default template
+    :param report_date: date for which we're running the report, for the definition validity
+    :param loader: ReportDefinitionLoader of the request, for the current definitions of a list of reports
+    :return:
+    """
+    with stage("definition"):
+        if loader is not None and report_date is None:
+            entry = loader.load(report_name)
         else:
-            r = default_report
-    return r
+            entry = report_definition_cache.lookup(report_name, report_date)
+    if entry:
+        return entry[1]
+    if default:
+        return default
+    return default_report
+
+
+def get_report_definition_version(report_name, default, report_date=None):
+    """
+    Version of the definition used to run a report: digest of the overridden or default definition
+    """
+    entry = report_definition_cache.lookup(report_name, report_date)
+    if entry:
+        return entry[0][4]
+    return definition_digest(default if default else default_report)
 
 
-def run_stored_proc_report(stored_procedure_name, *args, **kwargs):
+def get_compiled_report_definition(report_name, default, report_date=None):
+    """
+    Same as get_report_definition but returns the parsed definition, from the in-process cache when possible
+    :param report_name: name of the report to fetch, no module yet
+    :param default: default template
+    :param report_date: date for which we're running the report, for the definition validity
+    :return: the definition as a dict, shared between requests so it must not be modified
+    """
+    with stage("definition"):
+        entry = report_definition_cache.lookup(report_name, report_date)
+        if not entry:
+            definition = default if default else default_report
+            if isinstance(definition, dict):
+                return definition
+            entry = ((report_name, None, None, None, definition_digest(definition)), definition)
+        return report_definition_cache.compile(*entry)
+
+
+def _stored_proc_sql(stored_procedure_name, kwargs):
+    sql_params = []
+    params = []
+    for k, v in kwargs.items():
+        sql_params.append(f"@{k} = %s")
+        params.append(v)
+    return f"EXEC [{stored_procedure_name}] {', '.join(sql_params)}", params
+
+
+def run_stored_proc_report(stored_procedure_name, *args, columnar=False, **kwargs):
     """
     Used to run uspSSRS* stored procedures
     :param stored_procedure_name: For example "usbSSRSEnroledFamilies"
     :param args: Unused, don't pass unnamed parameters
+    :param columnar: return a ColumnarResult, a read-only sequence of mappings taking a fraction of the memory
     :param kwargs: All parameters to pass to the stored procedure
-    :return: a list of dict with the results from the stored procedure
+    :return: a list of dict with the results from the stored procedure, from the query_cache if the procedure has
+             a TTL in report_query_cache_ttls
     """
-    with connection.cursor() as cur:
-        sql_params = []
-        params = []
-        for k, v in kwargs.items():
-            sql_params.append(f"@{k} = %s")
-            params.append(v)
-        sql = f"EXEC [{stored_procedure_name}] {', '.join(sql_params)}"
-
+    cache_key = None
+    if query_cache.ttl(stored_procedure_name):
+        cache_key = query_cache.key(stored_procedure_name, kwargs, columnar)
+        res = query_cache.get(cache_key)
+        if res is not None:
+            count("query_cache_hits", 1)
+            return res
+    with stage("db"), report_connection().cursor() as cur:
+        sql, params = _stored_proc_sql(stored_procedure_name, kwargs)
         cur.execute(sql, params)
-        res = _dictfetchall(cur)
-        return res
+        res = ColumnarResult.from_cursor(cur) if columnar else _dictfetchall(cur)
+        count("rows", len(res))
+    if cache_key:
+        query_cache.set(cache_key, res)
+    return res
+
+
+def stream_stored_proc_report(stored_procedure_name, *args, fetch_size=1000, row_type=ROW_DICT, max_rows=None,
+                              **kwargs):
+    """
+    Streaming variant of run_stored_proc_report, the rows are fetched by batches while iterating
+    :param stored_procedure_name: For example "usbSSRSEnroledFamilies"
+    :param args: Unused, don't pass unnamed parameters
+    :param fetch_size: number of rows fetched from the database at once
+    :param row_type: dict, tuple or namedtuple
+    :param max_rows: stop after this number of rows, the result is then flagged as truncated
+    :param kwargs: All parameters to pass to the stored procedure
+    :return: a StreamedRows, the procedure is executed when it is iterated
+    """
+    sql, params = _stored_proc_sql(stored_procedure_name, kwargs)
+    # the rows can be iterated after the report run, by a streamed response
+    connection = report_connection()
+
+    @contextmanager
+    def execute():
+        with connection.cursor() as cur:
+            cur.execute(sql, params)
+            yield cur
+
+    return StreamedRows(execute, fetch_size=fetch_size, row_type=row_type, max_rows=max_rows)
+
+
+class StreamedRows(object):
+    """
+    Iterable over the rows of a query, fetched with cursor.fetchmany(). The column names are only read once and
+    shared by all rows. Once iterated, row_count holds the number of returned rows and truncated is True if
+    max_rows was reached before the end of the result.
+    """
+
+    def __init__(self, execute, fetch_size=1000, row_type=ROW_DICT, max_rows=None):
+        """
+        :param execute: callable returning a context manager that yields an executed cursor
+        """
+        if row_type not in ROW_TYPES:
+            raise ValueError(f"unknown row type {row_type}")
+        self.execute = execute
+        self.fetch_size = fetch_size
+        self.row_type = row_type
+        self.max_rows = max_rows
+        self.columns = None
+        self.row_count = 0
+        self.truncated = False
+
+    def _row_factory(self):
+        if self.row_type == ROW_TUPLE:
+            return tuple
+        if self.row_type == ROW_NAMEDTUPLE:
+            return namedtuple("Row", self.columns, rename=True)._make
+        columns = self.columns
+        return lambda row: dict(zip(columns, row))
+
+    def __iter__(self):
+        self.row_count = 0
+        self.truncated = False
+        with self.execute() as cursor:
+            self.columns = tuple(col[0] for col in cursor.description)
+            make_row = self._row_factory()
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    if self.max_rows is not None and self.row_count >= self.max_rows:
+                        self.truncated = True
+                        return
+                    self.row_count += 1
+                    yield make_row(row)
 
 
 def _dictfetchall(cursor):
@@ -75,80 +438,76 @@ def generate_report(report_name, definition, data, report_format="pdf", local_fi
     :param report_name: Name of the report, only used for error reporting
     :param definition: Report definition, either a dict or a JSON string
     :param data: Data to pass to the report
-    :param report_format: pdf or xlsx
+    :param report_format: pdf, xlsx or, for single table reports, xlsx-stream or csv
     :param local_file: Leave out to get a response that will be included into a HTTP response, otherwise a local file where the report will be saved (for preview)
     :param is_test_data: If True, the report will be generated with test data
-    :return: A FileResponse or None if local_file is set
+    :return: A FileResponse or None if local_file is set, an iterable of bytes for xlsx-stream and csv
+    """
+    if report_format in STREAM_FORMATS:
+        report_definition = definition if isinstance(definition, dict) else json.loads(definition)
+        return stream_report(report_name, report_definition, data, report_format, local_file=local_file)
+    if report_format == "pdf":
+        from .apps import ReportConfig
+
+        data_source = ReportConfig.report_chunked_reports.get(report_name)
+        if data_source and len(data.get(data_source) or []) > ReportConfig.report_chunk_rows:
+            from .chunking import chunking_blocker, render_chunked
+
+            report_definition = definition if isinstance(definition, dict) else json.loads(definition)
+            blocker = chunking_blocker(report_definition, data_source)
+            if blocker:
+                logger.warning(f"report {report_name} rendered in one piece, it can't be chunked: {blocker}")
+            else:
+                with stage("chunks"):
+                    return render_chunked(report_name, report_definition, data, data_source,
+                                          ReportConfig.report_chunk_rows, ReportConfig.report_chunk_workers,
+                                          local_file=local_file, is_test_data=is_test_data)
+    if render_pool.enabled:
+        with stage("render"):
+            return render_pool.render(report_name, definition, data, report_format, local_file=local_file,
+                                      is_test_data=is_test_data)
+    return render_report(report_name, definition, data, report_format, local_file=local_file,
+                         is_test_data=is_test_data)
+
+
+def render_report(report_name, definition, data, report_format="pdf", local_file='', is_test_data=None,
+                  page_numbers=None):
+    """
+    Renders a PDF/XLSX report with ReportBro in the current process, see generate_report
+    :param page_numbers: tuple (offset, total or None) to continue the page numbers of previous chunks
     """
     try:
-        r = Report(definition if isinstance(definition, dict) else json.loads(definition), data,
-                   additional_fonts=[
-                       dict(
-                           value='firefly', filename=finders.find("report/reportbro/fonts/fireflysung.ttf")
-                       ),
-                       dict(
-                           value='dejavusans',
-                           filename=finders.find('report/reportbro/fonts/DejaVuSans.ttf'),
-                           bold_filename=finders.find('report/reportbro/fonts/DejaVuSans-Bold.ttf'),
-                           italic_filename=finders.find('report/reportbro/fonts/DejaVuSans-Oblique.ttf'),
-                           bold_italic_filename=finders.find('report/reportbro/fonts/DejaVuSans-BoldOblique.ttf'),
-                       ),
-                       dict(
-                           value='notosans',
-                           filename=finders.find('report/reportbro/fonts/NotoSans-Regular.ttf'),
-                           bold_filename=finders.find('report/reportbro/fonts/NotoSans-Bold.ttf'),
-                           italic_filename=finders.find('report/reportbro/fonts/NotoSans-Italic.ttf'),
-                           bold_italic_filename=finders.find('report/reportbro/fonts/NotoSans-BoldItalique.ttf'),
-                       ),
-                       dict(
-                           value='notosans-myanmar',
-                           filename=finders.find('report/reportbro/fonts/NotoSansMyanmar-Regular.ttf'),
-                           bold_filename=finders.find('report/reportbro/fonts/NotoSansMyanmar-Bold.ttf'),
-                       ),
-                       dict(
-                           value='notosans-arabic',
-                           filename=finders.find('report/reportbro/fonts/NotoSansArabic.ttf'),
-                       ),
-                       dict(
-                           value='notosans-naskh-arabic',
-                           filename=finders.find('report/reportbro/fonts/NotoNaskhArabic.ttf'),
-                       ),
-                       dict(
-                           value='notosans-ethiopic',
-                           filename=finders.find('report/reportbro/fonts/NotoSansEthiopic.ttf'),
-                       ),
-                       dict(
-                           value='freesans',
-                           filename=finders.find('report/reportbro/fonts/FreeSans.ttf'),
-                           bold_filename=finders.find('report/reportbro/fonts/FreeSansBold.ttf'),
-                           italic_filename=finders.find('report/reportbro/fonts/FreeSansOblique.ttf'),
-                           bold_italic_filename=finders.find('report/reportbro/fonts/FreeSansBoldOblique.ttf'),
-                       ),
-                       dict(
-                           value="unifont",
-                           filename=finders.find("report/reportbro/fonts/unifont.ttf"),
-                       ),
-                   ],
-                   encode_error_handling="strict",
-                   is_test_data=is_test_data,
-                   core_fonts_encoding="utf-8",
-                   )
+        with stage("load"):
+            report_definition = definition if isinstance(definition, dict) else json.loads(definition)
+            with stage("fonts"):
+                compiled = report_definition.get(COMPILED_KEY) or {}
+                additional_fonts = FontRegistry.get_fonts(report_definition, compiled.get("fonts"))
+            r = Report(report_definition, reportbro_data(data),
+                       additional_fonts=additional_fonts,
+                       encode_error_handling="strict",
+                       is_test_data=is_test_data,
+                       core_fonts_encoding="utf-8",
+                       )
     except Exception as e:
         logger.exception(f"Error loading report definition {report_name}")
         raise ReportBroError(str(e))
     if r.errors:
         logger.error(f"Error generating report {report_name}: {r.errors[0]}")
         raise ReportBroError(r.errors[0])
+    if page_numbers:
+        _continue_page_numbers(r, *page_numbers)
 
     if report_format == "pdf":
         try:
-            generated_report = r.generate_pdf(filename=local_file)
+            with stage("render"):
+                generated_report = r.generate_pdf(filename=local_file)
         except Exception as e:
             logger.exception(f"Error generating PDF report {report_name}")
             raise ReportBroError(str(e))
     elif report_format == "xlsx":
         try:
-            generated_report = r.generate_xlsx(filename=local_file)
+            with stage("render"):
+                generated_report = r.generate_xlsx(filename=local_file)
         except Exception as e:
             logger.exception(f"Error generating XLSX report {report_name}")
             raise ReportBroError(str(e))
@@ -157,6 +516,54 @@ def generate_report(report_name, definition, data, report_format="pdf", local_fi
     return generated_report
 
 
+def _continue_page_numbers(report, page_offset, page_total=None):
+    """
+    ReportBro keeps page_number and page_count in its context: page_number is incremented when a page is added and
+    page_count is set once the layout of the document is done. Starting page_number at the offset and forcing
+    page_count to the total makes a chunk continue the previous ones.
+    """
+    context = report.context
+    context.root_data["page_number"] = page_offset
+    if page_total:
+        set_page_count = context.set_page_count
+        context.set_page_count = lambda page_count: set_page_count(page_total)
+
+
+def has_report_permission(user, report_config):
+    """
+    A user can run a report if it has the generic report query right or the report specific permission
+    """
+    from .apps import ReportConfig
+
+    return (
+        not report_config.get("permission")
+        or user.has_perms(ReportConfig.gql_query_report_perms)
+        or user.has_perms(report_config.get("permission"))
+    )
+
+
+def run_report(user, report_config, report_format="pdf", params=None, local_file=''):
+    """
+    Runs the query of a module report and generates its output
+    :param user: user running the report, passed to the python_query
+    :param report_config: report as registered in ReportConfig (name, default_report, python_query...)
+    :param report_format: pdf or xlsx
+    :param params: parameters of the python_query
+    :param local_file: see generate_report
+    :return: see generate_report
+    """
+    report_name = report_config["name"]
+    report_definition = get_compiled_report_definition(report_name, report_config["default_report"])
+    with stage("query"), report_database(report_name):
+        data = report_config["python_query"](user, **(params or {}))
+    generated_report = generate_report(report_name, report_definition, data, report_format, local_file=local_file)
+    if isinstance(generated_report, (bytes, bytearray)):
+        count("output_bytes", len(generated_report))
+    elif local_file and os.path.exists(local_file):
+        count("output_bytes", os.path.getsize(local_file))
+    return generated_report
+
+
 class ReportService(object):
     def __init__(self, user):
         self.user = user
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ReportDefinition
+from .services import report_definition_cache
+
+
+@receiver([post_save, post_delete], sender=ReportDefinition)
+def invalidate_report_definition_cache(sender, instance, **kwargs):
+    report_definition_cache.invalidate(instance.name)
@@ -0,0 +1,182 @@
+"""
+Snapshots of the stored procedure results, linked to the GeneratedReports (tblReporting) rows.
+The result set is stored column by column (each column is a list of values), serialized as JSON and zlib compressed.
+A report re-run with the same parameters reuses the snapshot instead of executing the procedure again, as long as
+the source version given by the report is unchanged (see source_version) and the snapshot isn't older than
+report_snapshot_max_age. Without a source version there is no way to tell the snapshot is still current, it is
+never reused. Storing a snapshot deletes the ones it supersedes and the expired ones of the procedure.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import uuid
+import zlib
+
+from django.db.models import Count, Max
+
+from .apps import ReportConfig
+from .columnar import ColumnarResult
+from .metrics import count, stage
+from .output_cache import normalize_parameters
+from .services import run_stored_proc_report
+
+logger = logging.getLogger(__name__)
+
+# JSON has no type for these values, their column type is stored to convert them back
+_ENCODERS = {
+    "datetime": (datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    "date": (datetime.date, datetime.date.isoformat, datetime.date.fromisoformat),
+    "time": (datetime.time, datetime.time.isoformat, datetime.time.fromisoformat),
+    "decimal": (decimal.Decimal, str, decimal.Decimal),
+    "uuid": (uuid.UUID, str, uuid.UUID),
+}
+
+
+def _column_type(values):
+    for value in values:
+        if value is None:
+            continue
+        # datetime is a subclass of date, it is checked first
+        for name, (value_type, _, _) in _ENCODERS.items():
+            if isinstance(value, value_type):
+                return name
+        return None
+    return None
+
+
+def encode_rows(rows):
+    """
+    :param rows: list of dict or ColumnarResult, as returned by run_stored_proc_report
+    :return: the compressed columnar representation of the rows
+    """
+    if isinstance(rows, ColumnarResult):
+        columns = list(rows.columns)
+        values = [list(rows.column(column)) for column in columns]
+    else:
+        columns = list(rows[0].keys()) if rows else []
+        values = [[row.get(column) for row in rows] for column in columns]
+    types = [_column_type(column_values) for column_values in values]
+    for index, column_type in enumerate(types):
+        if column_type:
+            encode = _ENCODERS[column_type][1]
+            values[index] = [None if v is None else encode(v) for v in values[index]]
+    payload = {"columns": columns, "types": types, "values": values, "row_count": len(rows)}
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_rows(data, columnar=False):
+    payload = json.loads(zlib.decompress(bytes(data)).decode("utf-8"))
+    values = payload["values"]
+    for index, column_type in enumerate(payload["types"]):
+        if column_type:
+            decode = _ENCODERS[column_type][2]
+            values[index] = [None if v is None else decode(v) for v in values[index]]
+    columns = payload["columns"]
+    if columnar:
+        return ColumnarResult(columns, values)
+    return [dict(zip(columns, row)) for row in zip(*values)] if columns else []
+
+
+def parameters_hash(stored_procedure_name, params):
+    payload = json.dumps([stored_procedure_name, normalize_parameters(params)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def source_version(*querysets, field="validity_from"):
+    """
+    Version of the data a report reads: changes when rows are added, removed or (for the versioned models, whose
+    updates create a new row) updated in the querysets
+    """
+    parts = []
+    for queryset in querysets:
+        result = queryset.aggregate(rows=Count("pk"), last=Max(field))
+        parts.append(f"{queryset.model._meta.db_table}:{result['rows']}:{result['last']}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class ReportSnapshotService(object):
+    def __init__(self, user=None):
+        self.user = user
+
+    def find(self, stored_procedure_name, params, version=None, max_age=None):
+        from .models import ReportSnapshot
+
+        if version is None:
+            return None
+        max_age = ReportConfig.report_snapshot_max_age if max_age is None else max_age
+        queryset = ReportSnapshot.objects.filter(
+            stored_procedure=stored_procedure_name,
+            parameters_hash=parameters_hash(stored_procedure_name, params),
+            source_version=version,
+        )
+        if max_age:
+            from django.utils import timezone
+
+            queryset = queryset.filter(created_at__gte=timezone.now() - datetime.timedelta(seconds=max_age))
+        return queryset.order_by("-created_at").first()
+
+    def save(self, stored_procedure_name, params, rows, version=None, generated_report=None):
+        from .models import ReportSnapshot
+
+        snapshot = ReportSnapshot.objects.create(
+            generated_report=generated_report,
+            stored_procedure=stored_procedure_name,
+            parameters_hash=parameters_hash(stored_procedure_name, params),
+            parameters={k: v for k, v in normalize_parameters(params)},
+            source_version=version,
+            row_count=len(rows),
+            data=encode_rows(rows),
+        )
+        self.prune(stored_procedure_name, snapshot)
+        return snapshot
+
+    def prune(self, stored_procedure_name, snapshot=None, max_age=None):
+        """
+        Deletes the snapshots of the procedure older than max_age (report_snapshot_max_age by default) and, if a
+        snapshot is given, the previous ones of the same parameters, that it supersedes
+        :return: the number of deleted snapshots
+        """
+        from django.db.models import Q
+        from django.utils import timezone
+
+        from .models import ReportSnapshot
+
+        max_age = ReportConfig.report_snapshot_max_age if max_age is None else max_age
+        condition = Q()
+        if max_age:
+            condition |= Q(created_at__lt=timezone.now() - datetime.timedelta(seconds=max_age))
+        if snapshot is not None:
+            condition |= Q(parameters_hash=snapshot.parameters_hash)
+        if not condition:
+            return 0
+        queryset = ReportSnapshot.objects.filter(condition, stored_procedure=stored_procedure_name)
+        if snapshot is not None:
+            queryset = queryset.exclude(pk=snapshot.pk)
+        deleted, _ = queryset.delete()
+        return deleted
+
+    def run_stored_proc_report(self, stored_procedure_name, version=None, generated_report=None, max_age=None,
+                               columnar=False, **kwargs):
+        """
+        Same result as services.run_stored_proc_report, from the snapshot of the same procedure and parameters
+        if there is one for this source version, otherwise the procedure is run and its result stored.
+        :param version: source version of the report data, see source_version. Without it, the procedure is
+                        always run (its result is still stored, for the generated report).
+        :param generated_report: GeneratedReports row the snapshot belongs to
+        :param columnar: return a ColumnarResult, see services.run_stored_proc_report
+        """
+        snapshot = self.find(stored_procedure_name, kwargs, version, max_age)
+        if snapshot is not None:
+            with stage("snapshot"):
+                rows = decode_rows(snapshot.data, columnar)
+            count("snapshot_hits", 1)
+            return rows
+        rows = run_stored_proc_report(stored_procedure_name, columnar=columnar, **kwargs)
+        try:
+            with stage("snapshot"):
+                self.save(stored_procedure_name, kwargs, rows, version, generated_report)
+        except Exception:
+            logger.exception(f"failed to store the snapshot of {stored_procedure_name}")
+        return rows
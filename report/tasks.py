@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from .jobs import run_report_job
+
+
+@shared_task
+def run_report_job_task(job_id):
+    run_report_job(job_id)
@@ -0,0 +1,77 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from report import aggregation
+from report.aggregation import group_by, percentage, pivot, running_total, total
+from report.columnar import ColumnarResult
+
+ROWS = [
+    {"district": "A", "month": 1, "claims": 2, "amount": 10.0},
+    {"district": "B", "month": 1, "claims": 1, "amount": None},
+    {"district": "A", "month": 2, "claims": 3, "amount": 30.0},
+    {"district": "A", "month": 2, "claims": 1, "amount": 5.0},
+]
+
+
+class AggregationTestMixin(object):
+    def test_group_by(self):
+        result = group_by(ROWS, ["district"], {
+            "rows": ("count", None),
+            "claims": ("sum", "claims"),
+            "amounts": ("count", "amount"),
+            "amount": ("sum", "amount"),
+            "average": ("avg", "amount"),
+            "smallest": ("min", "claims"),
+            "largest": ("max", "claims"),
+        })
+        self.assertEqual([dict(row) for row in result], [
+            {"district": "A", "rows": 3, "claims": 6, "amounts": 3, "amount": 45.0, "average": 15.0, "smallest": 1,
+             "largest": 3},
+            {"district": "B", "rows": 1, "claims": 1, "amounts": 0, "amount": None, "average": None, "smallest": 1,
+             "largest": 1},
+        ])
+
+    def test_group_by_columnar(self):
+        result = group_by(ColumnarResult.from_rows(ROWS), ["district", "month"], {"claims": ("sum", "claims")})
+        self.assertEqual(result.to_dicts(), [
+            {"district": "A", "month": 1, "claims": 2},
+            {"district": "B", "month": 1, "claims": 1},
+            {"district": "A", "month": 2, "claims": 4},
+        ])
+
+    def test_total(self):
+        self.assertEqual(total(ROWS, "claims"), 7)
+        self.assertEqual(total(ROWS, "amount", "avg"), 15.0)
+        self.assertIsNone(total([], "claims"))
+        self.assertEqual(total([], "claims", "count"), 0)
+
+    def test_unknown_aggregate(self):
+        with self.assertRaises(ValueError):
+            group_by(ROWS, ["district"], {"x": ("median", "claims")})
+
+    def test_pivot(self):
+        result = pivot(ROWS, ["district"], "month", "claims", fill=0)
+        self.assertEqual(result.columns, ("district", "1", "2"))
+        self.assertEqual(result.to_dicts(), [{"district": "A", "1": 2, "2": 4}, {"district": "B", "1": 1, "2": 0}])
+
+    def test_running_total(self):
+        result = running_total(ROWS, "claims")
+        self.assertEqual(list(result.column("claims_running_total")), [2, 3, 6, 7])
+        result = running_total(ROWS, "amount", name="cumulated", partition_by=["district"])
+        self.assertEqual(list(result.column("cumulated")), [10.0, None, 40.0, 45.0])
+
+    def test_percentage(self):
+        result = percentage(ROWS, "claims", partition_by=["district"])
+        self.assertEqual(list(result.column("claims_percentage")), [2 * 100 / 6, 100.0, 50.0, 1 * 100 / 6])
+
+
+class NumpyAggregationTest(AggregationTestMixin, SimpleTestCase):
+    def setUp(self):
+        if aggregation.numpy is None:
+            self.skipTest("NumPy is not installed")
+
+
+@mock.patch("report.aggregation.numpy", None)
+class PythonAggregationTest(AggregationTestMixin, SimpleTestCase):
+    pass
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from report.batch import BatchReportService, batch_filename
+from report.scheduler import RenderRejected, RenderScheduler
+
+REPORT_CONFIG = {"name": "r", "default_report": {}, "python_query": lambda user, **params: params}
+
+
+def _generate(report_name, definition, data, report_format):
+    return f"{data['region']}".encode("utf-8")
+
+
+@mock.patch("report.batch.connections")
+@mock.patch("report.batch.get_compiled_report_definition", return_value={})
+@mock.patch("report.batch.generate_report", side_effect=_generate)
+class BatchReportServiceTest(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = RenderScheduler()
+        patcher = mock.patch("report.batch.render_scheduler", self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = mock.Mock(id=1)
+
+    def _outputs(self, parameter_sets):
+        return list(BatchReportService(self.user).iter_outputs(REPORT_CONFIG, "pdf", parameter_sets))
+
+    def test_outputs_in_order(self, *mocks):
+        outputs = self._outputs([{"region": "a"}, {"region": "b"}])
+        self.assertEqual([(index, output) for index, _, output, _ in outputs], [(0, b"a"), (1, b"b")])
+
+    def test_renders_in_a_scheduler_slot(self, *mocks):
+        with mock.patch.object(self.scheduler, "acquire", wraps=self.scheduler.acquire) as acquire:
+            self._outputs([{"region": "a"}, {"region": "b"}])
+        self.assertEqual(acquire.call_args_list, [mock.call("r", 1, heavy=False)] * 2)
+        self.assertEqual(self.scheduler.stats(), {"running": 0, "queued": 0})
+
+    def test_batch_within_the_user_limit(self, *mocks):
+        self.scheduler.configure(4, 20, 0, 1, 1, 30)
+        outputs = self._outputs([{"region": str(i)} for i in range(5)])
+        self.assertEqual([error for _, _, _, error in outputs], [None] * 5)
+
+    @mock.patch("report.batch.ReportConfig.report_batch_workers", 2)
+    def test_closed_early(self, generate_report, *mocks):
+        executors = []
+
+        def executor(*args, **kwargs):
+            executors.append(ThreadPoolExecutor(*args, **kwargs))
+            return executors[-1]
+
+        with mock.patch("report.batch.ThreadPoolExecutor", side_effect=executor):
+            outputs = BatchReportService(self.user).iter_outputs(
+                REPORT_CONFIG, "pdf", [{"region": str(i)} for i in range(10)]
+            )
+            self.assertEqual(next(outputs)[2], b"0")
+            outputs.close()
+        # the sets already running finish in the background
+        executors[0].shutdown(wait=True)
+        # the first set, the window of 2 workers and the refill after the first output at most
+        regions = {call.args[2]["region"] for call in generate_report.call_args_list}
+        self.assertTrue(regions <= {"0", "1", "2"})
+
+    def test_rejected_parameter_set(self, *mocks):
+        with mock.patch.object(self.scheduler, "acquire", side_effect=RenderRejected("full", 503, 30)):
+            outputs = self._outputs([{"region": "a"}])
+        self.assertEqual(outputs, [(0, {"region": "a"}, None, "full")])
+
+
+class BatchFilenameTest(SimpleTestCase):
+    def test_filename(self):
+        self.assertEqual(batch_filename("r", 0, {"region": "a/b", "year": 2024}), "r_0001_region-ab_year-2024")
@@ -0,0 +1,48 @@
+import io
+import json
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from report.benchmarks import benchmark_aggregation, benchmark_columnar, benchmark_render, benchmark_row_fetch
+
+
+class BenchmarkCommandTest(SimpleTestCase):
+    def _run(self, *args):
+        benchmark = mock.Mock(return_value={"ok": True})
+        stdout = io.StringIO()
+        with mock.patch.dict("report.management.commands.report_benchmark.BENCHMARKS", {"fake": benchmark}):
+            call_command("report_benchmark", "fake", *args, stdout=stdout)
+        self.assertEqual(json.loads(stdout.getvalue()), {"ok": True})
+        return benchmark
+
+    def test_benchmark_defaults_kept(self):
+        self._run().assert_called_once_with()
+
+    def test_given_options_passed(self):
+        benchmark = self._run("--rows", "10", "--iterations", "2", "--sizes", "1,2", "--formats", "csv")
+        benchmark.assert_called_once_with(rows=10, iterations=2, sizes=[1, 2], formats=["csv"])
+
+
+class BenchmarksTest(SimpleTestCase):
+    def test_row_fetch(self):
+        result = benchmark_row_fetch(rows=100)
+        self.assertEqual(result["rows"], 100)
+        self.assertIn("stream_dict", result)
+
+    def test_columnar(self):
+        result = benchmark_columnar(rows=100)
+        self.assertEqual(result["rows"], 100)
+        self.assertIn("saved_mb", result)
+
+    def test_aggregation(self):
+        result = benchmark_aggregation(rows=100, iterations=1)
+        self.assertEqual(result["group_by"]["iterations"], 1)
+
+    def test_render(self):
+        result = benchmark_render(sizes=[10], formats=["pdf", "xlsx"])
+        cases = {(r["case"], r["format"]) for r in result["results"]}
+        self.assertEqual(cases, {(case, report_format) for case in ("default_report", "table")
+                                 for report_format in ("pdf", "xlsx")})
+        self.assertTrue(all(r["output_bytes"] > 0 for r in result["results"]))
@@ -0,0 +1,57 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from report.chunking import chunking_blocker, render_chunked
+from report.services import generate_report
+
+TABLE = {"id": 1, "elementType": "table", "containerId": "0_content", "dataSource": "${rows}"}
+HEADER_TEXT = {"id": 2, "elementType": "text", "containerId": "0_header", "content": "${page_number}"}
+TITLE = {"id": 3, "elementType": "text", "containerId": "0_content", "content": "Claims"}
+TOTAL = {"name": "total", "type": "sum", "expression": "${rows.amount}"}
+DEFINITION = {"docElements": [HEADER_TEXT, TABLE], "parameters": []}
+DATA = {"rows": [{"amount": i} for i in range(5)]}
+
+
+class ChunkingBlockerTest(SimpleTestCase):
+    def test_table_only(self):
+        self.assertIsNone(chunking_blocker(DEFINITION, "rows"))
+
+    def test_content_besides_the_table(self):
+        self.assertTrue(chunking_blocker({"docElements": [TITLE, TABLE]}, "rows"))
+
+    def test_table_footer(self):
+        self.assertTrue(chunking_blocker({"docElements": [dict(TABLE, footer=True)]}, "rows"))
+
+    def test_totals_over_the_rows(self):
+        self.assertTrue(chunking_blocker({"docElements": [TABLE], "parameters": [TOTAL]}, "rows"))
+
+    def test_other_data_source(self):
+        self.assertTrue(chunking_blocker(DEFINITION, "claims"))
+
+
+@mock.patch("report.chunking.merge_pdfs", return_value=b"%PDF-merged")
+@mock.patch("report.chunking.pdf_page_count", return_value=1)
+@mock.patch("report.chunking.render_report")
+class RenderChunkedTest(SimpleTestCase):
+    def test_slices_with_page_offsets(self, render_report, *mocks):
+        self.assertEqual(render_chunked("r", DEFINITION, DATA, "rows", 2), b"%PDF-merged")
+        slices = [call.args[2]["rows"] for call in render_report.call_args_list]
+        self.assertEqual([len(rows) for rows in slices], [2, 2, 1])
+        self.assertEqual([call.kwargs["page_numbers"] for call in render_report.call_args_list],
+                         [(0, None), (1, None), (2, None)])
+
+
+@mock.patch("report.apps.ReportConfig.report_chunk_rows", 2)
+@mock.patch("report.apps.ReportConfig.report_chunked_reports", {"r": "rows"})
+@mock.patch("report.services.render_report", return_value=b"%PDF")
+@mock.patch("report.chunking.render_chunked", return_value=b"%PDF-merged")
+class GenerateChunkedReportTest(SimpleTestCase):
+    def test_chunked(self, render_chunked, render_report):
+        self.assertEqual(generate_report("r", DEFINITION, DATA), b"%PDF-merged")
+        render_report.assert_not_called()
+
+    def test_not_chunked_with_totals(self, render_chunked, render_report):
+        definition = {"docElements": [TABLE], "parameters": [TOTAL]}
+        self.assertEqual(generate_report("r", definition, DATA), b"%PDF")
+        render_chunked.assert_not_called()
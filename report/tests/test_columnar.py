@@ -0,0 +1,49 @@
+from array import array
+
+from django.test import SimpleTestCase
+
+from report.columnar import ColumnarResult, RowView, reportbro_data
+
+ROWS = [{"name": "a", "count": 1, "rate": 0.5}, {"name": "b", "count": 2, "rate": None}]
+
+
+class ColumnarResultTest(SimpleTestCase):
+    def setUp(self):
+        self.result = ColumnarResult.from_rows(ROWS)
+
+    def test_rows(self):
+        self.assertEqual(len(self.result), 2)
+        self.assertEqual([dict(row) for row in self.result], ROWS)
+        self.assertEqual(self.result[-1]["name"], "b")
+        self.assertEqual(self.result[1].get("missing", "default"), "default")
+        with self.assertRaises(IndexError):
+            self.result[2]
+
+    def test_compact_columns(self):
+        self.assertIsInstance(self.result.column("count"), array)
+        # None can't go in an array
+        self.assertIsInstance(self.result.column("rate"), list)
+
+    def test_slice(self):
+        self.assertEqual([row["name"] for row in self.result[1:]], ["b"])
+
+    def test_from_tuples(self):
+        result = ColumnarResult.from_rows([("a", 1), ("b", 2)], columns=["name", "count"])
+        self.assertEqual(result.to_dicts(), [{"name": "a", "count": 1}, {"name": "b", "count": 2}])
+
+    def test_empty(self):
+        self.assertEqual(len(ColumnarResult.from_rows([])), 0)
+        self.assertEqual(list(ColumnarResult.from_rows([], columns=["a"])), [])
+
+
+class ReportBroDataTest(SimpleTestCase):
+    def test_row_views_not_copied_to_dicts(self):
+        data = reportbro_data({"rows": ColumnarResult.from_rows(ROWS), "title": "t"})
+        self.assertIsInstance(data["rows"], list)
+        self.assertTrue(all(isinstance(row, RowView) for row in data["rows"]))
+        self.assertEqual(data["rows"][0].get("name"), "a")
+        self.assertEqual(data["title"], "t")
+
+    def test_plain_data_unchanged(self):
+        data = {"rows": ROWS}
+        self.assertIs(reportbro_data(data), data)
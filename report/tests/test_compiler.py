@@ -0,0 +1,63 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
+
+from report.compiler import check_data_schema, definition_metadata, validate_report_definition
+from report.default_report import default_report
+from report.services import compile_report_definition
+
+REFERENCE = [
+    {"name": "title", "type": "string"},
+    {"name": "rows", "type": "array", "children": [{"name": "amount", "type": "number"}]},
+]
+
+
+class CheckDataSchemaTest(SimpleTestCase):
+    def test_provided(self):
+        self.assertEqual(check_data_schema(REFERENCE, REFERENCE), [])
+
+    def test_missing_and_wrong_type(self):
+        errors = check_data_schema([
+            {"name": "subtitle", "type": "string"},
+            {"name": "title", "type": "number"},
+            {"name": "rows", "type": "array", "children": [{"name": "count", "type": "number"}]},
+        ], REFERENCE)
+        self.assertEqual(errors, [
+            "parameter subtitle is not provided by the report data",
+            "parameter title must be of type string",
+            "parameter rows.count is not provided by the report data",
+        ])
+
+    def test_internal_and_computed_parameters_ignored(self):
+        self.assertEqual(check_data_schema([
+            {"name": "page_number", "type": "number"},
+            {"name": "total", "type": "sum", "expression": "${rows.amount}"},
+            {"name": "label", "type": "string", "eval": True, "expression": "'x'"},
+        ], REFERENCE), [])
+
+
+class ValidateReportDefinitionTest(SimpleTestCase):
+    def test_default_report(self):
+        parsed, errors = validate_report_definition(default_report)
+        self.assertEqual(errors, [])
+        self.assertIsInstance(parsed, dict)
+
+    def test_invalid_json(self):
+        parsed, errors = validate_report_definition("{")
+        self.assertIsNone(parsed)
+        self.assertTrue(errors[0].startswith("invalid JSON"))
+
+    def test_not_an_object(self):
+        self.assertEqual(validate_report_definition("[]"), (None, ["the definition must be a JSON object"]))
+
+    def test_compile_rejects_unknown_parameters(self):
+        definition = json.dumps({"docElements": [], "parameters": [{"name": "missing", "type": "string"}]})
+        with self.assertRaises(ValidationError):
+            compile_report_definition("r", definition, {"parameters": REFERENCE})
+
+    def test_metadata(self):
+        metadata = definition_metadata({"parameters": REFERENCE}, "digest")
+        self.assertEqual(metadata["digest"], "digest")
+        self.assertEqual(metadata["parameters"], [{"name": "title", "type": "string"},
+                                                  {"name": "rows", "type": "array"}])
@@ -0,0 +1,53 @@
+import datetime
+
+from django.test import SimpleTestCase
+
+from report.cron import CronExpression
+
+NOW = datetime.datetime(2024, 3, 15, 10, 30, 45)
+
+
+class CronExpressionTest(SimpleTestCase):
+    def _next(self, expression, now=NOW):
+        return CronExpression(expression).next_after(now)
+
+    def test_every_minute(self):
+        self.assertEqual(self._next("* * * * *"), datetime.datetime(2024, 3, 15, 10, 31))
+
+    def test_strictly_after(self):
+        self.assertEqual(self._next("30 10 * * *", datetime.datetime(2024, 3, 15, 10, 30)),
+                         datetime.datetime(2024, 3, 16, 10, 30))
+
+    def test_steps_ranges_and_lists(self):
+        self.assertEqual(self._next("*/20 * * * *"), datetime.datetime(2024, 3, 15, 10, 40))
+        self.assertEqual(self._next("0 8-9,22 * * *"), datetime.datetime(2024, 3, 15, 22, 0))
+        self.assertEqual(self._next("5/30 * * * *"), datetime.datetime(2024, 3, 15, 10, 35))
+
+    def test_month_rollover(self):
+        self.assertEqual(self._next("0 2 1 * *"), datetime.datetime(2024, 4, 1, 2, 0))
+        self.assertEqual(self._next("0 0 1 1 *"), datetime.datetime(2025, 1, 1, 0, 0))
+
+    def test_weekday(self):
+        # 2024-03-15 is a Friday, 0 and 7 are both Sunday
+        self.assertEqual(self._next("0 6 * * 1"), datetime.datetime(2024, 3, 18, 6, 0))
+        self.assertEqual(self._next("0 6 * * 7"), datetime.datetime(2024, 3, 17, 6, 0))
+
+    def test_day_or_weekday_when_both_restricted(self):
+        self.assertEqual(self._next("0 0 20 * 0"), datetime.datetime(2024, 3, 17, 0, 0))
+
+    def test_leap_day(self):
+        self.assertEqual(self._next("0 0 29 2 *"), datetime.datetime(2028, 2, 29, 0, 0))
+
+    def test_matches(self):
+        self.assertTrue(CronExpression("30 10 15 3 5").matches(NOW))
+        self.assertFalse(CronExpression("31 10 15 3 5").matches(NOW))
+
+    def test_invalid_expressions(self):
+        for expression in ("* * * *", "60 * * * *", "* 24 * * *", "0 0 0 * *", "*/0 * * * *", "5-1 * * * *",
+                           "a * * * *", "* * * 13 *"):
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                CronExpression(expression)
+
+    def test_never_matches(self):
+        with self.assertRaises(ValueError):
+            self._next("0 0 31 2 *")
@@ -0,0 +1,112 @@
+from django.test import TestCase
+
+from report.fields import content_hash
+from report.models import ReportDefinition
+from report.schema import ReportGQLType
+from report.services import (
+    ReportDefinitionLoader, definition_digest, get_report_definition_version, report_definition_cache,
+)
+
+DEFINITION_A = '{"docElements":[],"parameters":[],"version":"a"}'
+DEFINITION_B = '{"docElements":[],"parameters":[],"version":"b"}'
+
+
+def _override_elsewhere(definition, text):
+    # saved by another process: no post_save signal in this one
+    ReportDefinition.objects.filter(id=definition.id).update(definition=text, definition_hash=content_hash(text))
+
+
+class ReportDefinitionCacheTest(TestCase):
+    def setUp(self):
+        report_definition_cache.clear()
+        self.definition = ReportDefinition.objects.create(name="test_cache_report", definition=DEFINITION_A)
+
+    def tearDown(self):
+        report_definition_cache.clear()
+
+    def test_lookup_cached(self):
+        entry = report_definition_cache.lookup("test_cache_report")
+        self.assertEqual(entry[1], DEFINITION_A)
+        # only the version check, the definition isn't fetched again
+        with self.assertNumQueries(1):
+            self.assertEqual(report_definition_cache.lookup("test_cache_report"), entry)
+
+    def test_lookup_sees_other_process_override(self):
+        report_definition_cache.lookup("test_cache_report")
+        _override_elsewhere(self.definition, DEFINITION_B)
+        self.assertEqual(report_definition_cache.lookup("test_cache_report")[1], DEFINITION_B)
+
+    def test_lookup_sees_new_override(self):
+        self.assertIsNone(report_definition_cache.lookup("test_cache_report_new"))
+        ReportDefinition.objects.bulk_create([ReportDefinition(
+            name="test_cache_report_new", definition=DEFINITION_B, definition_hash=content_hash(DEFINITION_B)
+        )])
+        self.assertIsNotNone(report_definition_cache.lookup("test_cache_report_new"))
+
+    def test_invalidated_on_save(self):
+        report_definition_cache.lookup("test_cache_report")
+        self.definition.definition = DEFINITION_B
+        self.definition.save()
+        self.assertEqual(report_definition_cache.lookup("test_cache_report")[1], DEFINITION_B)
+
+    def test_lookup_many_sees_other_process_override(self):
+        entries = report_definition_cache.lookup_many(["test_cache_report", "test_cache_other"])
+        self.assertEqual(entries["test_cache_report"][1], DEFINITION_A)
+        self.assertIsNone(entries["test_cache_other"])
+        _override_elsewhere(self.definition, DEFINITION_B)
+        entries = report_definition_cache.lookup_many(["test_cache_report", "test_cache_other"])
+        self.assertEqual(entries["test_cache_report"][1], DEFINITION_B)
+
+    def test_compile_once_per_version(self):
+        entry = report_definition_cache.lookup("test_cache_report")
+        compiled = report_definition_cache.compile(*entry)
+        self.assertIs(report_definition_cache.compile(*entry), compiled)
+        self.assertEqual(compiled["version"], "a")
+
+
+class ReportDefinitionLoaderTest(TestCase):
+    def setUp(self):
+        report_definition_cache.clear()
+        for name in ("test_loader_a", "test_loader_b"):
+            ReportDefinition.objects.create(name=name, definition=DEFINITION_A)
+
+    def test_single_query_for_the_pending_reports(self):
+        loader = ReportDefinitionLoader()
+        loader.add(["test_loader_a", "test_loader_b", "test_loader_c"])
+        with self.assertNumQueries(1):
+            self.assertEqual(loader.load("test_loader_a")[1], DEFINITION_A)
+            self.assertEqual(loader.load("test_loader_b")[1], DEFINITION_A)
+            self.assertIsNone(loader.load("test_loader_c"))
+
+    def test_for_request(self):
+        request = type("Request", (), {})()
+        self.assertIs(ReportDefinitionLoader.for_request(request), ReportDefinitionLoader.for_request(request))
+
+    def test_versions_without_the_definitions(self):
+        loader = ReportDefinitionLoader()
+        loader.add(["test_loader_a", "test_loader_c"])
+        with self.assertNumQueries(1):
+            self.assertEqual(loader.load_version("test_loader_a")[4], content_hash(DEFINITION_A))
+            self.assertIsNone(loader.load_version("test_loader_c"))
+
+
+class ReportDefinitionVersionTest(TestCase):
+    def setUp(self):
+        report_definition_cache.clear()
+        ReportDefinition.objects.create(name="test_version_report", definition=DEFINITION_B)
+        self.info = type("Info", (), {"context": type("Request", (), {})()})()
+
+    def tearDown(self):
+        report_definition_cache.clear()
+
+    def test_overridden(self):
+        report = {"name": "test_version_report", "default_report": DEFINITION_A}
+        self.assertEqual(get_report_definition_version(report["name"], DEFINITION_A), content_hash(DEFINITION_B))
+        self.assertEqual(ReportGQLType.resolve_definition_version(report, self.info), content_hash(DEFINITION_B))
+        self.assertTrue(ReportGQLType.resolve_overridden(report, self.info))
+
+    def test_default(self):
+        report = {"name": "test_version_default", "default_report": DEFINITION_A}
+        self.assertEqual(get_report_definition_version(report["name"], DEFINITION_A), definition_digest(DEFINITION_A))
+        self.assertEqual(ReportGQLType.resolve_definition_version(report, self.info), definition_digest(DEFINITION_A))
+        self.assertFalse(ReportGQLType.resolve_overridden(report, self.info))
@@ -0,0 +1,104 @@
+import gzip
+import io
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+from django.utils.http import http_date
+
+from report.downloads import content_etag, download_response, streaming_download_response
+
+CONTENT = b"0123456789"
+LAST_MODIFIED = 1700000000
+
+
+@mock.patch("report.downloads.ReportConfig.report_compressed_formats", ["csv"])
+class DownloadResponseTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _get(self, content=CONTENT, report_format="pdf", ranges=True, **headers):
+        request = self.factory.get("/report", **headers)
+        return download_response(request, content, f"r.{report_format}", report_format,
+                                 last_modified=LAST_MODIFIED, ranges=ranges)
+
+    def _body(self, response):
+        return b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test_full(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._body(response), CONTENT)
+        self.assertEqual(response["ETag"], content_etag(CONTENT))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Last-Modified"], http_date(LAST_MODIFIED))
+
+    def test_file_content(self):
+        self.assertEqual(self._body(self._get(io.BytesIO(CONTENT))), CONTENT)
+
+    def test_range(self):
+        for header, expected, content_range in (
+            ("bytes=2-4", b"234", "bytes 2-4/10"),
+            ("bytes=7-", b"789", "bytes 7-9/10"),
+            ("bytes=-3", b"789", "bytes 7-9/10"),
+            ("bytes=8-20", b"89", "bytes 8-9/10"),
+        ):
+            with self.subTest(header=header):
+                response = self._get(io.BytesIO(CONTENT), HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(self._body(response), expected)
+                self.assertEqual(response["Content-Range"], content_range)
+
+    def test_unsatisfiable_range(self):
+        response = self._get(HTTP_RANGE="bytes=10-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_unsupported_range_gets_everything(self):
+        for header in ("bytes=0-1,4-5", "items=0-1", "bytes=-"):
+            with self.subTest(header=header):
+                self.assertEqual(self._get(HTTP_RANGE=header).status_code, 200)
+
+    def test_if_range(self):
+        etag = content_etag(CONTENT)
+        self.assertEqual(self._get(HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(
+            self._get(HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE=http_date(LAST_MODIFIED)).status_code, 206
+        )
+        self.assertEqual(self._get(HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"other"').status_code, 200)
+        self.assertEqual(
+            self._get(HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE=http_date(LAST_MODIFIED + 60)).status_code, 200
+        )
+
+    def test_generated_output_without_ranges(self):
+        response = self._get(ranges=False, HTTP_RANGE="bytes=0-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._body(response), CONTENT)
+        self.assertEqual(response["Accept-Ranges"], "none")
+
+    def test_conditional_get(self):
+        etag = content_etag(CONTENT)
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH=f'"other", {etag}').status_code, 304)
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(self._get(HTTP_IF_MODIFIED_SINCE=http_date(LAST_MODIFIED)).status_code, 304)
+        self.assertEqual(self._get(HTTP_IF_MODIFIED_SINCE=http_date(LAST_MODIFIED - 60)).status_code, 200)
+
+    def test_compressed(self):
+        response = self._get(CONTENT * 100, "csv", HTTP_ACCEPT_ENCODING="gzip;q=1, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), CONTENT * 100)
+        self.assertEqual(response["ETag"], f'{content_etag(CONTENT * 100)[:-1]}-gzip"')
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_not_compressed_format(self):
+        self.assertFalse(self._get(HTTP_ACCEPT_ENCODING="gzip").has_header("Content-Encoding"))
+
+    def test_streamed_closes_its_source(self):
+        source = mock.MagicMock()
+        source.__iter__.return_value = iter([b"a", b"b"])
+        response = streaming_download_response(
+            self.factory.get("/report", HTTP_ACCEPT_ENCODING="gzip"), source, "r.csv", "csv"
+        )
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), b"ab")
+        response.close()
+        source.close.assert_called_once()
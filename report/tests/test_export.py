@@ -0,0 +1,83 @@
+import datetime
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from report.export import TableSpec, _date_pattern, iter_csv, write_xlsx
+
+DEFINITION = {
+    "docElements": [
+        {
+            "elementType": "table",
+            "dataSource": "${rows}",
+            "headerData": {"columnData": [
+                {"content": "Name", "width": 140},
+                {"content": "Amount (${currency})"},
+                {"content": "Date"},
+            ]},
+            "contentDataRows": [{"columnData": [
+                {"content": "${name}"},
+                {"content": "${amount}", "pattern": "#,##0.00"},
+                {"content": "${date}", "pattern": "dd/MM/yyyy HH:mm"},
+            ]}],
+        }
+    ]
+}
+
+DATA = {
+    "currency": "EUR",
+    "rows": [
+        {"name": "a", "amount": 1.5, "date": datetime.datetime(2024, 1, 2, 3, 4, tzinfo=datetime.timezone.utc)},
+        {"name": "b, c", "amount": None, "date": datetime.date(2024, 2, 3)},
+    ],
+}
+
+
+class DatePatternTest(SimpleTestCase):
+    def test_months_and_minutes(self):
+        self.assertEqual(_date_pattern("yyyy-MM-dd"), "yyyy-mm-dd")
+        self.assertEqual(_date_pattern("dd/MM/yyyy HH:mm"), "dd/mm/yyyy hh:mm")
+        self.assertEqual(_date_pattern("HH:mm dd/MM"), "hh:mm dd/mm")
+        self.assertEqual(_date_pattern("mm:ss"), "mm:ss")
+
+    def test_names_and_fractions(self):
+        self.assertEqual(_date_pattern("EEEE d MMMM y"), "dddd d mmmm yyyy")
+        self.assertEqual(_date_pattern("HH:mm:ss.SSS"), "hh:mm:ss.000")
+        self.assertEqual(_date_pattern("h:mm a"), "h:mm AM/PM")
+
+    def test_quoted_literals_kept(self):
+        self.assertEqual(_date_pattern("d MMM 'at' HH:mm"), "d mmm \\a\\t hh:mm")
+
+    def test_ambiguous_fields(self):
+        # a month next to an hour would be read as minutes
+        self.assertEqual(_date_pattern("HH MM"), "hh mmm")
+        # minutes alone would be read as the month
+        self.assertEqual(_date_pattern("m"), "yyyy-mm-dd")
+
+
+class TableSpecTest(SimpleTestCase):
+    def test_from_definition(self):
+        table = TableSpec.from_definition(DEFINITION)
+        self.assertEqual(table.data_source, "rows")
+        self.assertEqual([column.field for column in table.columns], ["name", "amount", "date"])
+        self.assertEqual(table.columns[0].width, 140)
+        self.assertEqual(table.headers(DATA), ["Name", "Amount (EUR)", "Date"])
+
+    def test_not_a_single_table(self):
+        self.assertIsNone(TableSpec.from_definition({"docElements": [{"elementType": "text"}]}))
+
+    def test_csv(self):
+        output = b"".join(iter_csv(TableSpec.from_definition(DEFINITION), DATA)).decode("utf-8")
+        lines = output.lstrip("\ufeff").splitlines()
+        self.assertEqual(lines[0], "Name,Amount (EUR),Date")
+        self.assertEqual(lines[2], '"b, c",,2024-02-03')
+
+    def test_xlsx_aware_datetimes(self):
+        fd, filename = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            write_xlsx(TableSpec.from_definition(DEFINITION), DATA, filename)
+            self.assertGreater(os.path.getsize(filename), 0)
+        finally:
+            os.unlink(filename)
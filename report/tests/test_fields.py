@@ -0,0 +1,53 @@
+from django.core.exceptions import FieldError
+from django.test import SimpleTestCase, TestCase
+
+from report.fields import (
+    COMPRESSED_PREFIX, CompressedTextField, compress_text, content_hash, decompress_text, minify_json,
+)
+from report.models import ReportDefinition
+
+DEFINITION = '{\n  "docElements": [],\n  "title": "Réclamations"\n}'
+
+
+class FieldsTest(SimpleTestCase):
+    def test_minify_json(self):
+        self.assertEqual(minify_json(DEFINITION), '{"docElements":[],"title":"Réclamations"}')
+        self.assertEqual(minify_json("not json"), "not json")
+
+    def test_compress_round_trip(self):
+        compressed = compress_text(DEFINITION)
+        self.assertTrue(compressed.startswith(COMPRESSED_PREFIX))
+        self.assertEqual(decompress_text(compressed), DEFINITION)
+        # stable output, no timestamp in the gzip header
+        self.assertEqual(compress_text(DEFINITION), compressed)
+
+    def test_uncompressed_values_read_as_is(self):
+        self.assertEqual(decompress_text(DEFINITION), DEFINITION)
+        self.assertIsNone(decompress_text(None))
+
+    def test_field(self):
+        field = CompressedTextField()
+        stored = field.get_prep_value(DEFINITION)
+        self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+        self.assertEqual(field.get_prep_value(stored), stored)
+        self.assertEqual(field.from_db_value(stored, None, None), DEFINITION)
+        self.assertIsNone(field.get_prep_value(None))
+
+    def test_content_hash(self):
+        self.assertEqual(content_hash("a"), content_hash("a"))
+        self.assertNotEqual(content_hash("a"), content_hash("b"))
+
+
+class CompressedTextFieldLookupTest(TestCase):
+    def setUp(self):
+        ReportDefinition.objects.create(name="test_compressed_lookup", definition=DEFINITION)
+
+    def test_exact(self):
+        self.assertTrue(ReportDefinition.objects.filter(definition=DEFINITION).exists())
+        self.assertTrue(ReportDefinition.objects.filter(definition__in=[DEFINITION]).exists())
+        self.assertFalse(ReportDefinition.objects.filter(definition__isnull=True).exists())
+
+    def test_text_lookups_rejected(self):
+        for lookup in ("contains", "icontains", "startswith"):
+            with self.subTest(lookup=lookup), self.assertRaises(FieldError):
+                ReportDefinition.objects.filter(**{f"definition__{lookup}": "docElements"}).exists()
@@ -0,0 +1,59 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from report.apps import DEFAULT_CFG, ReportConfig
+from report.fonts import FontRegistry, used_fonts
+
+DEFINITION = {
+    "docElements": [
+        {"elementType": "text", "font": "dejavusans"},
+        {
+            "elementType": "table",
+            "headerData": {"columnData": [{"font": "notosans", "cs_font": "helvetica"}]},
+            "contentDataRows": [{"columnData": [{"font": "times"}]}],
+        },
+    ],
+    "styles": [{"name": "title", "font": "freesans", "cs_font": "unifont"}],
+}
+
+FONTS = {
+    "dejavusans": {"value": "dejavusans", "filename": "/fonts/DejaVuSans.ttf"},
+    "notosans": {"value": "notosans", "filename": "/fonts/NotoSans-Regular.ttf"},
+    "freesans": {"value": "freesans", "filename": "/fonts/FreeSans.ttf"},
+}
+
+
+class ConfigTest(SimpleTestCase):
+    def test_class_attributes_match_default_cfg(self):
+        for key, value in DEFAULT_CFG.items():
+            if not key.startswith("gql_"):
+                self.assertEqual(getattr(ReportConfig, key), value, key)
+
+
+class UsedFontsTest(SimpleTestCase):
+    def test_collects_elements_cells_and_styles(self):
+        self.assertEqual(used_fonts(DEFINITION), {"dejavusans", "notosans", "freesans", "unifont"})
+
+    def test_standard_fonts_excluded(self):
+        definition = {"docElements": [{"font": "helvetica"}, {"font": "courier"}]}
+        self.assertEqual(used_fonts(definition), set())
+
+    def test_empty_definition(self):
+        self.assertEqual(used_fonts({}), set())
+
+
+@mock.patch.object(FontRegistry, "_selections", {})
+@mock.patch.object(FontRegistry, "_fonts", FONTS)
+class FontRegistryTest(SimpleTestCase):
+    def test_only_used_and_available_fonts(self):
+        fonts = FontRegistry.get_fonts(DEFINITION)
+        # unifont is used but not available
+        self.assertEqual([font["value"] for font in fonts], ["dejavusans", "freesans", "notosans"])
+
+    def test_selection_is_shared(self):
+        self.assertIs(FontRegistry.get_fonts(DEFINITION), FontRegistry.get_fonts(DEFINITION))
+
+    def test_known_names(self):
+        fonts = FontRegistry.get_fonts({}, names=["notosans"])
+        self.assertEqual([font["value"] for font in fonts], ["notosans"])
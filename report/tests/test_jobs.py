@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from core import datetime
+from core.test_helpers import create_test_interactive_user
+from django.test import TestCase
+
+from report.jobs import ReportJobService, fail_lost_jobs, run_report_job
+from report.models import ReportJob
+from report.output_cache import job_output_store
+
+REPORT_CONFIG = {"name": "test_job_report", "default_report": None, "python_query": None}
+
+
+def _write_output(user, report_config, report_format, params, local_file=""):
+    with open(local_file, "wb") as f:
+        f.write(b"%PDF-test")
+
+
+class ReportJobTest(TestCase):
+    def setUp(self):
+        self.user = create_test_interactive_user(username="test_report_job")
+        self.directory = tempfile.mkdtemp()
+        self.store_config = (job_output_store.directory, job_output_store.max_bytes, job_output_store.ttl)
+        job_output_store.configure(self.directory, 1024 * 1024, 3600)
+
+    def tearDown(self):
+        job_output_store.configure(*self.store_config)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _job(self, **kwargs):
+        return ReportJob.objects.create(name="test_job_report", report_format="pdf", user=self.user, **kwargs)
+
+    @mock.patch("report.jobs.run_report", side_effect=_write_output)
+    @mock.patch("report.jobs.ReportConfig.get_report", return_value=REPORT_CONFIG)
+    def test_output_stored_with_ttl(self, get_report, run_report):
+        job = self._job()
+        run_report_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.STATUS_SUCCESS)
+        self.assertEqual(os.path.dirname(job.output_file), self.directory)
+        with ReportJobService(self.user).output(job) as output:
+            self.assertEqual(output.read(), b"%PDF-test")
+        # expired
+        os.utime(job.output_file, (0, 0))
+        self.assertIsNone(ReportJobService(self.user).output(job))
+        self.assertFalse(os.path.exists(job.output_file))
+
+    @mock.patch("report.jobs.ReportConfig.get_report", return_value=None)
+    def test_unknown_report_fails(self, get_report):
+        job = self._job()
+        run_report_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.STATUS_FAILED)
+        self.assertIsNone(ReportJobService(self.user).output(job))
+
+    def test_lost_running_jobs_failed(self):
+        now = datetime.datetime.now()
+        lost = self._job(status=ReportJob.STATUS_RUNNING, started_at=now - timedelta(hours=2))
+        running = self._job(status=ReportJob.STATUS_RUNNING, started_at=now)
+        with mock.patch("report.jobs.ReportConfig.report_job_timeout", 3600):
+            self.assertEqual(fail_lost_jobs(), 1)
+            self.assertEqual(ReportJobService(self.user).get(lost.id).status, ReportJob.STATUS_FAILED)
+            self.assertEqual(ReportJobService(self.user).get(running.id).status, ReportJob.STATUS_RUNNING)
+
+    @mock.patch.object(ReportJobService, "dispatch")
+    def test_queued_jobs_requeued_once(self, dispatch):
+        job = self._job()
+        with mock.patch.object(ReportJobService, "_recovered", False), \
+                mock.patch("report.jobs.ReportConfig.report_job_backend", "thread"):
+            ReportJobService(self.user)
+            ReportJobService(self.user)
+        dispatch.assert_called_once_with(job.id)
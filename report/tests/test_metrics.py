@@ -0,0 +1,101 @@
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+from rest_framework.test import force_authenticate
+
+from report import views
+
+from report.metrics import (
+    PrometheusExporter, ReportTrace, count, current_rss_kb, current_trace, register_metrics_hook, report_trace,
+    stage,
+)
+
+
+class ReportTraceTest(SimpleTestCase):
+    def test_stages_and_counters(self):
+        with mock.patch("report.metrics.publish") as publish:
+            with report_trace("r", "pdf") as trace:
+                with stage("query"):
+                    count("rows", 3)
+                    count("rows", 2)
+                self.assertIs(current_trace(), trace)
+        self.assertIsNone(current_trace())
+        self.assertEqual(trace.counters["rows"], 5)
+        self.assertIn("query", trace.stages)
+        self.assertIn("total", trace.stages)
+        self.assertIn("query;dur=", trace.server_timing())
+        publish.assert_called_once_with(trace)
+
+    def test_outside_of_a_trace(self):
+        with stage("query"):
+            count("rows", 1)
+        self.assertIsNone(current_trace())
+
+    def test_error(self):
+        with mock.patch("report.metrics.publish"):
+            with self.assertRaises(ValueError):
+                with report_trace("r", "pdf") as trace:
+                    raise ValueError()
+        self.assertEqual(trace.error, "ValueError")
+
+    def test_rss_delta_is_current_memory(self):
+        with mock.patch("report.metrics.current_rss_kb", side_effect=[1000, 800]), \
+                mock.patch("report.metrics.publish"):
+            trace = ReportTrace("r", "pdf")
+            trace.finish()
+            trace.finish()
+        self.assertEqual(trace.counters["rss_delta_kb"], -200)
+
+    def test_current_rss(self):
+        self.assertGreaterEqual(current_rss_kb(), 0)
+
+    @mock.patch("report.metrics._hooks", [])
+    def test_hooks(self):
+        hook = mock.Mock()
+        register_metrics_hook(hook)
+        register_metrics_hook(hook)
+        with mock.patch("report.metrics.logger"):
+            with report_trace("r", "pdf") as trace:
+                pass
+        hook.assert_called_once_with(trace)
+
+
+class PrometheusExporterTest(SimpleTestCase):
+    def test_render(self):
+        exporter = PrometheusExporter()
+        trace = ReportTrace("r", "pdf")
+        trace.add("render", 0.5)
+        trace.count("rows", 10)
+        exporter.observe(trace)
+        exporter.observe(trace)
+        text = exporter.render()
+        self.assertIn('openimis_report_runs_total{report="r",format="pdf",status="success"} 2', text)
+        self.assertIn('openimis_report_stage_seconds_sum{report="r",stage="render"} 1.000000', text)
+        self.assertIn('openimis_report_total{report="r",metric="rows"} 20', text)
+
+    def test_rss_delta_gauge(self):
+        exporter = PrometheusExporter()
+        for delta in (500, -300):
+            trace = ReportTrace("r", "pdf")
+            trace.counters["rss_delta_kb"] = delta
+            exporter.observe(trace)
+        text = exporter.render()
+        self.assertNotIn('metric="rss_delta_kb"', text)
+        self.assertIn("# TYPE openimis_report_rss_delta_kb gauge", text)
+        self.assertIn('openimis_report_rss_delta_kb{report="r"} -300', text)
+
+
+@mock.patch("report.views.ReportConfig.report_metrics_exporter", True)
+class ReportMetricsViewTest(SimpleTestCase):
+    def _get(self, allowed):
+        request = RequestFactory().get("/report/metrics")
+        force_authenticate(request, user=mock.Mock(has_perms=mock.Mock(return_value=allowed)))
+        return views.report_metrics(request)
+
+    def test_requires_the_rights(self):
+        self.assertEqual(self._get(False).status_code, 403)
+
+    def test_allowed(self):
+        response = self._get(True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"openimis_report_runs_total", response.content)
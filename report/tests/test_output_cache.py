@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from report.output_cache import (
+    SCOPE_RIGHTS, FileOutputStore, ReportOutputCache, output_cache_key, permission_scope,
+)
+
+
+class OutputCacheKeyTest(SimpleTestCase):
+    def test_parameters_normalized(self):
+        self.assertEqual(
+            output_cache_key("r", "pdf", "v1", {"b": 2, "a": "1", "async": "1"}, "user:1"),
+            output_cache_key("r", "pdf", "v1", {"a": 1, "b": "2"}, "user:1"),
+        )
+
+    def test_version_format_and_scope_in_key(self):
+        key = output_cache_key("r", "pdf", "v1", {}, "user:1")
+        self.assertNotEqual(key, output_cache_key("r", "pdf", "v2", {}, "user:1"))
+        self.assertNotEqual(key, output_cache_key("r", "xlsx", "v1", {}, "user:1"))
+        self.assertNotEqual(key, output_cache_key("r", "pdf", "v1", {}, "user:2"))
+
+    def test_permission_scope(self):
+        user = SimpleNamespace(id=3, rights=[2, 1])
+        self.assertEqual(permission_scope(user), "user:3")
+        self.assertEqual(
+            permission_scope(user, SCOPE_RIGHTS), permission_scope(SimpleNamespace(id=4, rights=[1, 2]), SCOPE_RIGHTS)
+        )
+
+
+class FileOutputStoreTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FileOutputStore(self.directory, 100, 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_set_get(self):
+        self.store.set("a", b"content")
+        with self.store.get("a") as f:
+            self.assertEqual(f.read(), b"content")
+        self.assertIsNone(self.store.get("missing"))
+
+    def test_expired(self):
+        self.store.set("a", b"content")
+        os.utime(self.store.path("a"), (time.time(), time.time() - 120))
+        self.assertIsNone(self.store.get("a"))
+        self.assertFalse(os.path.exists(self.store.path("a")))
+
+    def test_own_ttl(self):
+        self.store.set("a", b"content", ttl=3600)
+        mtime = os.stat(self.store.path("a")).st_mtime
+        self.assertGreater(mtime, time.time() + 3000)
+
+    def test_least_recently_used_evicted(self):
+        self.store.set("a", b"x" * 40)
+        os.utime(self.store.path("a"), (time.time() - 10, time.time()))
+        self.store.set("b", b"x" * 40)
+        self.store.set("c", b"x" * 40)
+        self.assertFalse(os.path.exists(self.store.path("a")))
+        self.assertTrue(os.path.exists(self.store.path("c")))
+
+    def test_failed_write_leaves_nothing(self):
+        def write_file(path):
+            raise ValueError("render failed")
+
+        with self.assertRaises(ValueError):
+            self.store.write("a", write_file)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class ReportOutputCacheTest(SimpleTestCase):
+    def test_disabled_without_ttl(self):
+        cache = ReportOutputCache()
+        cache.configure(0, 100, directory=tempfile.gettempdir())
+        self.assertFalse(cache.enabled)
+        cache.set("a", b"content")
+        self.assertIsNone(cache.get("a"))
@@ -0,0 +1,52 @@
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+
+from report import views
+from report.output_cache import FileOutputStore
+
+PREVIEW = {"outputFormat": "pdf", "report": {"docElements": []}, "data": {}, "isTestData": True}
+
+
+def _write_preview(report_name, definition, data, report_format, local_file="", is_test_data=None):
+    with open(local_file, "wb") as f:
+        f.write(b"%PDF-preview")
+
+
+class PreviewTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch("report.views.preview_store", FileOutputStore(self.directory, 1024, 60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @mock.patch("report.views.generate_report", side_effect=_write_preview)
+    def test_put_then_get(self, generate_report):
+        response = views.reportbro_previewer(
+            self.factory.put("/report/preview", json.dumps(PREVIEW), content_type="application/json")
+        )
+        key = response.content.decode("utf-8")
+        self.assertTrue(key.startswith("key:"))
+        response = views.reportbro_previewer(
+            self.factory.get("/report/preview", {"outputFormat": "pdf", "key": key[4:]})
+        )
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-preview")
+
+    def test_invalid_key(self):
+        response = views.reportbro_previewer(
+            self.factory.get("/report/preview", {"outputFormat": "pdf", "key": "../../etc/passwd"})
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_preview(self):
+        with self.assertRaises(views.Http404):
+            views.reportbro_previewer(
+                self.factory.get("/report/preview", {"outputFormat": "pdf", "key": "0" * 32 + ".pdf"})
+            )
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase
+
+from report.columnar import ColumnarResult
+from report.query_cache import QueryResultCache, result_size
+
+ROWS = [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+
+
+def _cache(backend=""):
+    cache = QueryResultCache()
+    cache.configure({"proc": 60}, 1024 * 1024, backend=backend)
+    return cache
+
+
+class QueryResultCacheTest(SimpleTestCase):
+    def test_only_procedures_with_a_ttl(self):
+        cache = _cache()
+        cache.set(cache.key("other", {}), ROWS)
+        self.assertIsNone(cache.get(cache.key("other", {})))
+
+    def test_copies_returned(self):
+        cache = _cache()
+        key = cache.key("proc", {"year": 2024})
+        cache.set(key, ROWS)
+        rows = cache.get(key)
+        rows[0]["name"] = "changed"
+        self.assertEqual(cache.get(cache.key("proc", {"year": 2024})), ROWS)
+
+    def test_invalidate(self):
+        cache = _cache()
+        cache.set(cache.key("proc", {"year": 2024}), ROWS)
+        self.assertEqual(cache.invalidate("proc"), 1)
+        self.assertIsNone(cache.get(cache.key("proc", {"year": 2024})))
+
+    def test_invalidate_in_another_process(self):
+        shared = LocMemCache("report-query-cache-test", {})
+        with mock.patch("django.core.cache.caches", {"shared": shared}):
+            cache, other_process = _cache("shared"), _cache("shared")
+            key = other_process.key("proc", {"year": 2024})
+            other_process.set(key, ROWS)
+            cache.invalidate("proc")
+            self.assertIsNone(other_process.get(other_process.key("proc", {"year": 2024})))
+            other_process.set(other_process.key("proc", {"year": 2024}), ROWS)
+            cache.invalidate()
+            self.assertIsNone(other_process.get(other_process.key("proc", {"year": 2024})))
+        shared.clear()
+
+    def test_result_size(self):
+        self.assertGreater(result_size(ROWS), 0)
+        self.assertGreater(result_size(ColumnarResult.from_rows(ROWS)), 0)
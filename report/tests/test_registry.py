@@ -0,0 +1,91 @@
+import sys
+import types
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from report.apps import ReportConfig
+from report.registry import load_report_manifest
+
+REPORTS = [
+    {"name": "a", "permission": ["1"]},
+    {"name": "b", "permission": ["1"]},
+    {"name": "c", "permission": ["2"]},
+    {"name": "d"},
+    {"name": "a", "permission": []},
+]
+
+
+class FakeUser(object):
+    def __init__(self, rights):
+        self.rights = rights
+        self.checks = 0
+
+    def has_perms(self, permission):
+        self.checks += 1
+        return all(right in self.rights for right in permission)
+
+
+@mock.patch.object(ReportConfig, "reports", REPORTS)
+class ReportIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.indexes = (ReportConfig.reports_by_name, ReportConfig.reports_by_permission)
+        ReportConfig.index_reports()
+
+    def tearDown(self):
+        ReportConfig.reports_by_name, ReportConfig.reports_by_permission = self.indexes
+
+    def test_first_duplicate_kept(self):
+        self.assertIs(ReportConfig.get_report("a"), REPORTS[0])
+        self.assertIsNone(ReportConfig.get_report("unknown"))
+
+    def test_allowed_reports(self):
+        user = FakeUser(["1"])
+        names = [report["name"] for report in ReportConfig.get_allowed_reports(user)]
+        self.assertEqual(names, ["a", "b", "d"])
+        # one check per distinct permission
+        self.assertEqual(user.checks, 2)
+
+    def test_allowed_reports_kept_on_request(self):
+        request = type("Request", (), {})()
+        user = FakeUser(["2"])
+        ReportConfig.get_allowed_reports(user, request)
+        names = [report["name"] for report in ReportConfig.get_allowed_reports(user, request)]
+        self.assertEqual(names, ["c", "d"])
+        self.assertEqual(user.checks, 2)
+
+
+class LazyReportTest(SimpleTestCase):
+    def setUp(self):
+        self.query = mock.Mock()
+        definitions = types.ModuleType("test_lazy_app.report")
+        definitions.report_definitions = [
+            {"name": "lazy", "python_query": self.query, "default_report": "{}", "permission": ["1"]},
+        ]
+        manifest = types.ModuleType("test_lazy_app.report_manifest")
+        manifest.report_manifest = [{"name": "lazy", "permission": ["1"]}, {"name": "missing"}]
+        self.modules = mock.patch.dict(sys.modules, {
+            "test_lazy_app": types.ModuleType("test_lazy_app"),
+            "test_lazy_app.report": definitions,
+            "test_lazy_app.report_manifest": manifest,
+        })
+        self.modules.start()
+
+    def tearDown(self):
+        self.modules.stop()
+
+    def test_loaded_on_first_access(self):
+        report, _ = load_report_manifest("test_lazy_app")
+        self.assertEqual(report["permission"], ["1"])
+        self.assertFalse(report.loaded)
+        self.assertIs(report["python_query"], self.query)
+        self.assertTrue(report.loaded)
+        self.assertEqual(report.get("default_report"), "{}")
+
+    def test_missing_definition(self):
+        _, report = load_report_manifest("test_lazy_app")
+        with self.assertRaises(LookupError):
+            report.get("python_query")
+
+    def test_app_without_manifest(self):
+        self.assertIsNone(load_report_manifest("test_app_without_manifest"))
@@ -0,0 +1,51 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from report.render_pool import RENDER_MODE_PROCESS, RENDER_MODE_THREAD, RenderPool, _warm
+
+
+@mock.patch("report.render_pool.ProcessPoolExecutor")
+class RenderPoolTest(SimpleTestCase):
+    def _pool(self, mode=RENDER_MODE_PROCESS, processes=3):
+        pool = RenderPool()
+        pool.configure(mode, processes, 10, 1024)
+        return pool
+
+    def test_thread_mode_starts_nothing(self, executor_class):
+        pool = self._pool(RENDER_MODE_THREAD)
+        self.assertFalse(pool.enabled)
+        executor_class.assert_not_called()
+
+    def test_workers_warmed_when_configured(self, executor_class):
+        self._pool()
+        executor_class.assert_called_once()
+        self.assertEqual(executor_class.return_value.submit.call_args_list, [mock.call(_warm)] * 3)
+
+    def test_replacement_started_before_recycle(self, executor_class):
+        old, new = mock.Mock(name="old"), mock.Mock(name="new")
+        executor_class.side_effect = [old, new]
+        pool = self._pool(processes=2)
+        pool.recycle(old)
+        self.assertEqual(new.submit.call_count, 2)
+        old.shutdown.assert_called_once_with(wait=False)
+        self.assertIs(pool.start(), new)
+
+    def test_stale_recycle_ignored(self, executor_class):
+        current = executor_class.return_value
+        pool = self._pool()
+        pool.recycle(mock.Mock(name="previous"))
+        current.shutdown.assert_not_called()
+        self.assertEqual(executor_class.call_count, 1)
+
+    def test_forked_process_starts_its_own_pool(self, executor_class):
+        pool = self._pool()
+        with mock.patch("report.render_pool.os.getpid", return_value=-1):
+            pool.start()
+        self.assertEqual(executor_class.call_count, 2)
+
+    def test_not_started_in_a_render_process(self, executor_class):
+        with mock.patch("report.render_pool._in_worker", True):
+            pool = self._pool()
+        self.assertFalse(pool.enabled)
+        executor_class.assert_not_called()
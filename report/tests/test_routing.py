@@ -0,0 +1,77 @@
+from unittest import mock
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase
+
+from report.routing import (
+    report_database, report_db_alias, resolve_alias, statement_timeout, statement_timeout_for,
+)
+
+
+@mock.patch("report.routing.ReportConfig.report_database_overrides", {"heavy": "replica"})
+@mock.patch("report.routing.ReportConfig.report_database", "")
+class ResolveAliasTest(SimpleTestCase):
+    def test_default(self):
+        self.assertEqual(resolve_alias("other"), DEFAULT_DB_ALIAS)
+
+    @mock.patch("report.routing.connections")
+    def test_override(self, connections):
+        connections.databases = {DEFAULT_DB_ALIAS: {}, "replica": {}}
+        self.assertEqual(resolve_alias("heavy"), "replica")
+
+    @mock.patch("report.routing.connections")
+    def test_missing_alias_falls_back(self, connections):
+        connections.databases = {DEFAULT_DB_ALIAS: {}}
+        with mock.patch("report.routing.logger"):
+            self.assertEqual(resolve_alias("heavy"), DEFAULT_DB_ALIAS)
+
+    @mock.patch("report.routing.connections")
+    def test_unreachable_alias_falls_back(self, connections):
+        connections.databases = {DEFAULT_DB_ALIAS: {}, "replica": {}}
+        connections.__getitem__.return_value.ensure_connection.side_effect = OperationalError()
+        with mock.patch("report.routing.logger"):
+            self.assertEqual(resolve_alias("heavy"), DEFAULT_DB_ALIAS)
+
+
+@mock.patch("report.routing.ReportConfig.report_statement_timeouts", {"heavy": 600, "unlimited": 0})
+@mock.patch("report.routing.ReportConfig.report_statement_timeout", 60)
+class StatementTimeoutTest(SimpleTestCase):
+    def test_timeout_for(self):
+        self.assertEqual(statement_timeout_for("heavy"), 600)
+        self.assertEqual(statement_timeout_for("unlimited"), 0)
+        self.assertEqual(statement_timeout_for("other"), 60)
+        self.assertEqual(statement_timeout_for(), 60)
+
+    def test_postgresql(self):
+        connection = mock.MagicMock(vendor="postgresql")
+        cursor = connection.cursor.return_value.__enter__.return_value
+        with statement_timeout(connection, 1.5):
+            cursor.execute.assert_called_once_with("SET statement_timeout = %s", [1500])
+        cursor.execute.assert_called_with("RESET statement_timeout")
+
+    def test_sql_server(self):
+        connection = mock.MagicMock(vendor="microsoft")
+        connection.connection.timeout = 0
+        with statement_timeout(connection, 30):
+            self.assertEqual(connection.connection.timeout, 30)
+        self.assertEqual(connection.connection.timeout, 0)
+
+    def test_no_timeout(self):
+        connection = mock.MagicMock(vendor="postgresql")
+        with statement_timeout(connection, 0):
+            pass
+        connection.cursor.assert_not_called()
+
+
+class ReportDatabaseTest(SimpleTestCase):
+    @mock.patch("report.routing.statement_timeout")
+    @mock.patch("report.routing.resolve_alias", return_value="replica")
+    @mock.patch("report.routing.connections")
+    def test_alias_of_the_run(self, connections, resolve_alias, statement_timeout):
+        with report_database("heavy") as alias:
+            self.assertEqual(alias, "replica")
+            self.assertEqual(report_db_alias(), "replica")
+        resolve_alias.assert_called_once_with("heavy")
+        resolve_alias.return_value = DEFAULT_DB_ALIAS
+        self.assertEqual(report_db_alias(), DEFAULT_DB_ALIAS)
@@ -0,0 +1,154 @@
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from report import views
+from report.metrics import ReportTrace
+from report.scheduler import RenderRejected, RenderScheduler
+
+REPORT_CONFIG = {"name": "test_scheduled_report", "default_report": None, "python_query": None}
+
+
+def _scheduler(**kwargs):
+    scheduler = RenderScheduler()
+    config = dict(max_concurrent=1, max_queue=10, max_per_report=0, max_per_user=0, queue_timeout=5,
+                  retry_after=7)
+    config.update(kwargs)
+    scheduler.configure(**config)
+    return scheduler
+
+
+def _wait_queued(scheduler, count):
+    deadline = time.monotonic() + 5
+    while scheduler.stats()["queued"] < count:
+        if time.monotonic() > deadline:
+            raise AssertionError("renders not queued")
+        time.sleep(0.01)
+
+
+class RenderSchedulerTest(SimpleTestCase):
+    def test_heavy_reports_run_after_the_others(self):
+        scheduler = _scheduler()
+        running = scheduler.acquire("first", 1)
+        order = []
+
+        def render(report_name, user_id, heavy):
+            ticket = scheduler.acquire(report_name, user_id, heavy=heavy)
+            order.append(report_name)
+            scheduler.release(ticket)
+
+        threads = [threading.Thread(target=render, args=("heavy", 2, True))]
+        threads[0].start()
+        _wait_queued(scheduler, 1)
+        threads.append(threading.Thread(target=render, args=("light", 3, False)))
+        threads[1].start()
+        _wait_queued(scheduler, 2)
+        scheduler.release(running)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ["light", "heavy"])
+
+    def test_per_report_limit_lets_other_reports_run(self):
+        scheduler = _scheduler(max_concurrent=2, max_per_report=1)
+        running = scheduler.acquire("report", 1)
+        order = []
+
+        def render(report_name, user_id):
+            ticket = scheduler.acquire(report_name, user_id)
+            order.append(report_name)
+            scheduler.release(ticket)
+
+        blocked = threading.Thread(target=render, args=("report", 2))
+        blocked.start()
+        _wait_queued(scheduler, 1)
+        render("other", 3)
+        self.assertEqual(order, ["other"])
+        scheduler.release(running)
+        blocked.join(5)
+        self.assertEqual(order, ["other", "report"])
+
+    def test_user_limit_429(self):
+        scheduler = _scheduler(max_concurrent=2, max_per_user=1)
+        scheduler.acquire("report", 1)
+        with self.assertRaises(RenderRejected) as error:
+            scheduler.acquire("other", 1)
+        self.assertEqual(error.exception.status, 429)
+        self.assertEqual(error.exception.retry_after, 7)
+
+    def test_full_queue_503(self):
+        scheduler = _scheduler(max_queue=0)
+        with self.assertRaises(RenderRejected) as error:
+            scheduler.acquire("report", 1)
+        self.assertEqual(error.exception.status, 503)
+
+    def test_queue_timeout_503(self):
+        scheduler = _scheduler(queue_timeout=0.05)
+        scheduler.acquire("report", 1)
+        with self.assertRaises(RenderRejected) as error:
+            scheduler.acquire("report", 2)
+        self.assertEqual(error.exception.status, 503)
+        self.assertEqual(scheduler.stats(), {"running": 1, "queued": 0})
+
+    def test_heavy_configuration(self):
+        scheduler = _scheduler(heavy_reports=["claim_history"])
+        self.assertTrue(scheduler.is_heavy({"name": "claim_history"}))
+        self.assertTrue(scheduler.is_heavy({"name": "other", "heavy": True}))
+        self.assertFalse(scheduler.is_heavy({"name": "other"}))
+
+
+@mock.patch("report.views.report_output_cache", mock.Mock(enabled=False))
+@mock.patch("report.views.precomputed_outputs", mock.Mock(enabled=False))
+@mock.patch("report.views.has_report_permission", return_value=True)
+@mock.patch("report.views.ReportConfig.get_report", return_value=REPORT_CONFIG)
+class ReportViewSchedulingTest(SimpleTestCase):
+    def _get(self, report_format="pdf"):
+        request = APIRequestFactory().get(f"/report/test_scheduled_report/{report_format}/")
+        force_authenticate(request, user=SimpleNamespace(id=1, is_authenticated=True, is_active=True))
+        return views.report(request, "test_scheduled_report", report_format)
+
+    @mock.patch("report.views.render_scheduler", _scheduler(max_queue=0))
+    def test_rejected_render(self, get_report, has_permission):
+        response = self._get()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+
+    def test_streamed_report_holds_the_slot(self, get_report, has_permission):
+        scheduler = _scheduler()
+        with mock.patch("report.views.render_scheduler", scheduler), \
+                mock.patch("report.views.report_database"), \
+                mock.patch("report.views.run_report", return_value=iter([b"a,b\r\n", b"1,2\r\n"])):
+            response = self._get("csv")
+            self.assertEqual(scheduler.stats()["running"], 1)
+            self.assertEqual(b"".join(response.streaming_content), b"a,b\r\n1,2\r\n")
+            response.close()
+            self.assertEqual(scheduler.stats()["running"], 0)
+
+    def test_streamed_report_closed_before_iteration(self, get_report, has_permission):
+        scheduler = _scheduler()
+        with mock.patch("report.views.render_scheduler", scheduler), \
+                mock.patch("report.views.run_report", return_value=iter([b"a,b\r\n"])):
+            response = self._get("csv")
+            response.close()
+            self.assertEqual(scheduler.stats()["running"], 0)
+
+
+class StreamedReportTest(SimpleTestCase):
+    def test_released_once_when_interrupted(self):
+        scheduler = _scheduler()
+        ticket = scheduler.acquire("report", 1)
+        trace = ReportTrace("report", "csv")
+        with mock.patch("report.views.render_scheduler", scheduler), \
+                mock.patch("report.views.report_database"), \
+                mock.patch.object(trace, "finish") as finish:
+            streamed = views.StreamedReport(iter([b"a", b"b"]), "report", trace, ticket)
+            chunks = iter(streamed)
+            self.assertEqual(next(chunks), b"a")
+            self.assertEqual(scheduler.stats()["running"], 1)
+            streamed.close()
+            streamed.close()
+        self.assertEqual(scheduler.stats()["running"], 0)
+        finish.assert_called_once_with()
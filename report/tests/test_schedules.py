@@ -0,0 +1,78 @@
+import datetime
+import io
+from unittest import mock
+
+from django.core.management import call_command
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
+
+from report.models import ReportSchedule
+from report.schedules import ReportScheduleService, resolve_parameters
+
+NOW = datetime.datetime(2024, 3, 15, 10, 30)
+
+
+def _schedule(cron="0 6 * * *", name="r"):
+    return mock.Mock(spec=ReportSchedule, id=1, cron=cron, formats=["pdf"], parameters={}, is_active=True,
+                     user=mock.Mock(), last_error=None, next_run_at=None)
+
+
+@mock.patch("report.schedules.precomputed_outputs")
+@mock.patch("report.schedules.get_report_definition_version", return_value=1)
+@mock.patch("report.schedules.ReportConfig.get_report", return_value={"name": "r", "default_report": {}})
+@mock.patch("report.schedules.run_report", return_value=b"%PDF")
+class ReportScheduleServiceTest(SimpleTestCase):
+    def test_run(self, run_report, *mocks):
+        schedule = _schedule()
+        with mock.patch("report.metrics.publish"):
+            self.assertTrue(ReportScheduleService().run(schedule, NOW))
+        self.assertEqual(schedule.next_run_at, datetime.datetime(2024, 3, 16, 6, 0))
+        self.assertIsNone(schedule.last_error)
+        schedule.save.assert_called_once_with(update_fields=["last_run_at", "next_run_at", "last_error"])
+
+    def test_invalid_cron_deactivates_without_rendering(self, run_report, *mocks):
+        schedule = _schedule("0 0 31 2 *")
+        self.assertFalse(ReportScheduleService().run(schedule, NOW))
+        run_report.assert_not_called()
+        self.assertFalse(schedule.is_active)
+        self.assertIn("cron", schedule.last_error)
+        schedule.save.assert_called_once_with(update_fields=["last_run_at", "is_active", "last_error"])
+
+    def test_run_due_continues_after_a_failure(self, run_report, *mocks):
+        broken, valid = _schedule(), _schedule()
+        broken.save.side_effect = RuntimeError("database")
+        with mock.patch("report.schedules.ReportSchedule.objects.filter", return_value=[broken, valid]), \
+                mock.patch("report.metrics.publish"):
+            results = ReportScheduleService().run_due(NOW)
+        self.assertEqual(results, [(broken, False), (valid, True)])
+
+
+class RunReportSchedulesCommandTest(SimpleTestCase):
+    @mock.patch("report.management.commands.run_report_schedules.ReportScheduleService")
+    @mock.patch("report.management.commands.run_report_schedules.precomputed_outputs", mock.Mock(enabled=False))
+    def test_disabled_by_default(self, service):
+        stderr = io.StringIO()
+        call_command("run_report_schedules", stderr=stderr)
+        service.assert_not_called()
+        self.assertIn("report_schedule_output_ttl", stderr.getvalue())
+
+
+class ReportScheduleCleanTest(SimpleTestCase):
+    def test_valid_cron(self):
+        ReportSchedule(name="r", cron="*/15 * * * *").clean()
+
+    def test_invalid_cron(self):
+        for cron in ("0 0 31 2 *", "every day"):
+            with self.subTest(cron=cron), self.assertRaises(ValidationError) as context:
+                ReportSchedule(name="r", cron=cron).clean()
+            self.assertIn("cron", context.exception.message_dict)
+
+
+class ResolveParametersTest(SimpleTestCase):
+    def test_placeholders(self):
+        self.assertEqual(
+            resolve_parameters({"month": "{previous_month}", "year": "{previous_month_year}", "hf": 3},
+                               datetime.datetime(2024, 1, 10)),
+            {"month": "12", "year": "2023", "hf": 3},
+        )
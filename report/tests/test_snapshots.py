@@ -0,0 +1,64 @@
+import datetime
+import decimal
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from report.columnar import ColumnarResult
+from report.models import ReportSnapshot
+from report.snapshots import ReportSnapshotService, decode_rows, encode_rows, parameters_hash
+
+ROWS = [
+    {"id": uuid.UUID(int=1), "amount": decimal.Decimal("1.50"), "date": datetime.date(2024, 1, 31),
+     "at": datetime.datetime(2024, 1, 31, 8, 0), "name": "a"},
+    {"id": None, "amount": None, "date": None, "at": None, "name": None},
+]
+
+
+class SnapshotEncodingTest(SimpleTestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_rows(encode_rows(ROWS)), ROWS)
+
+    def test_columnar(self):
+        rows = decode_rows(encode_rows(ColumnarResult.from_rows(ROWS)), columnar=True)
+        self.assertIsInstance(rows, ColumnarResult)
+        self.assertEqual([dict(row) for row in rows], ROWS)
+
+    def test_empty(self):
+        self.assertEqual(decode_rows(encode_rows([])), [])
+
+    def test_parameters_hash(self):
+        self.assertEqual(parameters_hash("p", {"a": 1, "b": 2}), parameters_hash("p", {"b": 2, "a": 1}))
+        self.assertNotEqual(parameters_hash("p", {"a": 1}), parameters_hash("q", {"a": 1}))
+
+
+@mock.patch("report.snapshots.run_stored_proc_report", return_value=[{"value": 1}])
+class ReportSnapshotServiceTest(TestCase):
+    def setUp(self):
+        self.service = ReportSnapshotService()
+
+    def test_reused_for_the_same_version(self, run_stored_proc_report):
+        self.service.run_stored_proc_report("proc", version="v1", year=2024)
+        self.assertEqual(self.service.run_stored_proc_report("proc", version="v1", year=2024), [{"value": 1}])
+        run_stored_proc_report.assert_called_once()
+
+    def test_new_version_supersedes(self, run_stored_proc_report):
+        self.service.run_stored_proc_report("proc", version="v1", year=2024)
+        self.service.run_stored_proc_report("proc", version="v2", year=2024)
+        self.assertEqual(run_stored_proc_report.call_count, 2)
+        self.assertEqual(list(ReportSnapshot.objects.values_list("source_version", flat=True)), ["v2"])
+
+    def test_not_reused_without_version(self, run_stored_proc_report):
+        self.service.run_stored_proc_report("proc", year=2024)
+        self.service.run_stored_proc_report("proc", year=2024)
+        self.assertEqual(run_stored_proc_report.call_count, 2)
+        self.assertEqual(ReportSnapshot.objects.count(), 1)
+
+    def test_expired(self, run_stored_proc_report):
+        old = self.service.save("proc", {"year": 2023}, [{"value": 0}], "v1")
+        ReportSnapshot.objects.filter(pk=old.pk).update(created_at=timezone.now() - datetime.timedelta(days=30))
+        self.assertIsNone(self.service.find("proc", {"year": 2023}, "v1", max_age=3600))
+        self.service.save("proc", {"year": 2024}, [{"value": 1}], "v1")
+        self.assertFalse(ReportSnapshot.objects.filter(pk=old.pk).exists())
@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+
+from django.test import SimpleTestCase
+
+from report.services import ROW_NAMEDTUPLE, ROW_TUPLE, StreamedRows
+
+
+class FakeCursor(object):
+    def __init__(self, columns, rows):
+        self.description = [(column, None, None, None, None, None, None) for column in columns]
+        self.rows = list(rows)
+        self.fetches = 0
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def _executor(cursor):
+    @contextmanager
+    def execute():
+        yield cursor
+
+    return execute
+
+
+class StreamedRowsTest(SimpleTestCase):
+    def test_dict_rows_fetched_by_batches(self):
+        cursor = FakeCursor(["id", "name"], [(i, f"name {i}") for i in range(5)])
+        rows = StreamedRows(_executor(cursor), fetch_size=2)
+        self.assertEqual(list(rows)[4], {"id": 4, "name": "name 4"})
+        self.assertEqual(rows.row_count, 5)
+        self.assertFalse(rows.truncated)
+        # 3 batches and the empty one ending the result
+        self.assertEqual(cursor.fetches, 4)
+
+    def test_tuple_rows(self):
+        rows = StreamedRows(_executor(FakeCursor(["id"], [(1,), (2,)])), row_type=ROW_TUPLE)
+        self.assertEqual(list(rows), [(1,), (2,)])
+
+    def test_namedtuple_rows(self):
+        rows = list(StreamedRows(_executor(FakeCursor(["id", "class"], [(1, "a")])), row_type=ROW_NAMEDTUPLE))
+        self.assertEqual(rows[0].id, 1)
+        # invalid identifiers are renamed
+        self.assertEqual(rows[0][1], "a")
+
+    def test_max_rows(self):
+        rows = StreamedRows(_executor(FakeCursor(["id"], [(i,) for i in range(10)])), fetch_size=3, max_rows=4)
+        self.assertEqual(len(list(rows)), 4)
+        self.assertEqual(rows.row_count, 4)
+        self.assertTrue(rows.truncated)
+
+    def test_unknown_row_type(self):
+        with self.assertRaises(ValueError):
+            StreamedRows(_executor(FakeCursor([], [])), row_type="list")
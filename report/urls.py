@@ -3,6 +3,10 @@ from django.views.decorators.csrf import csrf_exempt
 from . import views
 
 urlpatterns = [
+    path("metrics", views.report_metrics, name="report_metrics"),
+    path("batch/<str:report_name>/<str:report_format>/", views.report_batch, name="report_batch"),
+    path("jobs/<uuid:job_id>/", views.report_job_status, name="report_job_status"),
+    path("jobs/<uuid:job_id>/download/", views.report_job_download, name="report_job_download"),
     path(
         "<str:report_name>/<str:report_format>/",
         views.report,
@@ -1,24 +1,39 @@
 import io
 import json
 import logging
-import os
-import tempfile
+import re
+import uuid
 
 from django.contrib.staticfiles import finders
-from django.http import Http404, HttpResponse, HttpResponseBadRequest, FileResponse
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, FileResponse, JsonResponse,
+    StreamingHttpResponse,
+)
 from django.template import loader
+from django.urls import reverse
 from django.utils.translation import gettext as _
 from django.views.decorators.clickjacking import xframe_options_exempt
 from reportbro import Report, ReportBroError
 from rest_framework.decorators import api_view
 from rest_framework.exceptions import PermissionDenied
 
-from report.services import generate_report, get_report_definition
+from report.services import generate_report, get_report_definition_version, has_report_permission, run_report
 
 from .apps import ReportConfig
+from .batch import OUTPUT_MERGED_PDF, OUTPUT_ZIP, BatchReportService
+from .downloads import download_response, streaming_download_response
+from .export import FORMAT_CONTENT_TYPES, STREAM_FORMATS, report_extension
+from .jobs import ReportJobService
+from .metrics import ReportTrace, prometheus_exporter, report_trace
+from .models import ReportJob
+from .output_cache import precomputed_outputs, preview_store, report_output_cache
+from .routing import report_database
+from .scheduler import RenderRejected, render_scheduler
 
 logger = logging.getLogger(__file__)
 
+PREVIEW_KEY_RE = re.compile(r"^[0-9a-f]{32}\.(pdf|xlsx)$")
+
 
 @api_view(["GET"])
 def report(request, report_name, report_format="pdf", alternate=None):
@@ -26,7 +41,7 @@ def report(request, report_name, report_format="pdf", alternate=None):
     Run a report
     :param request: Predefined by Django
     :param report_name: Report name within the module
-    :param report_format: pdf (default) or xlsx
+    :param report_format: pdf (default), xlsx or, for single table reports, xlsx-stream or csv
     :param alternate: Future use, allows several templates for a single report: different languages or report variants
     :return: view
     """
@@ -40,14 +55,7 @@ def report(request, report_name, report_format="pdf", alternate=None):
     if not report_config:
         logger.INFO("I got here 1S")
         raise Http404("Poll does not exist")
-    report_definition = get_report_definition(
-        report_name, report_config["default_report"]
-    )
-    if (
-        report_config.get("permission")
-        and not request.user.has_perms(ReportConfig.gql_query_report_perms)
-        and not request.user.has_perms(report_config.get("permission"))
-    ):
+    if not has_report_permission(request.user, report_config):
         raise PermissionDenied(_("unauthorized"))
 
     # parameters tend to get put in lists because they *could* be repeated
@@ -56,17 +64,203 @@ def report(request, report_name, report_format="pdf", alternate=None):
         for k, v in request.GET.items()
     }
 
-    data = report_config["python_query"](request.user, **unlisted)
+    if unlisted.pop("async", None) in ("1", "true"):
+        job = ReportJobService(request.user).submit(report_name, report_format, unlisted)
+        return JsonResponse(_report_job_status(request, job), status=202)
+
+    filename = f"{report_name}.{report_extension(report_format)}"
+    cache_key = None
+    caches = [cache for cache in (precomputed_outputs, report_output_cache) if cache.enabled]
+    if caches and report_format not in STREAM_FORMATS:
+        definition_version = get_report_definition_version(report_name, report_config["default_report"])
+        # pre-rendered outputs of the report schedules first, then the outputs generated on request
+        for cache in caches:
+            cache_key = cache.key(request.user, report_name, report_format, definition_version, unlisted)
+            cached = cache.get(cache_key)
+            if cached:
+                return download_response(request, cached, filename, report_format)
+        if not report_output_cache.enabled:
+            cache_key = None
+
+    try:
+        if report_format in STREAM_FORMATS:
+            return _streamed_report(request, report_config, report_format, unlisted, filename)
+        with report_trace(report_name, report_format) as trace:
+            with render_scheduler.slot(report_config, request.user.id):
+                generated_report = run_report(request.user, report_config, report_format, unlisted)
+    except RenderRejected as exc:
+        response = JsonResponse({"error": str(exc)}, status=exc.status)
+        response["Retry-After"] = str(exc.retry_after)
+        return response
+    if cache_key:
+        report_output_cache.set(cache_key, generated_report)
+    # without the output cache, a request for a range would generate another document
+    response = download_response(request, generated_report, filename, report_format, ranges=bool(cache_key))
+    response["Server-Timing"] = trace.server_timing()
+    return response
+
+
+class StreamedReport(object):
+    """
+    Chunks of a xlsx-stream or csv report, the rows are read and written while the response is sent: the render
+    slot is held, and the report trace and database are active, until the chunks are exhausted or the response is
+    closed
+    """
+
+    def __init__(self, chunks, report_name, trace, ticket):
+        self.chunks = chunks
+        self.report_name = report_name
+        self.trace = trace
+        self.ticket = ticket
+        self._iterator = None
+        self._released = False
+
+    def __iter__(self):
+        self._iterator = self._iterate()
+        return self._iterator
+
+    def _iterate(self):
+        try:
+            with self.trace.activate(), report_database(self.report_name):
+                yield from self.chunks
+        except Exception as exc:
+            self.trace.error = type(exc).__name__
+            raise
+        finally:
+            self._release()
+
+    def close(self):
+        if self._iterator is not None:
+            # runs the finally of an iteration in progress
+            self._iterator.close()
+        self._release()
 
-    return FileResponse(
-        io.BytesIO(
-            generate_report(
-                report_name,
-                report_definition,
-                data,
-                report_format,
+    def _release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            close = getattr(self.chunks, "close", None)
+            if close:
+                close()
+        finally:
+            render_scheduler.release(self.ticket)
+            self.trace.finish()
+
+
+def _streamed_report(request, report_config, report_format, params, filename):
+    report_name = report_config["name"]
+    trace = ReportTrace(report_name, report_format)
+    ticket = None
+    try:
+        with trace.activate():
+            ticket = render_scheduler.acquire(
+                report_name, request.user.id, heavy=render_scheduler.is_heavy(report_config)
             )
-        ), filename=f"{report_name}.{report_format}", as_attachment=False
+            chunks = run_report(request.user, report_config, report_format, params)
+    except BaseException as exc:
+        trace.error = type(exc).__name__
+        if ticket is not None:
+            render_scheduler.release(ticket)
+        trace.finish()
+        raise
+    response = streaming_download_response(
+        request, StreamedReport(chunks, report_name, trace, ticket), filename, report_format
+    )
+    response["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@api_view(["GET"])
+def report_metrics(request):
+    """
+    Prometheus text exporter of the report pipeline metrics of this process, enabled by report_metrics_exporter,
+    for the users with report_metrics_perms
+    """
+    if not ReportConfig.report_metrics_exporter:
+        raise Http404("Report metrics are disabled")
+    if not request.user.has_perms(ReportConfig.report_metrics_perms):
+        raise PermissionDenied(_("unauthorized"))
+    return HttpResponse(prometheus_exporter.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api_view(["POST"])
+def report_batch(request, report_name, report_format="pdf"):
+    """
+    Run a report for many parameter sets, the JSON body is {"parameters": [{...}, ...], "output": "zip" or "pdf"}
+    :return: a streamed ZIP archive with one output per parameter set, or a single merged PDF
+    """
+    report_config = ReportConfig.get_report(report_name)
+    if not report_config:
+        raise Http404("Report does not exist")
+    if not has_report_permission(request.user, report_config):
+        raise PermissionDenied(_("unauthorized"))
+    parameter_sets = request.data.get("parameters")
+    if not isinstance(parameter_sets, list) or not parameter_sets \
+            or not all(isinstance(params, dict) for params in parameter_sets):
+        return HttpResponseBadRequest("parameters must be a non empty list of objects")
+    if len(parameter_sets) > ReportConfig.report_batch_max_size:
+        return HttpResponseBadRequest(f"at most {ReportConfig.report_batch_max_size} parameter sets per batch")
+
+    service = BatchReportService(request.user)
+    output = request.data.get("output", OUTPUT_ZIP)
+    if output == OUTPUT_MERGED_PDF:
+        if report_format != "pdf":
+            return HttpResponseBadRequest("only pdf reports can be merged")
+        try:
+            merged = service.merged_pdf(report_config, parameter_sets)
+        except ReportBroError as exc:
+            return HttpResponseBadRequest(exc.error)
+        return FileResponse(io.BytesIO(merged), filename=f"{report_name}.pdf", as_attachment=False)
+    if output != OUTPUT_ZIP:
+        return HttpResponseBadRequest("output must be zip or pdf")
+    response = StreamingHttpResponse(
+        service.iter_zip(report_config, report_format, parameter_sets), content_type="application/zip"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{report_name}.zip"'
+    return response
+
+
+def _report_job_status(request, job):
+    status = {
+        "id": str(job.id),
+        "name": job.name,
+        "format": job.report_format,
+        "status": job.get_status_display().lower(),
+        "error": job.error,
+        "requested_at": job.requested_at,
+        "finished_at": job.finished_at,
+        "status_url": request.build_absolute_uri(reverse("report_job_status", args=[job.id])),
+    }
+    if job.status == ReportJob.STATUS_SUCCESS:
+        status["download_url"] = request.build_absolute_uri(reverse("report_job_download", args=[job.id]))
+    return status
+
+
+@api_view(["GET"])
+def report_job_status(request, job_id):
+    """
+    Status of a report submitted with ?async=1
+    """
+    job = ReportJobService(request.user).get(job_id)
+    if not job:
+        raise Http404("Report job does not exist")
+    return JsonResponse(_report_job_status(request, job))
+
+
+@api_view(["GET"])
+def report_job_download(request, job_id):
+    """
+    Output of a report submitted with ?async=1, once its status is success
+    """
+    service = ReportJobService(request.user)
+    job = service.get(job_id)
+    output = service.output(job) if job else None
+    if not output:
+        raise Http404("Report output does not exist or expired")
+    return download_response(
+        request, output, f"{job.name}.{report_extension(job.report_format)}", job.report_format,
+        last_modified=job.finished_at.timestamp() if job.finished_at else None,
     )
 
 
@@ -105,10 +299,12 @@ def reportbro_previewer(request):
         data = json_data.get('data')
         is_test_data = json_data.get('isTestData')
         try:
-            temp_file=tempfile.NamedTemporaryFile(delete=False)
-            key = os.path.basename(temp_file.name)
-            generate_report("preview", report_definition, data, output_format,
-                            local_file=temp_file.name, is_test_data=is_test_data)
+            key = f"{uuid.uuid4().hex}.{output_format}"
+            preview_store.write(
+                key,
+                lambda path: generate_report("preview", report_definition, data, output_format,
+                                             local_file=path, is_test_data=is_test_data)
+            )
             return HttpResponse('key:'+key)
         except ReportBroError as e:
             logger.exception(e.error)
@@ -144,11 +340,19 @@ def reportbro_previewer(request):
                     )
                 ), filename=f"preview.{output_format}", as_attachment=False
             )
+        if not PREVIEW_KEY_RE.match(key):
+            return HttpResponseBadRequest('invalid key')
         try:
-            with open(os.path.join(tempfile.gettempdir(), key), 'rb') as f:
-                response = HttpResponse(f.read(), content_type='application/pdf')
-                response['Content-Disposition'] = 'inline; filename="report_preview.pdf"'
-                return response
+            preview = preview_store.get(key)
+            if not preview:
+                raise Http404("Preview does not exist or expired")
+            preview_format = key.rsplit(".", 1)[1]
+            return FileResponse(
+                preview, content_type=FORMAT_CONTENT_TYPES[preview_format],
+                filename=f"report_preview.{preview_format}", as_attachment=False
+            )
+        except Http404:
+            raise
         except Exception as e:
             logger.exception(e)
             return HttpResponseBadRequest('failed to generate report: ' + str(e))
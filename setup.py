@@ -28,6 +28,10 @@ setup(
         "reportbro-lib",
         "reportbro-fpdf",
     ],
+    extras_require={
+        "pdf-merge": ["pypdf"],
+        "aggregation": ["numpy"],
+    },
     classifiers=[
         "Environment :: Web Environment",
         "Framework :: Django",